@@ -1,13 +1,83 @@
+import asyncio
+import difflib
+import hashlib
+import logging
 import os
-import openai
-from dotenv import load_dotenv
+import random
+import time
+
+import httpx
+
+import config  # carga .env antes de leer las variables
+import db
+import db_async
+import metrics
+from cache import LRUTTLCache
+from intents import IntentClassifier
+from text import NORMALIZATION_VERSION, exact_terms, normalize_question
+
+logger = logging.getLogger(__name__)
 
-# Cargar variables de entorno
-load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# URL base alternativa (por ejemplo un servidor stub local para pruebas)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_MODEL = "gpt-3.5-turbo"
+
+# Límites del cliente de OpenAI
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "15"))
+AI_MAX_CONCURRENT = int(os.getenv("AI_MAX_CONCURRENT", "10"))
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "2"))
+AI_BACKOFF_BASE = 0.5
+AI_BACKOFF_MAX = 8.0
+# Respuestas generales como flujo de fragmentos (0 espera la respuesta completa)
+AI_STREAMING = os.getenv("AI_STREAMING", "1") == "1"
+
+# Caché de respuestas para preguntas generales
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "1") == "1"
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "500"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "21600"))
+# Similitud mínima para reutilizar la respuesta de una pregunta parecida (0 desactiva)
+AI_CACHE_FUZZY = float(os.getenv("AI_CACHE_FUZZY", "0.9"))
+# Preguntas en caché (las más recientes) que se comparan en la búsqueda aproximada
+AI_CACHE_FUZZY_CANDIDATES = int(os.getenv("AI_CACHE_FUZZY_CANDIDATES", "100"))
+AI_CACHE_PERSIST = os.getenv("AI_CACHE_PERSIST", "1") == "1"
+
+RESPUESTA_ERROR = "Lo siento, no puedo responder esa consulta en este momento. Por favor, intenta más tarde."
+# Último fragmento de un flujo que se cortó después de mostrar parte del texto
+RESPUESTA_INTERRUMPIDA = "\n\n(respuesta interrumpida)"
+
+_client = None
+_semaforo = None
+# Consulta en curso por usuario, para cancelarla si el usuario sigue con otra cosa
+_en_curso = {}
+# Consultas a la API en curso por (pregunta normalizada, contexto, modo)
+_vuelos = {}
 
-# Configurar la API de OpenAI
-openai.api_key = OPENAI_API_KEY
+_respuestas = LRUTTLCache(AI_CACHE_SIZE, AI_CACHE_TTL)
+# Hash del BANKING_CONTEXT con el que se llenó la caché
+_cache_contexto = None
+_cache_stats = {"fuzzy_hits": 0, "invalidations": 0}
+
+AI_RESPONSE_SECONDS = metrics.histogram(
+    "ai_response_seconds", "Duración de get_ai_response (incluye caché)", ("function",))
+AI_COMPLETION_SECONDS = metrics.histogram(
+    "ai_completion_seconds", "Duración de cada llamada a la API de OpenAI")
+AI_IMPORT_SECONDS = metrics.histogram(
+    "ai_import_seconds", "Importación del paquete openai")
+AI_TTFB_SECONDS = metrics.histogram(
+    "ai_ttfb_seconds", "Tiempo hasta el primer fragmento de la respuesta en modo streaming", ("source",))
+AI_CACHE_LOOKUPS = metrics.counter(
+    "ai_cache_lookups_total", "Búsquedas en la caché de respuestas", ("result",))
+AI_ERRORS = metrics.counter(
+    "ai_errors_total", "Errores de la API de OpenAI", ("type",))
+AI_RETRIES = metrics.counter(
+    "ai_retries_total", "Reintentos de llamadas a la API de OpenAI")
+AI_COALESCED = metrics.counter(
+    "ai_coalesced_total", "Consultas que se sumaron a una consulta idéntica en curso")
+AI_CANCELLED = metrics.counter(
+    "ai_cancelled_total", "Consultas canceladas por un mensaje nuevo del usuario")
+INTENTS = metrics.counter(
+    "bot_intents_total", "Mensajes clasificados por intención", ("intent",))
 
 # Contexto para preguntas bancarias
 BANKING_CONTEXT = """
@@ -32,58 +102,454 @@ Da respuestas concisas y claras. Si no estás seguro de algo, indica que consult
 """
 
 
-async def get_ai_response(user_message):
+def _errores_reintentables():
+    """Errores transitorios que vale la pena reintentar"""
+    import openai
+    return (
+        openai.APIConnectionError,  # incluye APITimeoutError
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+
+def preload():
+    """Importar openai de antemano (por ejemplo en un hilo al arrancar)"""
+    with AI_IMPORT_SECONDS.time():
+        import openai  # se guarda en sys.modules
+
+
+def get_client():
+    """Cliente asíncrono de OpenAI compartido (pool de conexiones HTTP)"""
+    global _client
+    if _client is None:
+        # El paquete openai tarda en importarse; se carga recién con la primera
+        # consulta general (o con preload() una vez que el bot está listo)
+        import openai
+        _client = openai.AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            timeout=AI_TIMEOUT,
+            max_retries=0,  # los reintentos los manejamos nosotros
+            http_client=httpx.AsyncClient(
+                timeout=AI_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=AI_MAX_CONCURRENT,
+                    max_keepalive_connections=AI_MAX_CONCURRENT
+                )
+            )
+        )
+    return _client
+
+
+async def close_client():
+    """Cerrar el cliente y sus conexiones al apagar el bot"""
+    global _client, _semaforo
+    if _client is not None:
+        await _client.close()
+        _client = None
+    _semaforo = None
+
+
+def _get_semaforo():
+    global _semaforo
+    if _semaforo is None:
+        _semaforo = asyncio.Semaphore(AI_MAX_CONCURRENT)
+    return _semaforo
+
+
+def _backoff(intento):
+    """Espera exponencial con jitter completo"""
+    return random.uniform(0, min(AI_BACKOFF_MAX, AI_BACKOFF_BASE * 2 ** intento))
+
+
+def _parametros(user_message):
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": BANKING_CONTEXT},
+            {"role": "user", "content": user_message}
+        ],
+        "max_tokens": 200,
+        "temperature": 0.7,
+    }
+
+
+async def _completar(user_message):
+    """Llamada a la API con límite de concurrencia y reintentos"""
+    for intento in range(AI_MAX_RETRIES + 1):
+        try:
+            async with _get_semaforo():
+                with AI_COMPLETION_SECONDS.time():
+                    response = await get_client().chat.completions.create(
+                        **_parametros(user_message))
+            return response.choices[0].message.content
+        except _errores_reintentables() as e:
+            if intento == AI_MAX_RETRIES:
+                raise
+            AI_RETRIES.inc()
+            logger.warning("Reintentando la llamada a OpenAI (%s): %s", intento + 1, e)
+            await asyncio.sleep(_backoff(intento))
+
+
+async def _completar_en_flujo(user_message, entregar):
+    """
+    Como _completar, pero pasa cada fragmento de texto a entregar() apenas llega
+
+    Sólo se reintenta si el error ocurre antes del primer fragmento; después
+    el usuario ya vio parte de la respuesta.
+    """
+    for intento in range(AI_MAX_RETRIES + 1):
+        recibido = False
+        try:
+            async with _get_semaforo():
+                with AI_COMPLETION_SECONDS.time():
+                    stream = await get_client().chat.completions.create(
+                        **_parametros(user_message), stream=True)
+                    try:
+                        async for chunk in stream:
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                recibido = True
+                                entregar(chunk.choices[0].delta.content)
+                    finally:
+                        await stream.close()
+            return
+        except _errores_reintentables() as e:
+            if recibido or intento == AI_MAX_RETRIES:
+                raise
+            AI_RETRIES.inc()
+            logger.warning("Reintentando la llamada a OpenAI (%s): %s", intento + 1, e)
+            await asyncio.sleep(_backoff(intento))
+
+
+def _hash_contexto():
+    return hashlib.sha1(f"{NORMALIZATION_VERSION}:{BANKING_CONTEXT}".encode()).hexdigest()[:16]
+
+
+async def _preparar_cache():
+    """Invalida la caché si cambió BANKING_CONTEXT o la normalización y la precarga desde la base"""
+    global _cache_contexto
+    contexto = _hash_contexto()
+    if contexto == _cache_contexto:
+        return contexto
+
+    _respuestas.clear()
+    if _cache_contexto is not None:
+        _cache_stats["invalidations"] += 1
+    _cache_contexto = contexto
+
+    if AI_CACHE_PERSIST:
+        await db_async.run(db.delete_cached_responses, contexto)
+        ahora = time.time()
+        filas = await db_async.run(
+            db.load_cached_responses, contexto, ahora - AI_CACHE_TTL)
+        for clave, respuesta, creado in filas:
+            _respuestas.set(clave, respuesta, ttl=AI_CACHE_TTL - (ahora - creado))
+    return contexto
+
+
+def _buscar_en_cache(clave):
+    """
+    Busca la pregunta normalizada y, si no está, la más parecida
+
+    Sólo se comparan preguntas con los mismos números y negaciones
+    (exact_terms), y como mucho AI_CACHE_FUZZY_CANDIDATES, así la búsqueda
+    no recorre toda la caché en el event loop.
+    """
+    respuesta = _respuestas.get(clave)
+    if respuesta is not None:
+        AI_CACHE_LOOKUPS.inc("hit")
+        return respuesta
+    if AI_CACHE_FUZZY > 0:
+        terminos = exact_terms(clave)
+        candidatas = []
+        for otra in reversed(_respuestas.keys()):
+            if exact_terms(otra) == terminos:
+                candidatas.append(otra)
+                if len(candidatas) >= AI_CACHE_FUZZY_CANDIDATES:
+                    break
+        parecidas = difflib.get_close_matches(
+            clave, candidatas, n=1, cutoff=AI_CACHE_FUZZY)
+        if parecidas:
+            respuesta = _respuestas.get(parecidas[0])
+            if respuesta is not None:
+                _cache_stats["fuzzy_hits"] += 1
+                AI_CACHE_LOOKUPS.inc("fuzzy_hit")
+                return respuesta
+    AI_CACHE_LOOKUPS.inc("miss")
+    return None
+
+
+def get_cache_stats():
+    """Contadores de la caché de respuestas (los hits incluyen los fuzzy_hits)"""
+    return {**_respuestas.stats(), **_cache_stats}
+
+
+def cancel_ai_response(user_id):
+    """Cancelar la consulta en curso de un usuario, si la hay"""
+    tarea = _en_curso.pop(user_id, None)
+    if tarea is not None and tarea.cancel():
+        AI_CANCELLED.inc()
+
+
+class _Vuelo:
+    """Consulta a OpenAI en curso, compartida por quienes hacen la misma pregunta"""
+    __slots__ = ("tarea", "esperando", "partes", "oyentes")
+
+    def __init__(self):
+        self.tarea = None
+        self.esperando = 0
+        self.partes = []     # fragmentos recibidos (modo streaming)
+        self.oyentes = set()  # colas de quienes leen el flujo
+
+    def entregar(self, fragmento):
+        self.partes.append(fragmento)
+        for cola in self.oyentes:
+            cola.put_nowait(fragmento)
+
+    def suscribir(self):
+        """Cola con los fragmentos ya recibidos y los que lleguen; termina con None"""
+        cola = asyncio.Queue()
+        for fragmento in self.partes:
+            cola.put_nowait(fragmento)
+        self.oyentes.add(cola)
+        return cola
+
+    def cerrar(self):
+        for cola in self.oyentes:
+            cola.put_nowait(None)
+        self.oyentes.clear()
+
+
+def _clave_vuelo(user_message, clave, en_flujo):
+    return (clave or user_message, _hash_contexto(), en_flujo)
+
+
+def _unirse(clave_vuelo, consulta):
+    """
+    Sumarse a la consulta idéntica en curso o iniciar una nueva
+
+    Args:
+        clave_vuelo: (pregunta normalizada, hash del contexto, modo)
+        consulta: Función (vuelo) -> corrutina que consulta a OpenAI
+    """
+    vuelo = _vuelos.get(clave_vuelo)
+    if vuelo is None or vuelo.tarea.cancelled():
+        vuelo = _vuelos[clave_vuelo] = _Vuelo()
+        vuelo.tarea = asyncio.ensure_future(consulta(vuelo))
+
+        def terminar(tarea):
+            if _vuelos.get(clave_vuelo) is vuelo:
+                del _vuelos[clave_vuelo]
+            vuelo.cerrar()
+            if not tarea.cancelled():
+                tarea.exception()  # ya registrada en el log por la consulta
+
+        vuelo.tarea.add_done_callback(terminar)
+    else:
+        AI_COALESCED.inc()
+    vuelo.esperando += 1
+    return vuelo
+
+
+def _dejar(clave_vuelo, vuelo):
+    """Si ya nadie espera la consulta, se cancela"""
+    vuelo.esperando -= 1
+    if vuelo.esperando == 0 and not vuelo.tarea.done():
+        if _vuelos.get(clave_vuelo) is vuelo:
+            del _vuelos[clave_vuelo]
+        vuelo.tarea.cancel()
+
+
+async def _consultar(vuelo, user_message, clave, contexto):
+    """Consulta compartida: errores en el log una sola vez y respuesta a la caché"""
+    try:
+        respuesta = await _completar(user_message)
+    except Exception as e:
+        AI_ERRORS.inc(type(e).__name__)
+        logger.error("Error con OpenAI: %s", e)
+        raise
+    if clave:
+        await _guardar_en_cache(clave, contexto, respuesta)
+    return respuesta
+
+
+async def _consultar_en_flujo(vuelo, user_message, clave, contexto):
+    try:
+        await _completar_en_flujo(user_message, vuelo.entregar)
+    except Exception as e:
+        AI_ERRORS.inc(type(e).__name__)
+        logger.error("Error con OpenAI: %s", e)
+        raise
+    if clave and vuelo.partes:
+        await _guardar_en_cache(clave, contexto, "".join(vuelo.partes))
+
+
+async def _esperar_respuesta(clave_vuelo, user_message, clave, contexto):
+    vuelo = _unirse(
+        clave_vuelo, lambda vuelo: _consultar(vuelo, user_message, clave, contexto))
+    try:
+        # shield: cancelar a uno que espera no cancela la consulta de los demás
+        return await asyncio.shield(vuelo.tarea)
+    finally:
+        _dejar(clave_vuelo, vuelo)
+
+
+@metrics.timed(AI_RESPONSE_SECONDS)
+async def get_ai_response(user_message, user_id=None):
     """
     Obtiene una respuesta de la API de OpenAI para consultas bancarias
 
+    Las consultas simultáneas con la misma pregunta normalizada (y el mismo
+    BANKING_CONTEXT) comparten una única llamada a la API.
+
     Args:
         user_message: Mensaje del usuario
+        user_id: Usuario que consulta; una nueva consulta suya cancela la anterior
 
     Returns:
-        str: Respuesta del asistente
+        str: Respuesta del asistente, o None si la consulta fue cancelada
     """
+    if user_id is not None:
+        cancel_ai_response(user_id)
+
+    contexto = None
+    clave = normalize_question(user_message)
+    if AI_CACHE_ENABLED:
+        contexto = await _preparar_cache()
+        if clave:
+            respuesta = _buscar_en_cache(clave)
+            if respuesta is not None:
+                return respuesta
+
+    tarea = asyncio.ensure_future(_esperar_respuesta(
+        _clave_vuelo(user_message, clave, False), user_message,
+        clave if AI_CACHE_ENABLED else None, contexto))
+    if user_id is not None:
+        _en_curso[user_id] = tarea
+
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": BANKING_CONTEXT},
-                {"role": "user", "content": user_message}
-            ],
-            max_tokens=200,
-            temperature=0.7
-        )
-        return response['choices'][0]['message']['content']
-    except Exception as e:
-        print(f"Error con OpenAI: {e}")
-        return "Lo siento, no puedo responder esa consulta en este momento. Por favor, intenta más tarde."
+        # asyncio.wait no propaga la cancelación de la tarea interna
+        await asyncio.wait({tarea})
+    except asyncio.CancelledError:
+        tarea.cancel()
+        raise
+    finally:
+        if user_id is not None and _en_curso.get(user_id) is tarea:
+            del _en_curso[user_id]
 
+    if tarea.cancelled():
+        return None
+    if tarea.exception() is not None:
+        return RESPUESTA_ERROR
+    return tarea.result()
 
-async def detect_intent(message):
+
+async def _guardar_en_cache(clave, contexto, respuesta):
+    _respuestas.set(clave, respuesta)
+    if AI_CACHE_PERSIST:
+        await db_async.run(db.save_cached_response, clave, contexto, respuesta)
+
+
+async def stream_ai_response(user_message, user_id=None):
     """
-    Detecta la intención del usuario basada en su mensaje
+    Versión en flujo de get_ai_response: genera fragmentos de la respuesta
+
+    Una respuesta en caché sale como un único fragmento, y quien se suma a
+    una consulta idéntica en curso recibe primero lo que ya llegó. Si la
+    consulta se cancela (cancel_ai_response o un mensaje nuevo del usuario)
+    el generador termina sin más fragmentos; ante un error sin texto previo
+    genera RESPUESTA_ERROR. Si ya había generado texto, tanto la cancelación
+    como el error cierran el flujo con RESPUESTA_INTERRUMPIDA.
+
+    Args:
+        user_message: Mensaje del usuario
+        user_id: Usuario que consulta; una nueva consulta suya cancela la anterior
+    """
+    inicio = time.perf_counter()
+    if user_id is not None:
+        cancel_ai_response(user_id)
+
+    contexto = None
+    clave = normalize_question(user_message)
+    if AI_CACHE_ENABLED:
+        contexto = await _preparar_cache()
+        if clave:
+            respuesta = _buscar_en_cache(clave)
+            if respuesta is not None:
+                AI_TTFB_SECONDS.observe(time.perf_counter() - inicio, "cache")
+                AI_RESPONSE_SECONDS.observe(time.perf_counter() - inicio, "stream_ai_response")
+                yield respuesta
+                return
+
+    clave_vuelo = _clave_vuelo(user_message, clave, True)
+    clave_cache = clave if AI_CACHE_ENABLED else None
+    vuelo = _unirse(clave_vuelo, lambda vuelo: _consultar_en_flujo(
+        vuelo, user_message, clave_cache, contexto))
+    cola = vuelo.suscribir()
+
+    # Cancelar este futuro corta la lectura de este usuario, no la consulta compartida
+    baja = asyncio.get_running_loop().create_future()
+    baja.add_done_callback(lambda _: cola.put_nowait(None))
+    if user_id is not None:
+        _en_curso[user_id] = baja
+
+    recibidos = 0
+    try:
+        while True:
+            fragmento = await cola.get()
+            if fragmento is None:
+                break
+            if not recibidos:
+                AI_TTFB_SECONDS.observe(time.perf_counter() - inicio, "api")
+            recibidos += 1
+            yield fragmento
+    finally:
+        vuelo.oyentes.discard(cola)
+        _dejar(clave_vuelo, vuelo)
+        if user_id is not None and _en_curso.get(user_id) is baja:
+            del _en_curso[user_id]
+        AI_RESPONSE_SECONDS.observe(time.perf_counter() - inicio, "stream_ai_response")
+
+    cancelada = baja.cancelled() or not vuelo.tarea.done() or vuelo.tarea.cancelled()
+    if not cancelada and vuelo.tarea.exception() is None:
+        return
+    if recibidos:
+        yield RESPUESTA_INTERRUMPIDA
+    elif not cancelada:
+        yield RESPUESTA_ERROR
+
+
+# Clasificador de intenciones; puede reemplazarse por cualquier objeto con classify()
+intent_classifier = IntentClassifier()
+
+
+async def classify_intent(message):
+    """
+    Clasifica el mensaje del usuario en una sola pasada
 
     Args:
         message: Mensaje del usuario
 
     Returns:
-        str: Intención detectada
+        Intencion: intención, confianza y entidades (monto, plazo)
     """
-    message = message.lower()
+    resultado = intent_classifier.classify(message)
+    INTENTS.inc(resultado.intent)
+    return resultado
 
-    # Detectar intenciones relacionadas con saldo
-    if any(word in message for word in ['saldo', 'tengo', 'cuánto', 'cuenta', 'disponible']):
-        return "saldo"
 
-    # Detectar intenciones relacionadas con movimientos
-    if any(word in message for word in ['movimientos', 'transacciones', 'gastos', 'últimos', 'recientes']):
-        return "movimientos"
+async def detect_intent(message):
+    """
+    Detecta la intención del usuario basada en su mensaje
 
-    # Detectar intenciones relacionadas con préstamos
-    if any(word in message for word in ['préstamo', 'crédito', 'solicitar', 'pedir', 'necesito dinero']):
-        return "prestamo"
+    Args:
+        message: Mensaje del usuario
 
-    # Si no se detecta una intención específica, usar la IA
-    return "general"
+    Returns:
+        str: Intención detectada
+    """
+    resultado = await classify_intent(message)
+    return resultado.intent
 
 
 async def get_ai(user_message):
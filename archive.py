@@ -0,0 +1,411 @@
+"""
+Archivo en frío del historial de movimientos y préstamos
+
+movimientos y prestamos sólo crecen. Este módulo mueve las filas con fecha
+anterior al horizonte (ARCHIVE_HORIZON_DAYS, redondeado al inicio del mes) a
+una base SQLite por mes, data/archivo/AAAA-MM.db, registrada en la tabla
+particiones. db.get_transactions_page, ledger.balance_at, el importador y
+loan_batch.reprice_saved_loans leen la base caliente y las particiones juntas.
+
+Se trabaja en línea y por lotes chicos: cada lote se copia y confirma primero
+en la partición y recién después se borra de la base caliente en una
+transacción corta, con una pausa entre lotes para no frenar al bot. Quien lee
+la base caliente antes que las particiones nunca pierde una fila; a lo sumo
+la ve dos veces y la descarta por id. El rango de ids del lote en curso se
+anota en particiones antes de copiarlo: si la corrida se corta, la siguiente
+termina sólo ese lote.
+
+Sólo se archivan movimientos ya auditados por ledger.py (id <= cursor del
+auditor): el saldo de cada usuario queda cubierto por sus checkpoints.
+
+Uso:
+    python archive.py                        # archivar con ARCHIVE_HORIZON_DAYS
+    python archive.py --horizonte-dias 90
+    python archive.py --dry-run              # sólo contar filas por mes
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+
+import db
+import ledger
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Antigüedad en días a partir de la cual una fila pasa al archivo
+ARCHIVE_HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "365"))
+# Directorio de las particiones, relativo al directorio de DB_PATH
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archivo")
+# Filas por transacción en la base caliente y pausa entre lotes (segundos)
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "2000"))
+ARCHIVE_BATCH_PAUSE = float(os.getenv("ARCHIVE_BATCH_PAUSE", "0.05"))
+# Segundos entre corridas en segundo plano dentro del bot (0 las desactiva)
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "0"))
+
+# Columnas que se copian de cada tabla (id incluido, así no cambia al archivar)
+COLUMNAS = {
+    "movimientos": ("id", "user_id", "descripcion", "monto_centavos", "fecha", "ref_externa"),
+    "prestamos": ("id", "user_id", "monto_centavos", "plazo", "tasa",
+                  "cuota_centavos", "total_centavos", "fecha"),
+}
+
+# Ids por consulta IN al buscar filas ya copiadas
+LOTE_IDS = 500
+
+ESQUEMA_PARTICION = (
+    '''CREATE TABLE IF NOT EXISTS movimientos (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        descripcion TEXT,
+        monto_centavos INTEGER NOT NULL,
+        fecha INTEGER NOT NULL,
+        ref_externa TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS prestamos (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        monto_centavos INTEGER,
+        plazo INTEGER,
+        tasa REAL,
+        cuota_centavos INTEGER,
+        total_centavos INTEGER,
+        fecha INTEGER NOT NULL
+    )''',
+    '''CREATE INDEX IF NOT EXISTS idx_movimientos_usuario_fecha
+    ON movimientos (user_id, fecha DESC, id DESC)''',
+    '''CREATE UNIQUE INDEX IF NOT EXISTS idx_movimientos_ref_externa
+    ON movimientos (ref_externa) WHERE ref_externa IS NOT NULL''',
+)
+
+ARCHIVE_ROWS = metrics.counter(
+    "archive_rows_total", "Filas movidas de la base caliente al archivo", ("table",))
+ARCHIVE_LOCK_SECONDS = metrics.histogram(
+    "archive_batch_lock_seconds", "Duración de cada transacción de borrado en la base caliente")
+
+
+def _inicio_de_mes(fecha):
+    """Epoch del inicio del mes (hora local) que contiene `fecha`"""
+    dia = datetime.fromtimestamp(fecha)
+    return int(datetime(dia.year, dia.month, 1).timestamp())
+
+
+def _mes_siguiente(desde):
+    dia = datetime.fromtimestamp(desde)
+    anio, mes = (dia.year + 1, 1) if dia.month == 12 else (dia.year, dia.month + 1)
+    return int(datetime(anio, mes, 1).timestamp())
+
+
+def _filtro(tabla, tope_id):
+    """Condición extra y parámetros: movimientos sólo hasta el último auditado"""
+    if tabla == "movimientos":
+        return " AND id <= ?", (tope_id,)
+    return "", ()
+
+
+def _particion(conn, fecha):
+    """Crear (si hace falta) la partición del mes de `fecha` y registrarla en el catálogo"""
+    desde = _inicio_de_mes(fecha)
+    mes = datetime.fromtimestamp(desde).strftime("%Y-%m")
+    particion = db.Particion(mes, os.path.join(ARCHIVE_DIR, f"{mes}.db"), desde, _mes_siguiente(desde))
+
+    ruta = db.partition_path(particion.archivo)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with closing(sqlite3.connect(ruta, timeout=db.POOL_TIMEOUT)) as archivo:
+        for sql in ESQUEMA_PARTICION:
+            archivo.execute(sql)
+        archivo.commit()
+
+    # El catálogo se confirma antes de borrar la primera fila de la base caliente
+    conn.execute(
+        'INSERT INTO particiones (mes, archivo, desde, hasta, actualizado) VALUES (?, ?, ?, ?, ?) '
+        'ON CONFLICT (mes) DO NOTHING',
+        (*particion, db.ahora())
+    )
+    conn.commit()
+    return particion
+
+
+def _ids_copiados(archivo, tabla, ids):
+    """Ids que ya están en la partición"""
+    copiados = set()
+    for i in range(0, len(ids), LOTE_IDS):
+        lote = ids[i:i + LOTE_IDS]
+        copiados.update(r for (r,) in archivo.execute(
+            f'SELECT id FROM {tabla} WHERE id IN ({",".join("?" * len(lote))})', lote))
+    return copiados
+
+
+def _mover(conn, archivo, tabla, particion, filas):
+    """
+    Copiar las filas que falten en la partición y después borrarlas de la base caliente
+
+    Returns:
+        int: filas borradas de la base caliente
+    """
+    columnas = COLUMNAS[tabla]
+    ids = [fila[0] for fila in filas]
+    # Se anota el lote antes de copiarlo: una corrida cortada entre la copia y
+    # el borrado deja filas en los dos lados y la próxima las busca sólo acá
+    conn.execute(
+        'UPDATE particiones SET pendiente_tabla = ?, pendiente_desde = ?, pendiente_hasta = ? '
+        'WHERE mes = ?',
+        (tabla, min(ids), max(ids), particion.mes)
+    )
+    conn.commit()
+
+    copiados = _ids_copiados(archivo, tabla, ids)
+    archivo.executemany(
+        f'INSERT INTO {tabla} ({", ".join(columnas)}) VALUES ({", ".join("?" * len(columnas))})',
+        [fila for fila in filas if fila[0] not in copiados]
+    )
+    archivo.commit()
+
+    inicio = time.perf_counter()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        borradas = _borrar(conn, tabla, ids)
+        if tabla == "movimientos":
+            conn.executemany(
+                'INSERT OR IGNORE INTO particiones_usuarios (user_id, mes) VALUES (?, ?)',
+                [(user_id, particion.mes) for user_id in {fila[1] for fila in filas}]
+            )
+        conn.execute(
+            f'UPDATE particiones SET {tabla} = {tabla} + ?, actualizado = ?, '
+            'pendiente_tabla = NULL, pendiente_desde = NULL, pendiente_hasta = NULL '
+            'WHERE mes = ?',
+            (borradas, db.ahora(), particion.mes)
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        ARCHIVE_LOCK_SECONDS.observe(time.perf_counter() - inicio)
+    ARCHIVE_ROWS.inc(tabla, n=borradas)
+    return borradas
+
+
+def _borrar(conn, tabla, ids):
+    """Borrar filas de la base caliente; devuelve cuántas había"""
+    borradas = 0
+    for fila_id in ids:
+        borradas += conn.execute(f'DELETE FROM {tabla} WHERE id = ?', (fila_id,)).rowcount
+    return borradas
+
+
+def _mover_lote(conn, archivo, tabla, particion, hasta, tope_id, lote):
+    """
+    Mover a la partición el siguiente lote de filas del mes
+
+    Returns:
+        int: filas leídas del lote (0 si el mes ya no tiene filas para archivar)
+    """
+    columnas = COLUMNAS[tabla]
+    extra, parametros = _filtro(tabla, tope_id)
+    filas = conn.execute(
+        f'SELECT {", ".join(columnas)} FROM {tabla} '
+        f'WHERE fecha >= ? AND fecha < ?{extra} ORDER BY fecha LIMIT ?',
+        (particion.desde, hasta, *parametros, lote)
+    ).fetchall()
+    if filas:
+        _mover(conn, archivo, tabla, particion, filas)
+    return len(filas)
+
+
+def _recuperar(conn, particion, tabla, desde_id, hasta_id):
+    """
+    Terminar el borrado del lote que una corrida cortada dejó anotado
+
+    Sólo se leen las filas del rango de ids anotado (dentro del mes de la
+    partición): el costo depende del lote cortado, no del historial archivado.
+
+    Returns:
+        int: filas borradas de la base caliente
+    """
+    columnas = COLUMNAS[tabla]
+    filas = conn.execute(
+        f'SELECT {", ".join(columnas)} FROM {tabla} '
+        f'WHERE id BETWEEN ? AND ? AND fecha >= ? AND fecha < ?',
+        (desde_id, hasta_id, particion.desde, particion.hasta)
+    ).fetchall()
+    with closing(sqlite3.connect(db.partition_path(particion.archivo),
+                                 timeout=db.POOL_TIMEOUT)) as archivo:
+        copiados = _ids_copiados(archivo, tabla, [fila[0] for fila in filas])
+        if copiados:
+            return _mover(conn, archivo, tabla, particion,
+                          [fila for fila in filas if fila[0] in copiados])
+    # Se cortó antes de copiar: no queda nada de ese lote en la partición
+    conn.execute(
+        'UPDATE particiones SET pendiente_tabla = NULL, pendiente_desde = NULL, '
+        'pendiente_hasta = NULL WHERE mes = ?',
+        (particion.mes,)
+    )
+    conn.commit()
+    return 0
+
+
+def _lotes_cortados(conn):
+    """Particiones con un lote anotado sin terminar: lista de (Particion, tabla, desde_id, hasta_id)"""
+    filas = conn.execute(
+        'SELECT mes, archivo, desde, hasta, pendiente_tabla, pendiente_desde, pendiente_hasta '
+        'FROM particiones WHERE pendiente_tabla IS NOT NULL'
+    ).fetchall()
+    return [(db.Particion._make(fila[:4]), *fila[4:]) for fila in filas]
+
+
+def archive(horizonte_dias=ARCHIVE_HORIZON_DAYS, lote=ARCHIVE_BATCH_SIZE,
+            pausa=ARCHIVE_BATCH_PAUSE, detener=None):
+    """
+    Mover a las particiones mensuales las filas anteriores al horizonte
+
+    Args:
+        detener: threading.Event opcional; si se activa, se corta entre lotes
+
+    Returns:
+        dict: filas archivadas por tabla y meses tocados
+    """
+    corte = _inicio_de_mes(db.ahora() - horizonte_dias * 86400)
+    resultado = {"movimientos": 0, "prestamos": 0, "meses": set()}
+    try:
+        with db.get_pool().connection() as conn:
+            fila = conn.execute('SELECT valor FROM auditoria WHERE clave = ?', (ledger.CURSOR,)).fetchone()
+            tope_id = fila[0] if fila else 0
+            if not tope_id:
+                logger.warning("Los movimientos no se archivan hasta que corra la auditoría del libro mayor")
+
+            for particion, tabla, desde_id, hasta_id in _lotes_cortados(conn):
+                recuperadas = _recuperar(conn, particion, tabla, desde_id, hasta_id)
+                if recuperadas:
+                    logger.warning("Partición %s: %s filas copiadas por una corrida anterior "
+                                   "se borraron de la base caliente", particion.mes, recuperadas)
+
+            for tabla in COLUMNAS:
+                extra, parametros = _filtro(tabla, tope_id)
+                while not (detener and detener.is_set()):
+                    fila = conn.execute(
+                        f'SELECT fecha FROM {tabla} WHERE fecha < ?{extra} ORDER BY fecha LIMIT 1',
+                        (corte, *parametros)
+                    ).fetchone()
+                    if fila is None:
+                        break
+                    particion = _particion(conn, fila[0])
+                    hasta = min(particion.hasta, corte)
+                    ruta = db.partition_path(particion.archivo)
+                    with closing(sqlite3.connect(ruta, timeout=db.POOL_TIMEOUT)) as archivo:
+                        while not (detener and detener.is_set()):
+                            movidas = _mover_lote(conn, archivo, tabla, particion, hasta, tope_id, lote)
+                            if not movidas:
+                                break
+                            resultado[tabla] += movidas
+                            time.sleep(pausa)
+                    resultado["meses"].add(particion.mes)
+
+            # Las particiones ya no cambian hasta la próxima corrida: se compactan
+            for particion in db.list_partitions(conn):
+                if particion.mes in resultado["meses"]:
+                    with closing(sqlite3.connect(db.partition_path(particion.archivo),
+                                                 timeout=db.POOL_TIMEOUT)) as archivo:
+                        archivo.execute('VACUUM')
+    except (OSError, sqlite3.Error) as e:
+        logger.error("Error al archivar el historial: %s", e)
+    return resultado
+
+
+def pending(horizonte_dias=ARCHIVE_HORIZON_DAYS):
+    """
+    Filas que archivaría una corrida ahora, por tabla y mes
+
+    Returns:
+        dict: {tabla: {'AAAA-MM': filas}}
+    """
+    corte = _inicio_de_mes(db.ahora() - horizonte_dias * 86400)
+    resultado = {}
+    with db.get_pool().connection() as conn:
+        fila = conn.execute('SELECT valor FROM auditoria WHERE clave = ?', (ledger.CURSOR,)).fetchone()
+        tope_id = fila[0] if fila else 0
+        for tabla in COLUMNAS:
+            extra, parametros = _filtro(tabla, tope_id)
+            resultado[tabla] = dict(conn.execute(
+                f"SELECT strftime('%Y-%m', fecha, 'unixepoch', 'localtime') AS mes, COUNT(*) "
+                f'FROM {tabla} WHERE fecha < ?{extra} GROUP BY mes ORDER BY mes',
+                (corte, *parametros)
+            ).fetchall())
+    return resultado
+
+
+class Archivador:
+    """Ejecuta archive() cada `intervalo` segundos en un hilo de fondo"""
+
+    def __init__(self, intervalo=ARCHIVE_INTERVAL):
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def start(self):
+        if self._hilo is not None or not self.intervalo:
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._loop, name="archivador", daemon=True)
+        self._hilo.start()
+
+    def _loop(self):
+        while not self._detener.wait(self.intervalo):
+            archive(detener=self._detener)
+
+    def stop(self):
+        """Detener el archivador (corta la corrida en curso al terminar el lote)"""
+        hilo = self._hilo
+        if hilo is not None:
+            self._detener.set()
+            hilo.join()
+            self._hilo = None
+
+
+_archivador = Archivador()
+
+
+def start_archiver():
+    """Iniciar el archivado periódico (no hace nada con ARCHIVE_INTERVAL=0)"""
+    _archivador.start()
+
+
+def stop_archiver():
+    _archivador.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--horizonte-dias", type=int, default=ARCHIVE_HORIZON_DAYS,
+                        help="archivar filas más viejas que esta cantidad de días")
+    parser.add_argument("--lote", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--pausa", type=float, default=ARCHIVE_BATCH_PAUSE)
+    parser.add_argument("--dry-run", action="store_true", help="sólo contar filas por mes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not db.init_db():
+        raise SystemExit(1)
+    try:
+        if args.dry_run:
+            for tabla, meses in pending(args.horizonte_dias).items():
+                for mes, filas in meses.items():
+                    print(f"{tabla} {mes}: {filas:,} filas")
+                if not meses:
+                    print(f"{tabla}: nada para archivar")
+            return
+        inicio = time.perf_counter()
+        resultado = archive(args.horizonte_dias, args.lote, args.pausa)
+        print(f"Archivados {resultado['movimientos']:,} movimientos y {resultado['prestamos']:,} "
+              f"préstamos en {len(resultado['meses'])} meses ({time.perf_counter() - inicio:.1f} s)")
+    finally:
+        db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Servidor stub local compatible con /v1/chat/completions de OpenAI
+
+Con "stream": true responde por SSE, una palabra por evento, como la API real.
+
+Uso:
+    python -m benchmarks.fake_openai --port 8081 --latency 0.5 --token-delay 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8081/v1 python main.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPUESTA = "Ofrecemos Visa Classic, Visa Gold y Mastercard Platinum."
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como la API real
+    latency = 0.0
+    token_delay = 0.0
+    error_rate = 0.0
+    respuesta = RESPUESTA
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente canceló la consulta
+            pass
+
+    def _chunk(self, datos):
+        self.wfile.write(f"{len(datos):x}\r\n".encode() + datos + b"\r\n")
+
+    def _stream(self, modelo):
+        """Respuesta en eventos SSE con transfer-encoding chunked"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        palabras = self.respuesta.split(" ")
+        try:
+            for i, palabra in enumerate(palabras):
+                if i and self.token_delay:
+                    time.sleep(self.token_delay)
+                evento = {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": modelo,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": palabra if i == 0 else " " + palabra},
+                        "finish_reason": "stop" if i == len(palabras) - 1 else None,
+                    }],
+                }
+                self._chunk(f"data: {json.dumps(evento)}\n\n".encode())
+                self.wfile.flush()
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        largo = int(self.headers.get("Content-Length", 0))
+        pedido = json.loads(self.rfile.read(largo) or b"{}")
+
+        if not self.path.endswith("/chat/completions"):
+            self._json(404, {"error": {"message": "not found"}})
+            return
+
+        time.sleep(self.latency)
+
+        if random.random() < self.error_rate:
+            self._json(500, {"error": {"message": "stub error",
+                                       "type": "server_error"}})
+            return
+
+        if pedido.get("stream"):
+            self._stream(pedido.get("model", "stub"))
+            return
+
+        self._json(200, {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": pedido.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.respuesta},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0,
+                      "total_tokens": 0},
+        })
+
+
+def make_server(host="127.0.0.1", port=8081, latency=0.0, error_rate=0.0, token_delay=0.0):
+    handler = type("Handler", (FakeOpenAIHandler,), {
+        "latency": latency, "error_rate": error_rate, "token_delay": token_delay})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(host="127.0.0.1", port=8081, latency=0.0, error_rate=0.0, token_delay=0.0):
+    """Levanta el servidor en un hilo de fondo y lo devuelve"""
+    server = make_server(host, port, latency, error_rate, token_delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="segundos de demora por respuesta")
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="segundos entre palabras en modo streaming")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="proporción de respuestas con error 500")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.error_rate, args.token_delay)
+    print(f"Stub de OpenAI escuchando en http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
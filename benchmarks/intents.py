@@ -0,0 +1,92 @@
+"""
+Benchmark del clasificador de intenciones contra la versión por subcadenas
+
+Uso:
+    python -m benchmarks.intents [--repeticiones 2000]
+"""
+import argparse
+import time
+
+from intents import IntentClassifier
+
+# Corpus etiquetado: (mensaje, intención esperada)
+CORPUS = [
+    ("¿Cuánto tengo en mi cuenta?", "saldo"),
+    ("saldo", "saldo"),
+    ("quiero ver mi saldo", "saldo"),
+    ("cuanta plata tengo disponible", "saldo"),
+    ("Decime el saldo por favor", "saldo"),
+    ("¿Cuánto dinero tengo?", "saldo"),
+    ("Mostrame los últimos movimientos", "movimientos"),
+    ("movimientos", "movimientos"),
+    ("quiero ver mis transacciones recientes", "movimientos"),
+    ("en qué gasté este mes", "movimientos"),
+    ("historial de la cuenta", "movimientos"),
+    ("mis gastos", "movimientos"),
+    ("Necesito un préstamo", "prestamo"),
+    ("quiero pedir un crédito personal", "prestamo"),
+    ("necesito plata", "prestamo"),
+    ("quiero simular un prestamo", "prestamo"),
+    ("solicitar préstamo", "prestamo"),
+    ("¿Cuánto pagaría si pido 100.000 en 24 cuotas?", "simulacion"),
+    ("préstamo de $ 250.000 a 12 meses", "simulacion"),
+    ("quiero pedir 50 mil a 2 años", "simulacion"),
+    ("simular 1.000.000 en 36 cuotas", "simulacion"),
+    ("¿Qué tarjetas ofrecen?", "general"),
+    ("¿Conviene un plazo fijo?", "general"),
+    ("¿Cuál es la tasa para préstamos personales?", "general"),
+    ("¿Qué beneficios tiene la Visa Gold?", "general"),
+    ("quiero una tarjeta de crédito", "general"),
+    ("¿Cuántas cuotas sin interés tiene la Mastercard?", "general"),
+    ("¿Qué es el plazo fijo UVA?", "general"),
+    ("tengo una duda", "general"),
+    ("¿Cuáles son los requisitos para abrir una cuenta?", "general"),
+    ("hola", "general"),
+    ("¿Atienden los sábados?", "general"),
+]
+
+
+def legacy_detect(message):
+    """Implementación original por subcadenas, como referencia"""
+    message = message.lower()
+    if any(word in message for word in ['saldo', 'tengo', 'cuánto', 'cuenta', 'disponible']):
+        return "saldo"
+    if any(word in message for word in ['movimientos', 'transacciones', 'gastos', 'últimos', 'recientes']):
+        return "movimientos"
+    if any(word in message for word in ['préstamo', 'crédito', 'solicitar', 'pedir', 'necesito dinero']):
+        return "prestamo"
+    return "general"
+
+
+def medir(nombre, clasificar, repeticiones):
+    aciertos = sum(clasificar(msg) == esperado for msg, esperado in CORPUS)
+    fallos = [(msg, clasificar(msg), esperado)
+              for msg, esperado in CORPUS if clasificar(msg) != esperado]
+
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for msg, _esperado in CORPUS:
+            clasificar(msg)
+    duracion = time.perf_counter() - inicio
+
+    total = repeticiones * len(CORPUS)
+    print(f"{nombre:<12} precisión {aciertos}/{len(CORPUS)} "
+          f"({aciertos / len(CORPUS):.0%})  "
+          f"{total / duracion:,.0f} mensajes/s")
+    for msg, obtenido, esperado in fallos:
+        print(f"    ✗ {msg!r}: {obtenido} (esperado {esperado})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeticiones", type=int, default=2000)
+    args = parser.parse_args()
+
+    clasificador = IntentClassifier()
+    medir("substring", legacy_detect, args.repeticiones)
+    medir("compilado", lambda m: clasificador.classify(m).intent,
+          args.repeticiones)
+
+
+if __name__ == "__main__":
+    main()
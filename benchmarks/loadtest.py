@@ -0,0 +1,436 @@
+"""
+Prueba de carga: tráfico sintético de Telegram a través de los handlers de main.py
+
+Cada usuario simulado recorre /start, PIN, /saldo, /movimientos, "ver más",
+/prestamo (monto y plazo) y dos mensajes libres (uno por intención y otro
+que va a la IA). Las respuestas a Telegram se simulan en memoria y la IA es
+el stub local de benchmarks.fake_openai. La base es temporal.
+
+Además de la latencia total de cada paso se mide el tiempo hasta el primer
+mensaje visible (envío o edición) que lleva la respuesta de ese paso, que con
+--streaming es lo que ve el usuario. Como outbox une mensajes seguidos de un
+chat, cada texto encolado se asocia al paso que lo generó y se reconoce dentro
+del mensaje unido que llega a Telegram. Los handlers encolan sus respuestas en
+outbox; la cola se vacía antes de terminar. Por defecto la cola no limita
+envíos; --tasa-chat/--tasa-global aplican límites y --flood-chat hace que el
+Telegram simulado responda 429.
+
+Uso:
+    python -m benchmarks.loadtest --usuarios 200 --concurrencia 50 --latencia-ia 0.3
+    python -m benchmarks.loadtest --streaming --demora-token 0.05
+    python -m benchmarks.loadtest --tasa-chat 1 --tasa-global 30 --flood-chat 2
+    python -m benchmarks.loadtest --save benchmarks/loadtest_baseline.json
+    python -m benchmarks.loadtest --compare benchmarks/loadtest_baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+
+from telegram.request import BaseRequest
+
+from benchmarks import fake_openai
+
+TOLERANCIA = 0.2  # 20% más lento que la línea base cuenta como regresión
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Responde en memoria las llamadas a la API de Telegram"""
+
+    def __init__(self, latencia=0.0, flood_chat=0):
+        """
+        Args:
+            latencia: Demora por llamada
+            flood_chat: Mensajes por segundo a un chat a partir de los cuales
+                se responde 429 con retry_after (0 nunca)
+        """
+        self.latencia = latencia
+        self.flood_chat = flood_chat
+        self._envios_por_chat = {}
+        self.llamadas = {}
+        self._mensaje_id = 0
+        # chat_id -> futuro del paso en curso, que se resuelve con su primer
+        # mensaje visible
+        self.en_curso = {}
+        # chat_id -> textos encolados en outbox sin enviar: (texto, futuro del paso)
+        self._encolados = {}
+        # Separador con el que outbox une mensajes (outbox.SEPARADOR)
+        self.separador = "\n\n"
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        metodo = url.rsplit("/", 1)[-1]
+        self.llamadas[metodo] = self.llamadas.get(metodo, 0) + 1
+        parametros = request_data.parameters if request_data else {}
+        if self.latencia:
+            await asyncio.sleep(self.latencia)
+
+        if metodo == "getMe":
+            resultado = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "bot_bancario"}
+        elif metodo == "sendMessage" and self._saturado(parametros.get("chat_id")):
+            self.llamadas["429"] = self.llamadas.get("429", 0) + 1
+            return 429, json.dumps({
+                "ok": False, "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }).encode()
+        elif metodo in ("sendMessage", "editMessageText"):
+            momento = time.perf_counter()
+            for futuro in self._pasos_visibles(metodo, parametros):
+                if futuro is not None and not futuro.done():
+                    futuro.set_result(momento)
+            self._mensaje_id += 1
+            resultado = {
+                "message_id": parametros.get("message_id", self._mensaje_id),
+                "date": int(time.time()),
+                "chat": {"id": parametros.get("chat_id", 0), "type": "private"},
+                "text": parametros.get("text", ""),
+            }
+        else:
+            resultado = True
+        return 200, json.dumps({"ok": True, "result": resultado}).encode()
+
+    def encolado(self, chat_id, texto):
+        """Registra un texto que un handler encoló en outbox durante el paso en curso"""
+        self._encolados.setdefault(chat_id, deque()).append(
+            (texto, self.en_curso.get(chat_id)))
+
+    def _pasos_visibles(self, metodo, parametros):
+        """Futuros de los pasos cuya respuesta viaja en este envío o edición"""
+        chat_id = parametros.get("chat_id")
+        cola = self._encolados.get(chat_id)
+        if metodo != "sendMessage" or not cola:
+            # Ediciones y envíos directos los hace el handler del paso en curso
+            return [self.en_curso.get(chat_id)]
+        # outbox envía en orden y une textos con el separador: se toman de la
+        # cola los textos encolados hasta cubrir el largo del mensaje
+        texto = parametros.get("text", "")
+        pasos = []
+        largo = -len(self.separador)
+        while cola and largo < len(texto):
+            parte, futuro = cola.popleft()
+            largo += len(self.separador) + len(parte)
+            pasos.append(futuro)
+        return pasos
+
+    def _saturado(self, chat_id):
+        """True si el chat superó flood_chat mensajes en el último segundo"""
+        if not self.flood_chat:
+            return False
+        ahora = time.monotonic()
+        envios = [t for t in self._envios_por_chat.get(chat_id, ()) if ahora - t < 1]
+        if len(envios) >= self.flood_chat:
+            self._envios_por_chat[chat_id] = envios
+            return True
+        envios.append(ahora)
+        self._envios_por_chat[chat_id] = envios
+        return False
+
+
+def _usuario(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"Carga{user_id}"}
+
+
+def _mensaje(update_id, user_id, texto):
+    mensaje = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _usuario(user_id),
+        "text": texto,
+    }
+    if texto.startswith("/"):
+        mensaje["entities"] = [{"type": "bot_command", "offset": 0, "length": len(texto)}]
+    return {"update_id": update_id, "message": mensaje}
+
+
+def _callback(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _usuario(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "📄 Tus últimos movimientos:",
+            },
+        },
+    }
+
+
+# (handler que atiende el paso, constructor del update)
+ESCENARIO = [
+    ("start", lambda i, u: _mensaje(i, u, "/start")),
+    ("verificar_pin", lambda i, u: _mensaje(i, u, "1234")),
+    ("consultar_saldo", lambda i, u: _mensaje(i, u, "/saldo")),
+    ("consultar_movimientos", lambda i, u: _mensaje(i, u, "/movimientos")),
+    ("ver_mas_movimientos", lambda i, u: _callback(i, u, f"mov:{u}:9999999999:999999999")),
+    ("iniciar_prestamo", lambda i, u: _mensaje(i, u, "/prestamo")),
+    ("procesar_monto", lambda i, u: _mensaje(i, u, "100000")),
+    ("procesar_plazo", lambda i, u: _mensaje(i, u, "24")),
+    ("procesar_mensaje:saldo", lambda i, u: _mensaje(i, u, "¿Cuánto tengo en mi cuenta?")),
+    ("procesar_mensaje:ia", lambda i, u: _mensaje(i, u, "¿Qué tarjetas ofrecen?")),
+]
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def _configurar_entorno(args, puerto_ia):
+    """Variables que leen main/db/ai al importarse"""
+    os.environ["DB_PATH"] = args.db or os.path.join(tempfile.mkdtemp(), "loadtest.db")
+    os.environ["TELEGRAM_TOKEN"] = "1:loadtest"
+    os.environ["OPENAI_API_KEY"] = "loadtest"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{puerto_ia}/v1"
+    os.environ["AI_CACHE_ENABLED"] = "1" if args.cache else "0"
+    os.environ["AI_CACHE_PERSIST"] = "0"
+    os.environ["AI_STREAMING"] = "1" if args.streaming else "0"
+    os.environ["OUTBOX_CHAT_RATE"] = str(args.tasa_chat)
+    os.environ["OUTBOX_GLOBAL_RATE"] = str(args.tasa_global)
+
+
+async def correr(args):
+    import main
+    import db_async
+    import outbox
+    from scheduler import PerUserUpdateProcessor
+
+    class ProcesadorMedido(PerUserUpdateProcessor):
+        """Avisa cuando termina cada update para medir la latencia de punta a punta"""
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.esperando = {}
+
+        async def do_process_update(self, update, coroutine):
+            try:
+                await super().do_process_update(update, coroutine)
+            finally:
+                futuro = self.esperando.pop(update.update_id, None)
+                if futuro is not None and not futuro.done():
+                    futuro.set_result(None)
+
+    from telegram import Update
+
+    if not main.iniciar():
+        raise SystemExit(1)
+    telegram = FakeTelegramRequest(args.latencia_telegram, args.flood_chat)
+    telegram.separador = outbox.SEPARADOR
+    procesador = ProcesadorMedido(al_encolar=main.mensaje_en_cola)
+    app = main.build_application(request=telegram, update_processor=procesador)
+    errores = []
+
+    async def contar_error(update, context):
+        errores.append(repr(context.error))
+
+    app.add_error_handler(contar_error)
+
+    # Cada texto que encolan los handlers queda asociado al paso en curso
+    enviar = outbox.send
+
+    def enviar_medido(bot, chat_id, texto, *args, **kwargs):
+        telegram.encolado(chat_id, texto)
+        return enviar(bot, chat_id, texto, *args, **kwargs)
+
+    outbox.send = enviar_medido
+
+    latencias = {nombre: [] for nombre, _ in ESCENARIO}
+    primeros = {nombre: [] for nombre, _ in ESCENARIO}
+    # (paso, inicio, futuro del primer mensaje): se leen después de vaciar
+    # outbox, porque la respuesta de un paso puede salir después de que termine
+    visibles = []
+    siguiente_id = iter(range(1, 10 ** 9))
+    limite = asyncio.Semaphore(args.concurrencia)
+    loop = asyncio.get_running_loop()
+
+    async def usuario(user_id):
+        async with limite:
+            for nombre, construir in ESCENARIO:
+                update = Update.de_json(construir(next(siguiente_id), user_id), app.bot)
+                futuro = loop.create_future()
+                procesador.esperando[update.update_id] = futuro
+                primero = telegram.en_curso[user_id] = loop.create_future()
+                inicio = time.perf_counter()
+                await app.update_queue.put(update)
+                await futuro
+                latencias[nombre].append(time.perf_counter() - inicio)
+                visibles.append((nombre, inicio, primero))
+                if args.pausa:
+                    await asyncio.sleep(args.pausa)
+
+    await app.initialize()
+    await app.start()
+    inicio = time.perf_counter()
+    await asyncio.gather(*(usuario(1000000 + n) for n in range(args.usuarios)))
+    duracion = time.perf_counter() - inicio
+    await outbox.flush()
+    duracion_envios = time.perf_counter() - inicio
+    outbox.send = enviar
+    for nombre, inicio_paso, primero in visibles:
+        if primero.done():
+            primeros[nombre].append(primero.result() - inicio_paso)
+    stats_salida = outbox.get_stats()
+    await outbox.close()
+    stats_db = db_async.get_stats()
+    stats_procesador = procesador.stats()
+    await app.stop()
+    await app.shutdown()
+
+    total_updates = sum(len(v) for v in latencias.values())
+    tiempo_handlers = sum(sum(v) for v in latencias.values())
+    funciones_db = {
+        nombre: {
+            "calls": m["calls"],
+            "total_ms": m["avg_time_ms"] * m["calls"],
+            "wait_ms": m["avg_wait_ms"] * m["calls"],
+        }
+        for nombre, m in stats_db["functions"].items()
+    }
+    tiempo_db = sum(m["total_ms"] + m["wait_ms"] for m in funciones_db.values()) / 1000
+    return {
+        "config": {
+            "usuarios": args.usuarios,
+            "concurrencia": args.concurrencia,
+            "latencia_ia": args.latencia_ia,
+            "latencia_telegram": args.latencia_telegram,
+            "cache": args.cache,
+            "streaming": args.streaming,
+            "tasa_chat": args.tasa_chat,
+            "tasa_global": args.tasa_global,
+            "flood_chat": args.flood_chat,
+        },
+        "duracion_s": duracion,
+        "duracion_envios_s": duracion_envios,
+        "updates": total_updates,
+        "throughput": total_updates / duracion,
+        "errores": len(errores),
+        "handlers": {
+            nombre: {
+                "n": len(valores),
+                "p50_ms": percentil(valores, 0.50) * 1000,
+                "p95_ms": percentil(valores, 0.95) * 1000,
+                "p99_ms": percentil(valores, 0.99) * 1000,
+                "primer_mensaje_p50_ms": percentil(primeros[nombre], 0.50) * 1000,
+                "primer_mensaje_p95_ms": percentil(primeros[nombre], 0.95) * 1000,
+            }
+            for nombre, valores in latencias.items()
+        },
+        "db": {
+            "proporcion": tiempo_db / tiempo_handlers if tiempo_handlers else 0.0,
+            "funciones": funciones_db,
+        },
+        "scheduler": stats_procesador,
+        "outbox": stats_salida,
+        "telegram": telegram.llamadas,
+    }, errores
+
+
+def imprimir(resultado):
+    print(f"updates      {resultado['updates']} en {resultado['duracion_s']:.2f} s "
+          f"({resultado['throughput']:,.0f}/s), errores: {resultado['errores']}")
+    print(f"\n{'handler':<26}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'1º p50':>10}{'1º p95':>10}")
+    for nombre, h in resultado["handlers"].items():
+        print(f"{nombre:<26}{h['n']:>7}{h['p50_ms']:>10.1f}{h['p95_ms']:>10.1f}{h['p99_ms']:>10.1f}"
+              f"{h.get('primer_mensaje_p50_ms', 0):>10.1f}{h.get('primer_mensaje_p95_ms', 0):>10.1f}")
+    salida = resultado["outbox"]
+    print(f"\nsalida: {salida['messages']} mensajes en {salida['requests']} envíos "
+          f"({salida['merged']} unidos), {salida['flood_waits']} esperas por 429, "
+          f"todo enviado a los {resultado['duracion_envios_s']:.2f} s")
+    print(f"\nbase de datos: {resultado['db']['proporcion']:.1%} del tiempo de los handlers")
+    print(f"{'función':<26}{'llamadas':>9}{'total ms':>11}{'espera ms':>11}")
+    funciones = sorted(resultado["db"]["funciones"].items(), key=lambda item: -item[1]["total_ms"])
+    for nombre, f in funciones:
+        print(f"{nombre:<26}{f['calls']:>9}{f['total_ms']:>11.1f}{f['wait_ms']:>11.1f}")
+
+
+def comparar(resultado, base, tolerancia=TOLERANCIA):
+    """
+    Returns:
+        list: Descripción de cada métrica que empeoró más que la tolerancia
+    """
+    regresiones = []
+    if resultado["throughput"] < base["throughput"] * (1 - tolerancia):
+        regresiones.append(
+            f"throughput {base['throughput']:,.0f}/s -> {resultado['throughput']:,.0f}/s")
+    for nombre, h in resultado["handlers"].items():
+        anterior = base["handlers"].get(nombre)
+        if anterior and h["p95_ms"] > anterior["p95_ms"] * (1 + tolerancia):
+            regresiones.append(
+                f"{nombre} p95 {anterior['p95_ms']:.1f} ms -> {h['p95_ms']:.1f} ms")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--usuarios", type=int, default=100)
+    parser.add_argument("--concurrencia", type=int, default=20,
+                        help="usuarios activos a la vez")
+    parser.add_argument("--latencia-ia", type=float, default=0.2,
+                        help="segundos de demora del stub de OpenAI")
+    parser.add_argument("--latencia-telegram", type=float, default=0.0,
+                        help="segundos de demora por llamada a la API de Telegram")
+    parser.add_argument("--tasa-chat", type=float, default=0,
+                        help="mensajes por segundo por chat en la cola de salida (0 sin límite)")
+    parser.add_argument("--tasa-global", type=float, default=0,
+                        help="mensajes por segundo en total en la cola de salida (0 sin límite)")
+    parser.add_argument("--flood-chat", type=int, default=0,
+                        help="mensajes por segundo a un chat antes de que Telegram responda 429")
+    parser.add_argument("--pausa", type=float, default=0.0,
+                        help="segundos entre mensajes de un mismo usuario")
+    parser.add_argument("--streaming", action="store_true",
+                        help="respuestas de la IA en flujo, editando el mensaje")
+    parser.add_argument("--demora-token", type=float, default=0.0,
+                        help="segundos entre palabras del stub de OpenAI en modo streaming")
+    parser.add_argument("--cache", action="store_true",
+                        help="habilitar la caché de respuestas de la IA")
+    parser.add_argument("--db", help="base a usar (por defecto una temporal)")
+    parser.add_argument("--save", help="guardar el resultado como línea base")
+    parser.add_argument("--compare", help="comparar contra una línea base guardada")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA)
+    args = parser.parse_args()
+
+    servidor_ia = fake_openai.serve(port=0, latency=args.latencia_ia, token_delay=args.demora_token)
+    _configurar_entorno(args, servidor_ia.server_port)
+
+    resultado, errores = asyncio.run(correr(args))
+    servidor_ia.shutdown()
+    imprimir(resultado)
+    for error in errores[:5]:
+        print(f"Error: {error}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as archivo:
+            json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+        print(f"\nLínea base guardada en {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as archivo:
+            regresiones = comparar(resultado, json.load(archivo), args.tolerancia)
+        if regresiones:
+            print("\nRegresiones respecto de la línea base:")
+            for regresion in regresiones:
+                print(f"✗ {regresion}")
+            sys.exit(1)
+        print("\n✓ Sin regresiones respecto de la línea base")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark de la cotización por lotes contra calculate_loan en un loop
+
+Verifica además que los resultados sean idénticos campo por campo.
+
+Uso:
+    python -m benchmarks.loans [--n 200000]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from loan_batch import calculate_loans
+from logic import calculate_loan
+
+CAMPOS = ("monto", "plazo", "tasa_anual", "tasa_mensual", "cuota_mensual", "total")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--n", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    montos = rng.integers(100000, 500000000, args.n) / 100
+    plazos = rng.integers(1, 61, args.n)
+    interacciones = rng.integers(0, 40, args.n)
+
+    inicio = time.perf_counter()
+    escalares = [
+        calculate_loan(float(m), int(p), int(i))
+        for m, p, i in zip(montos, plazos, interacciones)
+    ]
+    t_loop = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    lote = calculate_loans(montos, plazos, interacciones)
+    t_lote = time.perf_counter() - inicio
+
+    diferencias = sum(
+        escalar[campo] != lote[campo][i]
+        for i, escalar in enumerate(escalares)
+        for campo in CAMPOS
+    )
+
+    print(f"loop Python  {t_loop * 1000:8.1f} ms  ({args.n / t_loop:,.0f} cotizaciones/s)")
+    print(f"NumPy        {t_lote * 1000:8.1f} ms  ({args.n / t_lote:,.0f} cotizaciones/s)")
+    print(f"aceleración  {t_loop / t_lote:.1f}x")
+    print(f"diferencias  {diferencias} de {args.n * len(CAMPOS)} valores")
+    if diferencias:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
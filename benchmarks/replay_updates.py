@@ -0,0 +1,115 @@
+"""
+Reenvía updates de Telegram grabados al webhook del bot
+
+Cada línea del archivo es el JSON de un Update tal como lo envía Telegram.
+Sin archivo se generan mensajes de texto sintéticos.
+
+Uso:
+    BOT_MODE=webhook WEBHOOK_URL=https://... WEBHOOK_SECRET=abc python main.py
+    python -m benchmarks.replay_updates --url http://127.0.0.1:8443/telegram \\
+        --secret abc updates.jsonl
+    python -m benchmarks.replay_updates --generar 500 --concurrencia 20 --secret abc
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+import httpx
+
+MENSAJES = [
+    "¿Cuál es mi saldo?",
+    "Quiero ver mis últimos movimientos",
+    "¿Cuánto pagaría si pido 100.000 en 24 cuotas?",
+    "¿Qué tarjetas de crédito ofrecen?",
+    "¿Cuál es el horario de atención?",
+]
+
+
+def leer_updates(ruta):
+    with open(ruta, encoding="utf-8") as archivo:
+        return [json.loads(linea) for linea in archivo if linea.strip()]
+
+
+def generar_updates(cantidad, usuarios=50, inicio=1):
+    """Updates con mensajes de texto de usuarios ficticios"""
+    updates = []
+    for i in range(cantidad):
+        user_id = 100000 + random.randrange(usuarios)
+        updates.append({
+            "update_id": inicio + i,
+            "message": {
+                "message_id": inicio + i,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": "Test"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+                "text": random.choice(MENSAJES),
+            },
+        })
+    return updates
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+async def reenviar(url, updates, secret=None, concurrencia=10):
+    headers = {}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    estados = Counter()
+    latencias = []
+    pendientes = asyncio.Queue()
+    for update in updates:
+        pendientes.put_nowait(update)
+
+    async def trabajador(client):
+        while not pendientes.empty():
+            update = pendientes.get_nowait()
+            t0 = time.perf_counter()
+            try:
+                respuesta = await client.post(url, json=update, headers=headers)
+                estados[respuesta.status_code] += 1
+            except httpx.HTTPError as e:
+                estados[type(e).__name__] += 1
+            latencias.append(time.perf_counter() - t0)
+
+    inicio = time.perf_counter()
+    async with httpx.AsyncClient(timeout=30) as client:
+        await asyncio.gather(*(trabajador(client) for _ in range(concurrencia)))
+    return estados, latencias, time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("archivo", nargs="?", help="JSONL con un Update por línea")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", help="valor de WEBHOOK_SECRET")
+    parser.add_argument("--generar", type=int, default=100,
+                        help="updates sintéticos si no se pasa archivo")
+    parser.add_argument("--concurrencia", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.archivo:
+        updates = leer_updates(args.archivo)
+    else:
+        updates = generar_updates(args.generar)
+
+    estados, latencias, duracion = asyncio.run(
+        reenviar(args.url, updates, args.secret, args.concurrencia))
+
+    print(f"updates      {len(updates)} en {duracion:.2f} s "
+          f"({len(updates) / duracion:,.0f}/s)")
+    print("respuestas   " + ", ".join(f"{k}: {v}" for k, v in sorted(estados.items(), key=str)))
+    print(f"latencia     p50 {percentil(latencias, 0.50) * 1000:.1f} ms  "
+          f"p95 {percentil(latencias, 0.95) * 1000:.1f} ms  "
+          f"p99 {percentil(latencias, 0.99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
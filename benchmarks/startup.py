@@ -0,0 +1,163 @@
+"""
+Tiempo de arranque del bot: importación por módulo y arranque en frío
+
+Cada corrida es un proceso nuevo con una base temporal vacía. Se mide:
+    import main          importación de main.py y sus dependencias
+    iniciar              creación de la base y migraciones
+    build + initialize   armar la aplicación, validar el token (Telegram
+                         simulado) y cargar las sesiones
+    listo                desde el inicio del proceso hasta marcar /ready
+    primer uso de la IA  crear el cliente de OpenAI (importa openai)
+
+y, con python -X importtime, el tiempo de importación de cada módulo del
+proyecto y de cada paquete externo (lo paga el primer módulo que lo importa).
+
+Uso:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeticiones 10 --json startup.json
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULOS_PROYECTO = {
+    nombre[:-3] for nombre in os.listdir(RAIZ)
+    if nombre.endswith(".py") and not nombre.startswith("_")
+}
+# import time:      self [us] | cumulative | imported package
+_LINEA_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+FASES = ("import_main", "iniciar", "build_initialize", "listo", "primer_uso_ia")
+
+
+def _entorno(db_path):
+    entorno = dict(os.environ)
+    entorno.update({
+        "DB_PATH": db_path,
+        "TELEGRAM_TOKEN": "1:startup",
+        "OPENAI_API_KEY": "startup",
+        "METRICS_PORT": "0",
+        "AI_PRELOAD": "0",
+        "PYTHONPATH": RAIZ,
+    })
+    return entorno
+
+
+def fase_hija():
+    """Corre en el proceso medido; imprime los tiempos como JSON"""
+    inicio = time.perf_counter()
+    import asyncio
+    import main
+    tiempos = {"import_main": time.perf_counter() - inicio}
+
+    t = time.perf_counter()
+    if not main.iniciar():
+        raise SystemExit(1)
+    tiempos["iniciar"] = time.perf_counter() - t
+
+    from benchmarks.loadtest import FakeTelegramRequest
+    import ai
+
+    async def arrancar():
+        t = time.perf_counter()
+        app = main.build_application(request=FakeTelegramRequest())
+        await app.initialize()
+        await main.marcar_listo(app)
+        tiempos["build_initialize"] = time.perf_counter() - t
+        tiempos["listo"] = time.perf_counter() - inicio
+
+        t = time.perf_counter()
+        ai.get_client()
+        tiempos["primer_uso_ia"] = time.perf_counter() - t
+        await app.shutdown()
+        await ai.close_client()
+
+    asyncio.run(arrancar())
+    print(json.dumps(tiempos))
+
+
+def medir_arranque():
+    with tempfile.TemporaryDirectory() as directorio:
+        inicio = time.perf_counter()
+        salida = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup", "--hija"],
+            cwd=RAIZ, env=_entorno(os.path.join(directorio, "startup.db")),
+            capture_output=True, text=True, check=True)
+        proceso = time.perf_counter() - inicio
+    tiempos = json.loads(salida.stdout.strip().splitlines()[-1])
+    tiempos["proceso"] = proceso
+    return tiempos
+
+
+def medir_importaciones():
+    """Tiempos de -X importtime: {módulo: (propio, acumulado)} en segundos"""
+    with tempfile.TemporaryDirectory() as directorio:
+        salida = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main"],
+            cwd=RAIZ, env=_entorno(os.path.join(directorio, "startup.db")),
+            capture_output=True, text=True, check=True)
+    proyecto, externos = {}, {}
+    for linea in salida.stderr.splitlines():
+        coincidencia = _LINEA_IMPORTTIME.match(linea)
+        if not coincidencia:
+            continue
+        propio, acumulado, _sangria, nombre = coincidencia.groups()
+        tiempos = (int(propio) / 1e6, int(acumulado) / 1e6)
+        if nombre in MODULOS_PROYECTO:
+            proyecto[nombre] = tiempos
+        elif "." not in nombre and nombre not in sys.stdlib_module_names:
+            externos[nombre] = tiempos
+    return proyecto, externos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    parser.add_argument("--hija", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hija:
+        fase_hija()
+        return
+
+    corridas = [medir_arranque() for _ in range(args.repeticiones)]
+    proyecto, externos = medir_importaciones()
+
+    print(f"Arranque en frío ({args.repeticiones} corridas, mediana y mínimo)")
+    print(f"{'fase':<20}{'mediana ms':>12}{'mínimo ms':>12}")
+    resumen = {}
+    for fase in FASES + ("proceso",):
+        valores = [c[fase] for c in corridas]
+        resumen[fase] = {"mediana_ms": statistics.median(valores) * 1000,
+                         "minimo_ms": min(valores) * 1000}
+        print(f"{fase:<20}{resumen[fase]['mediana_ms']:>12.1f}{resumen[fase]['minimo_ms']:>12.1f}")
+
+    for titulo, tiempos in (("módulo del proyecto", proyecto), ("paquete externo", externos)):
+        print(f"\n{titulo:<20}{'propio ms':>12}{'acumulado ms':>14}")
+        for nombre, (propio, acumulado) in sorted(tiempos.items(), key=lambda item: -item[1][1]):
+            print(f"{nombre:<20}{propio * 1000:>12.1f}{acumulado * 1000:>14.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as archivo:
+            json.dump({
+                "arranque": resumen,
+                "importacion": {
+                    "proyecto": {n: {"propio_ms": p * 1000, "acumulado_ms": a * 1000}
+                                 for n, (p, a) in proyecto.items()},
+                    "externos": {n: {"propio_ms": p * 1000, "acumulado_ms": a * 1000}
+                                 for n, (p, a) in externos.items()},
+                },
+            }, archivo, indent=2, ensure_ascii=False)
+        print(f"\nResultado guardado en {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+
+_FALTANTE = object()
+
+
+class LRUTTLCache:
+    """Caché en memoria con desalojo LRU y expiración por TTL (thread-safe)"""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, clave, default=None):
+        with self._lock:
+            entrada = self._datos.get(clave, _FALTANTE)
+            if entrada is _FALTANTE:
+                self.misses += 1
+                return default
+            valor, expira = entrada
+            if expira is not None and expira <= time.monotonic():
+                del self._datos[clave]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._datos.move_to_end(clave)
+            self.hits += 1
+            return valor
+
+    def set(self, clave, valor, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expira = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._datos[clave] = (valor, expira)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maxsize:
+                self._datos.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, clave):
+        """Invalidar una entrada; devuelve True si existía"""
+        with self._lock:
+            return self._datos.pop(clave, _FALTANTE) is not _FALTANTE
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+    def keys(self):
+        with self._lock:
+            return list(self._datos)
+
+    def __len__(self):
+        return len(self._datos)
+
+    def stats(self):
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                "size": len(self._datos),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / consultas if consultas else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,22 @@
+"""
+Carga única de la configuración del entorno
+
+Los módulos leen sus variables con os.getenv al importarse, así que el
+archivo .env tiene que cargarse antes. Importar este módulo primero en los
+puntos de entrada (main.py y los scripts de línea de comandos).
+"""
+from dotenv import load_dotenv
+
+_cargado = False
+
+
+def load(path=None):
+    """Cargar .env una sola vez; las variables ya definidas no se pisan"""
+    global _cargado
+    if _cargado:
+        return
+    load_dotenv(path)
+    _cargado = True
+
+
+load()
@@ -1,242 +1,959 @@
+import atexit
+import logging
 import sqlite3
 import os
-from datetime import datetime
+import pathlib
+import queue
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import islice
+
+import config  # carga .env antes de leer las variables
+import metrics
+import migrations
+from cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("DB_PATH", 'data/banco.db')
+
+# Configuración del pool de conexiones
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+STATEMENT_CACHE_SIZE = 128
+
+# PRAGMAs aplicados a cada conexión nueva
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",      # ~16 MB de caché de páginas
+    "PRAGMA mmap_size = 134217728",    # 128 MB de lectura mapeada en memoria
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA busy_timeout = {int(POOL_TIMEOUT * 1000)}",
+)
+
+# Caché de usuarios y saldos
+USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "1") == "1"
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+# Segundos entre consultas de las invalidaciones que anotan otros procesos
+USER_CACHE_SYNC_INTERVAL = float(os.getenv("USER_CACHE_SYNC_INTERVAL", "1"))
+
+# Escritura diferida del contador de interacciones
+INTERACTIONS_FLUSH_INTERVAL = float(os.getenv("INTERACTIONS_FLUSH_INTERVAL", "5"))
+INTERACTIONS_FLUSH_SIZE = int(os.getenv("INTERACTIONS_FLUSH_SIZE", "500"))
+
+
+class ConnectionPool:
+    """Pool de conexiones SQLite persistentes compartidas entre hilos"""
+
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._libres = queue.LifoQueue()
+        self._creadas = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "waits": 0,
+                       "wait_time": 0.0, "timeouts": 0}
+
+    def _connect(self):
+        # Creamos el directorio de la base de datos si no existe
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # cached_statements mantiene las sentencias preparadas por conexión
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            # Mide cada sentencia para db_query_seconds
+            factory=metrics.InstrumentedConnection if metrics.METRICS_ENABLED else sqlite3.Connection
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def acquire(self):
+        """Obtener una conexión del pool, creando una nueva si hay lugar"""
+        try:
+            conn = self._libres.get_nowait()
+            self._count("hits")
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            crear = self._creadas < self.size
+            if crear:
+                self._creadas += 1
+
+        if crear:
+            self._count("misses")
+            try:
+                return self._connect()
+            except sqlite3.Error:
+                with self._lock:
+                    self._creadas -= 1
+                raise
+
+        # Pool agotado: esperamos a que se libere una conexión
+        inicio = time.perf_counter()
+        try:
+            conn = self._libres.get(timeout=self.timeout)
+        except queue.Empty:
+            self._count("timeouts")
+            raise sqlite3.OperationalError("Pool de conexiones agotado")
+        finally:
+            with self._lock:
+                self._stats["waits"] += 1
+                self._stats["wait_time"] += time.perf_counter() - inicio
+        self._count("hits")
+        return conn
+
+    def release(self, conn):
+        """Devolver una conexión al pool descartando transacciones abiertas"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._creadas -= 1
+            return
+        self._libres.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Cerrar todas las conexiones libres del pool"""
+        while True:
+            try:
+                conn = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._creadas -= 1
 
-# Creamos el directorio de la base de datos si no existe
-os.makedirs('data', exist_ok=True)
-DB_PATH = 'data/banco.db'
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self.size
+            stats["open"] = self._creadas
+        stats["idle"] = self._libres.qsize()
+        return stats
 
 
-def init_db():
-    """Inicializar la base de datos"""
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Obtener el pool de conexiones global (se crea en el primer uso)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+
+def close_pool():
+    """Cerrar el pool global (por ejemplo al apagar el bot)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def get_pool_stats():
+    """Estadísticas de uso del pool: hits/misses, esperas y tiempo de espera"""
+    return get_pool().stats()
+
+
+def a_centavos(monto):
+    """Pesos (float) a centavos enteros"""
+    return int(round(monto * 100))
+
+
+def ahora():
+    """Fecha actual como epoch en segundos (formato de las columnas fecha)"""
+    return int(time.time())
+
+
+class Usuario:
+    """Fila de la tabla usuarios"""
+
+    __slots__ = ("user_id", "nombre", "saldo_centavos", "fecha_registro", "interacciones")
+
+    def __init__(self, user_id, nombre, saldo_centavos, fecha_registro, interacciones):
+        self.user_id = user_id
+        self.nombre = nombre
+        self.saldo_centavos = saldo_centavos
+        self.fecha_registro = fecha_registro
+        self.interacciones = interacciones
+
+    @property
+    def saldo(self):
+        """Saldo en pesos"""
+        return self.saldo_centavos / 100
+
+    def _replace(self, **cambios):
+        valores = {campo: getattr(self, campo) for campo in self.__slots__}
+        valores.update(cambios)
+        return Usuario(**valores)
+
+    def __repr__(self):
+        return f"Usuario({self.user_id!r}, {self.nombre!r}, saldo_centavos={self.saldo_centavos!r}, interacciones={self.interacciones!r})"
+
+
+_usuarios = LRUTTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+_usuarios_lock = threading.Lock()
+# Se incrementa en cada invalidación: una lectura de la base que se cruzó
+# con una escritura no se guarda en la caché
+_usuarios_generacion = 0
+
+
+def invalidate_user(user_id):
+    """Descartar el usuario cacheado (después de modificar su fila)"""
+    global _usuarios_generacion
+    with _usuarios_lock:
+        _usuarios_generacion += 1
+    _usuarios.pop(user_id)
+
+
+# Última invalidación de otro proceso ya aplicada (None: todavía no se leyó)
+_invalidaciones_vistas = None
+_invalidaciones_revisadas = 0.0
+_invalidaciones_lock = threading.Lock()
+
+
+def notify_user_changes(conn, user_ids):
+    """
+    Anotar usuarios modificados desde otro proceso (por ejemplo el importador)
+
+    Se llama dentro de la transacción que los modifica. Los procesos del bot
+    leen las anotaciones cada USER_CACHE_SYNC_INTERVAL segundos y descartan
+    esos usuarios de su caché; las anotaciones más viejas que USER_CACHE_TTL
+    ya no hacen falta y se borran.
+    """
+    fecha = ahora()
+    conn.executemany(
+        'INSERT INTO invalidaciones_usuarios (user_id, creado) VALUES (?, ?)',
+        [(user_id, fecha) for user_id in user_ids]
+    )
+    conn.execute('DELETE FROM invalidaciones_usuarios WHERE creado < ?',
+                 (fecha - USER_CACHE_TTL - USER_CACHE_SYNC_INTERVAL,))
+
+
+def _sincronizar_invalidaciones():
+    """Descartar de la caché los usuarios que otro proceso anotó como modificados"""
+    global _invalidaciones_vistas, _invalidaciones_revisadas
+    if (_invalidaciones_vistas is not None
+            and time.monotonic() - _invalidaciones_revisadas < USER_CACHE_SYNC_INTERVAL):
+        return
+    # Un solo hilo consulta; los demás siguen con la caché
+    if not _invalidaciones_lock.acquire(blocking=False):
+        return
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        _invalidaciones_revisadas = time.monotonic()
+        with get_pool().connection() as conn:
+            if _invalidaciones_vistas is None:
+                _invalidaciones_vistas = conn.execute(
+                    'SELECT COALESCE(MAX(id), 0) FROM invalidaciones_usuarios').fetchone()[0]
+                return
+            filas = conn.execute(
+                'SELECT id, user_id FROM invalidaciones_usuarios WHERE id > ? ORDER BY id',
+                (_invalidaciones_vistas,)
+            ).fetchall()
+        for _id, user_id in filas:
+            invalidate_user(user_id)
+        if filas:
+            _invalidaciones_vistas = filas[-1][0]
+    finally:
+        _invalidaciones_lock.release()
+
+
+def set_user_cache_enabled(habilitada):
+    """Activar o desactivar la caché de usuarios"""
+    global USER_CACHE_ENABLED
+    USER_CACHE_ENABLED = habilitada
+    _usuarios.clear()
+
+
+def get_user_cache_stats():
+    """Hits, misses y desalojos de la caché de usuarios"""
+    return {**_usuarios.stats(), "enabled": USER_CACHE_ENABLED}
+
+
+class InteractionBuffer:
+    """
+    Acumula los incrementos de interacciones en memoria y los escribe por lotes
+
+    Se vacía cada `intervalo` segundos, cuando hay `umbral` incrementos
+    pendientes y al apagar el bot, con un único executemany por lote.
+    """
+
+    def __init__(self, intervalo=INTERACTIONS_FLUSH_INTERVAL, umbral=INTERACTIONS_FLUSH_SIZE):
+        self.intervalo = intervalo
+        self.umbral = umbral
+        self._pendientes = {}
+        self._total = 0
+        self._vaciando = False
+        self._generacion = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        self.stats = {"increments": 0, "flushes": 0, "rows_written": 0, "errors": 0}
+
+    def add(self, user_id, cantidad=1):
+        """Sumar interacciones pendientes; vacía el buffer si se alcanzó el umbral"""
+        self._iniciar()
+        with self._cond:
+            self._pendientes[user_id] = self._pendientes.get(user_id, 0) + cantidad
+            self._total += cantidad
+            self.stats["increments"] += cantidad
+            lleno = self._total >= self.umbral
+        if lleno:
+            self.flush()
+
+    def read(self, user_id, leer):
+        """
+        Ejecuta leer() y devuelve (resultado, interacciones pendientes de user_id)
+
+        Si un lote se escribe mientras tanto se vuelve a leer, para no contar
+        dos veces ni perder los incrementos que se están escribiendo.
+        """
+        while True:
+            with self._cond:
+                while self._vaciando:
+                    self._cond.wait()
+                generacion = self._generacion
+            resultado = leer()
+            with self._cond:
+                if generacion == self._generacion and not self._vaciando:
+                    return resultado, self._pendientes.get(user_id, 0)
+
+    def flush(self):
+        """Escribir los incrementos pendientes en una sola transacción"""
+        with self._flush_lock:
+            with self._cond:
+                if not self._pendientes:
+                    return True
+                lote = self._pendientes
+                self._pendientes = {}
+                self._total = 0
+                self._vaciando = True
+                self._generacion += 1
+
+            ok = False
+            try:
+                with get_pool().connection() as conn:
+                    conn.executemany(
+                        'UPDATE usuarios SET interacciones = interacciones + ? WHERE user_id = ?',
+                        [(cantidad, user_id) for user_id, cantidad in sorted(lote.items())]
+                    )
+                    conn.commit()
+                ok = True
+                # Antes de liberar a los lectores, para que no lean la caché vieja
+                for user_id in lote:
+                    invalidate_user(user_id)
+            except sqlite3.Error as e:
+                logger.error("Error al guardar interacciones: %s", e)
+            finally:
+                with self._cond:
+                    if ok:
+                        self.stats["flushes"] += 1
+                        self.stats["rows_written"] += len(lote)
+                    else:
+                        # Devolvemos el lote al buffer para reintentar más tarde
+                        self.stats["errors"] += 1
+                        for user_id, cantidad in lote.items():
+                            self._pendientes[user_id] = self._pendientes.get(user_id, 0) + cantidad
+                            self._total += cantidad
+                    self._vaciando = False
+                    self._cond.notify_all()
+            return ok
+
+    def _iniciar(self):
+        if self._hilo is not None:
+            return
+        with self._flush_lock:
+            if self._hilo is None:
+                self._detener.clear()
+                self._hilo = threading.Thread(
+                    target=self._loop, name="interacciones", daemon=True)
+                self._hilo.start()
+
+    def _loop(self):
+        while not self._detener.wait(self.intervalo):
+            self.flush()
+
+    def stop(self):
+        """Detener el vaciado periódico y escribir lo pendiente"""
+        hilo = self._hilo
+        if hilo is not None:
+            self._detener.set()
+            hilo.join()
+            self._hilo = None
+        self.flush()
+
+    def pending(self):
+        with self._cond:
+            return self._total
+
+
+_interacciones = InteractionBuffer()
+atexit.register(_interacciones.stop)
+
+
+def flush_interactions():
+    """Forzar la escritura de las interacciones pendientes"""
+    return _interacciones.flush()
+
+
+def stop_interactions_buffer():
+    """Detener el buffer de interacciones escribiendo lo pendiente (apagado)"""
+    _interacciones.stop()
+
+
+def get_interactions_stats():
+    """Incrementos acumulados, lotes escritos y pendientes del buffer"""
+    return {**_interacciones.stats, "pending": _interacciones.pending()}
+
+
+def _metricas_pool():
+    if _pool is None:
+        return {}
+    stats = _pool.stats()
+    return {(estado,): stats[estado] for estado in ("open", "idle")}
+
+
+metrics.gauge("db_pool_connections", "Conexiones del pool", _metricas_pool, ("state",))
+metrics.gauge("db_interactions_pending", "Incrementos de interacciones sin escribir",
+              lambda: _interacciones.pending())
+metrics.gauge("db_user_cache_entries", "Usuarios en la caché de lectura", lambda: len(_usuarios))
 
-        # Crear tabla de usuarios
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS usuarios (
-            user_id INTEGER PRIMARY KEY,
-            nombre TEXT,
-            saldo REAL,
-            fecha_registro TEXT,
-            interacciones INTEGER DEFAULT 0
-        )
-        ''')
-
-        # Crear tabla de movimientos
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS movimientos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            descripcion TEXT,
-            monto REAL,
-            fecha TEXT,
-            FOREIGN KEY (user_id) REFERENCES usuarios(user_id)
-        )
-        ''')
-
-        # Crear tabla de préstamos simulados
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS prestamos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            monto REAL,
-            plazo INTEGER,
-            tasa REAL,
-            cuota REAL,
-            total REAL,
-            fecha TEXT,
-            FOREIGN KEY (user_id) REFERENCES usuarios(user_id)
-        )
-        ''')
 
-        conn.commit()
-        conn.close()
+def init_db():
+    """Inicializar la base de datos aplicando las migraciones pendientes"""
+    try:
+        with get_pool().connection() as conn:
+            migrations.migrate(conn)
         return True
-    except sqlite3.Error as e:
-        print(f"Error al inicializar la base de datos: {e}")
+    except (OSError, sqlite3.Error) as e:
+        logger.error("Error al inicializar la base de datos: %s", e)
         return False
 
 
+def _select_user(user_id):
+    """Leer el usuario desde la caché o, si no está, desde la base"""
+    if USER_CACHE_ENABLED:
+        _sincronizar_invalidaciones()
+    generacion = _usuarios_generacion
+    if USER_CACHE_ENABLED:
+        user = _usuarios.get(user_id)
+        if user is not None:
+            return user
+
+    with get_pool().connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT user_id, nombre, saldo_centavos, fecha_registro, interacciones FROM usuarios WHERE user_id = ?',
+            (user_id,)
+        )
+        row = cursor.fetchone()
+
+    if row is None:
+        return None
+    user = Usuario(*row)
+    if USER_CACHE_ENABLED:
+        with _usuarios_lock:
+            if generacion == _usuarios_generacion:
+                _usuarios.set(user_id, user)
+    return user
+
+
 def get_user(user_id):
-    """Obtener información del usuario"""
+    """Obtener información del usuario (incluye las interacciones aún sin escribir)"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM usuarios WHERE user_id = ?', (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        user, pendientes = _interacciones.read(
+            user_id, lambda: _select_user(user_id))
+        if user and pendientes:
+            user = user._replace(interacciones=user.interacciones + pendientes)
         return user
     except sqlite3.Error as e:
-        print(f"Error al obtener usuario: {e}")
+        logger.error("Error al obtener usuario: %s", e)
         return None
 
 
+# Movimientos simulados con los que arranca cada usuario: ingresos y egresos básicos (en centavos)
+MOVIMIENTOS_INICIALES = (
+    ("Depósito inicial", 1000000),
+    ("Compra supermercado", -150000),
+    ("Transferencia recibida", 250000),
+    ("Pago de servicio", -200000),
+)
+SALDO_INICIAL = sum(monto for _descripcion, monto in MOVIMIENTOS_INICIALES)
+
+# Filas por consulta IN y por transacción en create_users
+CREATE_USERS_CHUNK = 500
+
+
+def _insertar_movimientos_iniciales(cursor, user_ids, fecha):
+    cursor.executemany(
+        'INSERT INTO movimientos (user_id, descripcion, monto_centavos, fecha) VALUES (?, ?, ?, ?)',
+        [(user_id, descripcion, monto_centavos, fecha)
+         for user_id in user_ids
+         for descripcion, monto_centavos in MOVIMIENTOS_INICIALES]
+    )
+
+
 def create_user(user_id, nombre="Usuario"):
-    """Crear un nuevo usuario con saldo inicial generado por movimientos simulados"""
+    """
+    Crear un nuevo usuario con saldo inicial generado por movimientos simulados
+
+    Returns:
+        bool: True si se creó, False si ya existía (o hubo un error)
+    """
+    # Un usuario en la caché ya existe: no hace falta tomar el lock de escritura
+    if USER_CACHE_ENABLED and _usuarios.get(user_id) is not None:
+        return False
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            fecha = ahora()
 
-        # Insertar usuario con saldo inicial 0.0
-        cursor.execute(
-            'INSERT INTO usuarios (user_id, nombre, saldo, fecha_registro) VALUES (?, ?, ?, ?)',
-            (user_id, nombre, 0.0, fecha)
-        )
+            # El saldo ya incluye los movimientos iniciales; si el usuario
+            # existe no se inserta nada
+            cursor.execute(
+                'INSERT INTO usuarios (user_id, nombre, saldo_centavos, fecha_registro) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (user_id) DO NOTHING',
+                (user_id, nombre, SALDO_INICIAL, fecha)
+            )
+            if cursor.rowcount == 0:
+                conn.commit()
+                return False
+
+            _insertar_movimientos_iniciales(cursor, (user_id,), fecha)
+            conn.commit()
+        invalidate_user(user_id)
+        return True
+    except sqlite3.Error as e:
+        # El pool descarta la transacción abierta al devolver la conexión
+        logger.error("Error al crear usuario: %s", e)
+        return False
+
+
+def create_users(usuarios, chunk_size=CREATE_USERS_CHUNK):
+    """
+    Registrar usuarios por lotes (por ejemplo antes de una campaña)
+
+    Args:
+        usuarios: Iterable de (user_id, nombre)
+        chunk_size: Usuarios por transacción
+
+    Returns:
+        int: Usuarios creados; los que ya existían se omiten
+    """
+    creados = 0
+    usuarios = iter(usuarios)
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            while True:
+                lote = dict(islice(usuarios, chunk_size))
+                if not lote:
+                    break
+                fecha = ahora()
+                cursor.execute('BEGIN IMMEDIATE')
+                marcadores = ", ".join("?" * len(lote))
+                existentes = {fila[0] for fila in cursor.execute(
+                    f'SELECT user_id FROM usuarios WHERE user_id IN ({marcadores})',
+                    tuple(lote)
+                )}
+                nuevos = [user_id for user_id in lote if user_id not in existentes]
+                cursor.executemany(
+                    'INSERT INTO usuarios (user_id, nombre, saldo_centavos, fecha_registro) VALUES (?, ?, ?, ?)',
+                    [(user_id, lote[user_id], SALDO_INICIAL, fecha) for user_id in nuevos]
+                )
+                _insertar_movimientos_iniciales(cursor, nuevos, fecha)
+                conn.commit()
+                for user_id in nuevos:
+                    invalidate_user(user_id)
+                creados += len(nuevos)
+        return creados
+    except sqlite3.Error as e:
+        logger.error("Error al crear usuarios: %s", e)
+        return creados
+
+
+def update_interactions(user_id):
+    """Actualizar contador de interacciones (se escribe por lotes en segundo plano)"""
+    _interacciones.add(user_id)
+    return True
 
-        # Movimientos simulados: ingresos y egresos básicos
-        movimientos_simulados = [
-            ("Depósito inicial", 10000.0),
-            ("Compra supermercado", -1500.0),
-            ("Transferencia recibida", 2500.0),
-            ("Pago de servicio", -2000.0),
-        ]
 
-        for descripcion, monto in movimientos_simulados:
-            # Insertar movimiento
+def get_balance(user_id):
+    """Obtener saldo del usuario en centavos (0 si no existe)"""
+    try:
+        user = _select_user(user_id)
+        return user.saldo_centavos if user else 0
+    except sqlite3.Error as e:
+        logger.error("Error al obtener saldo: %s", e)
+        return 0
+
+
+def save_transaction(user_id, descripcion, monto):
+    """Guardar un movimiento en la cuenta (monto en pesos)"""
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            fecha = ahora()
+            monto_centavos = a_centavos(monto)
+
+            # Guardar movimiento
             cursor.execute(
-                'INSERT INTO movimientos (user_id, descripcion, monto, fecha) VALUES (?, ?, ?, ?)',
-                (user_id, descripcion, monto, fecha)
+                'INSERT INTO movimientos (user_id, descripcion, monto_centavos, fecha) VALUES (?, ?, ?, ?)',
+                (user_id, descripcion, monto_centavos, fecha)
             )
 
-            # Actualizar saldo en tabla de usuarios
+            # Actualizar saldo
             cursor.execute(
-                'UPDATE usuarios SET saldo = saldo + ? WHERE user_id = ?',
-                (monto, user_id)
+                'UPDATE usuarios SET saldo_centavos = saldo_centavos + ? WHERE user_id = ?',
+                (monto_centavos, user_id)
             )
 
-        conn.commit()
-        conn.close()
+            conn.commit()
+        invalidate_user(user_id)
         return True
     except sqlite3.Error as e:
-        print(f"Error al crear usuario: {e}")
-        if conn:
-            conn.rollback()
-            conn.close()
+        logger.error("Error al guardar transacción: %s", e)
         return False
 
 
-def update_interactions(user_id):
-    """Actualizar contador de interacciones"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
-            'UPDATE usuarios SET interacciones = interacciones + 1 WHERE user_id = ?',
+# Fila de la tabla movimientos (monto en centavos, fecha epoch)
+Movimiento = namedtuple("Movimiento", "id descripcion monto_centavos fecha")
+
+
+# Partición mensual del historial archivado (ver archive.py); [desde, hasta) en epoch
+Particion = namedtuple("Particion", "mes archivo desde hasta")
+
+
+def list_partitions(conn, user_id=None):
+    """
+    Particiones archivadas, de la más nueva a la más vieja
+
+    Con user_id, sólo las que tienen movimientos de ese usuario.
+    """
+    if user_id is None:
+        filas = conn.execute('SELECT mes, archivo, desde, hasta FROM particiones ORDER BY mes DESC')
+    else:
+        filas = conn.execute(
+            'SELECT p.mes, p.archivo, p.desde, p.hasta FROM particiones_usuarios pu JOIN particiones p ON p.mes = pu.mes WHERE pu.user_id = ? ORDER BY pu.mes DESC',
             (user_id,)
         )
-        conn.commit()
-        conn.close()
-        return True
-    except sqlite3.Error as e:
-        print(f"Error al actualizar interacciones: {e}")
-        if conn:
-            conn.rollback()
-            conn.close()
-        return False
+    return [Particion._make(fila) for fila in filas]
 
 
-def get_balance(user_id):
-    """Obtener saldo del usuario"""
+def partition_path(archivo):
+    """Ruta de un archivo de partición (se guarda relativo al directorio de la base)"""
+    return os.path.join(os.path.dirname(DB_PATH) or ".", archivo)
+
+
+@contextmanager
+def open_partition(particion):
+    """Conexión de sólo lectura a una partición, cerrada al salir del bloque"""
+    uri = pathlib.Path(partition_path(particion.archivo)).absolute().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, timeout=POOL_TIMEOUT)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT saldo FROM usuarios WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
+        yield conn
+    finally:
         conn.close()
 
-        if result:
-            # Formatear el saldo como moneda
-            return f"$ {result[0]:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-        return "$ 0,00"
+
+def get_transactions(user_id, limit=5):
+    """Obtener últimos movimientos (lista de Movimiento)"""
+    try:
+        return [Movimiento._make(fila) for fila in _select_transactions_after(user_id, None, limit)]
     except sqlite3.Error as e:
-        print(f"Error al obtener saldo: {e}")
-        if conn:
-            conn.close()
-        return "$ 0,00"
+        logger.error("Error al obtener transacciones: %s", e)
+        return []
 
 
-def save_transaction(user_id, descripcion, monto):
-    """Guardar un movimiento en la cuenta"""
+def _consultar_pagina(conn, user_id, cursor_pagina, cantidad):
+    if cursor_pagina is None:
+        return conn.execute(
+            'SELECT id, descripcion, monto_centavos, fecha FROM movimientos WHERE user_id = ? ORDER BY fecha DESC, id DESC LIMIT ?',
+            (user_id, cantidad)
+        ).fetchall()
+    fecha, mov_id = cursor_pagina
+    return conn.execute(
+        'SELECT id, descripcion, monto_centavos, fecha FROM movimientos WHERE user_id = ? AND (fecha, id) < (?, ?) ORDER BY fecha DESC, id DESC LIMIT ?',
+        (user_id, fecha, mov_id, cantidad)
+    ).fetchall()
+
+
+def _select_transactions_after(user_id, cursor_pagina, cantidad):
+    """Movimientos anteriores al cursor (fecha, id), del más reciente al más antiguo"""
+    with get_pool().connection() as conn:
+        filas = _consultar_pagina(conn, user_id, cursor_pagina, cantidad)
+        # Las particiones se leen después de la base caliente: una fila que se
+        # archiva en el medio aparece dos veces (se descarta por id), nunca ninguna
+        particiones = list_partitions(conn, user_id)
+    if not particiones:
+        return filas
+
+    archivadas = []
+    for particion in particiones:
+        if cursor_pagina is not None and particion.desde > cursor_pagina[0]:
+            continue
+        # Esta partición y las siguientes sólo tienen filas más viejas que las que ya hay
+        if len(archivadas) >= cantidad or (len(filas) >= cantidad and filas[-1][3] >= particion.hasta):
+            break
+        try:
+            with open_partition(particion) as archivo:
+                archivadas += _consultar_pagina(archivo, user_id, cursor_pagina, cantidad)
+        except sqlite3.Error as e:
+            logger.error("Error al leer la partición %s: %s", particion.mes, e)
+    if not archivadas:
+        return filas
+
+    unicas = {fila[0]: fila for fila in archivadas}
+    unicas.update((fila[0], fila) for fila in filas)
+    return sorted(unicas.values(), key=lambda fila: (fila[3], fila[0]), reverse=True)[:cantidad]
+
+
+def get_transactions_page(user_id, cursor=None, page_size=5):
+    """
+    Obtener una página de movimientos con paginación por cursor (keyset)
+
+    Args:
+        user_id: Usuario
+        cursor: (fecha, id) del último movimiento de la página anterior, o None
+        page_size: Movimientos por página
+
+    Returns:
+        tuple: (lista de Movimiento, cursor de la página siguiente o None)
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # Pedimos uno de más para saber si hay otra página
+        filas = _select_transactions_after(user_id, cursor, page_size + 1)
+        pagina = [Movimiento._make(fila) for fila in filas[:page_size]]
+        siguiente = None
+        if len(filas) > page_size:
+            siguiente = (pagina[-1].fecha, pagina[-1].id)
+        return pagina, siguiente
+    except sqlite3.Error as e:
+        logger.error("Error al obtener transacciones: %s", e)
+        return [], None
 
-        # Guardar movimiento
-        cursor.execute(
-            'INSERT INTO movimientos (user_id, descripcion, monto, fecha) VALUES (?, ?, ?, ?)',
-            (user_id, descripcion, monto, fecha)
-        )
 
-        # Actualizar saldo
-        cursor.execute(
-            'UPDATE usuarios SET saldo = saldo + ? WHERE user_id = ?',
-            (monto, user_id)
-        )
+def iter_transactions(user_id, chunk_size=500):
+    """
+    Recorrer todo el historial de un usuario sin cargarlo completo en memoria
 
-        conn.commit()
-        conn.close()
+    Devuelve (id, descripcion, monto_centavos, fecha) del más reciente al más
+    antiguo, leyendo de a `chunk_size` filas por consulta.
+    """
+    cursor_pagina = None
+    while True:
+        filas = _select_transactions_after(user_id, cursor_pagina, chunk_size)
+        yield from filas
+        if len(filas) < chunk_size:
+            return
+        mov_id, _descripcion, _monto, fecha = filas[-1]
+        cursor_pagina = (fecha, mov_id)
+
+
+def save_loan_simulation(user_id, monto, plazo, tasa, cuota, total):
+    """Guardar simulación de préstamo (montos en pesos)"""
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            fecha = ahora()
+
+            cursor.execute(
+                'INSERT INTO prestamos (user_id, monto_centavos, plazo, tasa, cuota_centavos, total_centavos, fecha) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (user_id, a_centavos(monto), plazo, tasa,
+                 a_centavos(cuota), a_centavos(total), fecha)
+            )
+
+            conn.commit()
         return True
     except sqlite3.Error as e:
-        print(f"Error al guardar transacción: {e}")
-        if conn:
-            conn.rollback()
-            conn.close()
+        logger.error("Error al guardar simulación de préstamo: %s", e)
         return False
 
 
-def get_transactions(user_id, limit=5):
-    """Obtener últimos movimientos"""
+def load_cached_responses(contexto, desde):
+    """Obtener respuestas cacheadas para un contexto, creadas después de `desde`"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT descripcion, monto, fecha FROM movimientos WHERE user_id = ? ORDER BY fecha DESC LIMIT ?',
-            (user_id, limit)
-        )
-        movimientos = cursor.fetchall()
-        conn.close()
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT clave, respuesta, creado FROM respuestas_cache WHERE contexto = ? AND creado > ?',
+                (contexto, desde)
+            )
+            return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error("Error al cargar respuestas cacheadas: %s", e)
+        return []
 
-        # Formatear los movimientos
-        formatted_movimientos = []
-        for mov in movimientos:
-            descripcion, monto, fecha = mov
-            signo = "🟢 +" if monto > 0 else "🔴 -"
-            monto_fmt = f"$ {abs(monto):,.2f}".replace(
-                ',', 'X').replace('.', ',').replace('X', '.')
-            formatted_movimientos.append(
-                f"{signo} {monto_fmt} - {descripcion}")
 
-        return formatted_movimientos
+def save_cached_response(clave, contexto, respuesta):
+    """Guardar (o reemplazar) una respuesta cacheada"""
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT OR REPLACE INTO respuestas_cache (clave, contexto, respuesta, creado) VALUES (?, ?, ?, ?)',
+                (clave, contexto, respuesta, time.time())
+            )
+            conn.commit()
+        return True
     except sqlite3.Error as e:
-        print(f"Error al obtener transacciones: {e}")
-        if conn:
-            conn.close()
-        return []
+        logger.error("Error al guardar respuesta cacheada: %s", e)
+        return False
 
 
-def save_loan_simulation(user_id, monto, plazo, tasa, cuota, total):
-    """Guardar simulación de préstamo"""
+def delete_cached_responses(excepto_contexto=None):
+    """Borrar respuestas cacheadas de contextos viejos (o todas)"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'DELETE FROM respuestas_cache WHERE contexto IS NOT ?',
+                (excepto_contexto,)
+            )
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error("Error al borrar respuestas cacheadas: %s", e)
+        return False
 
-        cursor.execute(
-            'INSERT INTO prestamos (user_id, monto, plazo, tasa, cuota, total, fecha) VALUES (?, ?, ?, ?, ?, ?, ?)',
-            (user_id, monto, plazo, tasa, cuota, total, fecha)
-        )
 
-        conn.commit()
-        conn.close()
+def load_session(user_id):
+    """
+    Obtener la sesión guardada de un usuario
+
+    Returns:
+        tuple: (datos JSON, versión, actualizado) o None si no hay sesión
+    """
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT datos, version, actualizado FROM sesiones WHERE user_id = ?',
+                (user_id,)
+            )
+            return cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error("Error al cargar sesión: %s", e)
+        return None
+
+
+def save_sessions(sesiones, conversaciones=()):
+    """
+    Guardar sesiones y estados de conversación en una sola transacción
+
+    Args:
+        sesiones: Lista de (user_id, datos JSON)
+        conversaciones: Lista de (nombre, clave JSON, estado JSON); un estado
+            None termina la conversación
+
+    Returns:
+        dict: user_id -> versión guardada, o None si hubo un error
+    """
+    momento = ahora()
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            versiones = {}
+            for user_id, datos in sesiones:
+                cursor.execute('''
+                INSERT INTO sesiones (user_id, datos, version, actualizado) VALUES (?, ?, 1, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    datos = excluded.datos,
+                    version = version + 1,
+                    actualizado = excluded.actualizado
+                RETURNING version
+                ''', (user_id, datos, momento))
+                versiones[user_id] = cursor.fetchone()[0]
+            cursor.executemany(
+                'INSERT OR REPLACE INTO conversaciones (nombre, clave, estado, actualizado) VALUES (?, ?, ?, ?)',
+                [(nombre, clave, estado, momento)
+                 for nombre, clave, estado in conversaciones if estado is not None]
+            )
+            cursor.executemany(
+                'DELETE FROM conversaciones WHERE nombre = ? AND clave = ?',
+                [(nombre, clave) for nombre, clave, estado in conversaciones if estado is None]
+            )
+            conn.commit()
+            return versiones
+    except sqlite3.Error as e:
+        logger.error("Error al guardar sesiones: %s", e)
+        return None
+
+
+def delete_session(user_id):
+    """Borrar la sesión de un usuario"""
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM sesiones WHERE user_id = ?', (user_id,))
+            conn.commit()
         return True
     except sqlite3.Error as e:
-        print(f"Error al guardar simulación de préstamo: {e}")
-        if conn:
-            conn.rollback()
-            conn.close()
+        logger.error("Error al borrar sesión: %s", e)
         return False
+
+
+def load_conversations(nombre, desde):
+    """Estados de una conversación actualizados después de `desde`: lista de (clave, estado)"""
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT clave, estado FROM conversaciones WHERE nombre = ? AND actualizado > ?',
+                (nombre, desde)
+            )
+            return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error("Error al cargar conversaciones: %s", e)
+        return []
+
+
+def purge_sessions(antes):
+    """
+    Borrar sesiones y conversaciones sin actividad desde `antes`
+
+    Returns:
+        int: Filas borradas
+    """
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM sesiones WHERE actualizado < ?', (antes,))
+            borradas = cursor.rowcount
+            cursor.execute('DELETE FROM conversaciones WHERE actualizado < ?', (antes,))
+            borradas += cursor.rowcount
+            conn.commit()
+        return borradas
+    except sqlite3.Error as e:
+        logger.error("Error al purgar sesiones: %s", e)
+        return 0
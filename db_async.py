@@ -0,0 +1,163 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import metrics
+
+# Hilos dedicados a la base de datos y límite de llamadas pendientes
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+DB_MAX_PENDING = int(os.getenv("DB_MAX_PENDING", "100"))
+
+_executor = None
+_semaforo = None
+_pendientes = 0
+_metricas = {}
+_metricas_lock = threading.Lock()
+
+DB_CALL_SECONDS = metrics.histogram(
+    "db_call_seconds", "Duración de cada función de db.py en el executor", ("function",))
+DB_CALL_WAIT_SECONDS = metrics.histogram(
+    "db_call_wait_seconds", "Espera en la cola del executor antes de ejecutar", ("function",))
+DB_CALL_ERRORS = metrics.counter(
+    "db_call_errors_total", "Funciones de db.py que lanzaron una excepción", ("function",))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=DB_WORKERS, thread_name_prefix="db")
+    return _executor
+
+
+def _get_semaforo():
+    global _semaforo
+    if _semaforo is None:
+        _semaforo = asyncio.Semaphore(DB_MAX_PENDING)
+    return _semaforo
+
+
+def _registrar(nombre, espera, duracion, error):
+    with _metricas_lock:
+        m = _metricas.setdefault(nombre, {
+            "calls": 0, "errors": 0, "wait_total": 0.0,
+            "time_total": 0.0, "time_max": 0.0
+        })
+        m["calls"] += 1
+        m["errors"] += int(error)
+        m["wait_total"] += espera
+        m["time_total"] += duracion
+        m["time_max"] = max(m["time_max"], duracion)
+    DB_CALL_SECONDS.observe(duracion, nombre)
+    DB_CALL_WAIT_SECONDS.observe(espera, nombre)
+    if error:
+        DB_CALL_ERRORS.inc(nombre)
+
+
+def _ejecutar(func, args, kwargs, encolado):
+    """Corre en un hilo del executor y mide espera en cola y ejecución"""
+    inicio = time.perf_counter()
+    error = True
+    try:
+        resultado = func(*args, **kwargs)
+        error = False
+        return resultado
+    finally:
+        fin = time.perf_counter()
+        _registrar(func.__name__, inicio - encolado, fin - inicio, error)
+
+
+async def run(func, *args, **kwargs):
+    """
+    Ejecuta una función síncrona de db.py sin bloquear el event loop
+
+    Si ya hay DB_MAX_PENDING llamadas en curso, espera a que se libere
+    un lugar antes de encolar (backpressure).
+    """
+    global _pendientes
+    loop = asyncio.get_running_loop()
+    async with _get_semaforo():
+        _pendientes += 1
+        try:
+            return await loop.run_in_executor(
+                _get_executor(),
+                functools.partial(_ejecutar, func, args,
+                                  kwargs, time.perf_counter())
+            )
+        finally:
+            _pendientes -= 1
+
+
+def get_stats():
+    """Latencia por función (espera en cola y ejecución) y profundidad de cola"""
+    with _metricas_lock:
+        funciones = {
+            nombre: {
+                "calls": m["calls"],
+                "errors": m["errors"],
+                "avg_wait_ms": m["wait_total"] / m["calls"] * 1000,
+                "avg_time_ms": m["time_total"] / m["calls"] * 1000,
+                "max_time_ms": m["time_max"] * 1000,
+            }
+            for nombre, m in _metricas.items()
+        }
+    return {
+        "pending": _pendientes,
+        "max_pending": DB_MAX_PENDING,
+        "workers": DB_WORKERS,
+        "functions": funciones,
+    }
+
+
+metrics.gauge("db_executor_pending", "Llamadas a la base en curso o en cola", lambda: _pendientes)
+
+
+def shutdown():
+    """Esperar las llamadas en curso y cerrar el pool de conexiones"""
+    global _executor, _semaforo
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    _semaforo = None
+    db.stop_interactions_buffer()
+    db.close_pool()
+
+
+async def get_user(user_id):
+    return await run(db.get_user, user_id)
+
+
+async def create_user(user_id, nombre="Usuario"):
+    return await run(db.create_user, user_id, nombre)
+
+
+async def create_users(usuarios, chunk_size=db.CREATE_USERS_CHUNK):
+    return await run(db.create_users, usuarios, chunk_size)
+
+
+async def update_interactions(user_id):
+    return await run(db.update_interactions, user_id)
+
+
+async def get_balance(user_id):
+    return await run(db.get_balance, user_id)
+
+
+async def save_transaction(user_id, descripcion, monto):
+    return await run(db.save_transaction, user_id, descripcion, monto)
+
+
+async def get_transactions(user_id, limit=5):
+    return await run(db.get_transactions, user_id, limit)
+
+
+async def get_transactions_page(user_id, cursor=None, page_size=5):
+    return await run(db.get_transactions_page, user_id, cursor, page_size)
+
+
+async def save_loan_simulation(user_id, monto, plazo, tasa, cuota, total):
+    return await run(db.save_loan_simulation, user_id, monto, plazo, tasa, cuota, total)
@@ -0,0 +1,257 @@
+"""
+Importación masiva de movimientos desde archivos del core bancario
+
+Acepta CSV (con encabezado) o JSONL con los campos:
+    ref          clave única del movimiento en el core (idempotencia)
+    user_id      usuario
+    descripcion  texto del movimiento
+    monto        importe en pesos, con punto decimal ("-1500.50")
+    fecha        epoch o fecha ISO ("2025-05-13 13:53:42"); opcional
+
+Las filas se procesan por bloques: cada bloque se inserta con executemany
+dentro de una transacción, junto con la actualización del saldo de cada
+usuario (un solo UPDATE por usuario por bloque). Los movimientos cuya ref
+ya existe se ignoran, así se puede reimportar un archivo sin duplicar.
+Los usuarios afectados se anotan en invalidaciones_usuarios para que el bot,
+que corre en otro proceso, descarte sus saldos cacheados.
+
+Uso:
+    python importer.py movimientos_20250513.csv [--chunk-size 50000]
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+import db
+
+CHUNK_SIZE = 50000
+# Máximo de parámetros por consulta IN (...) al buscar referencias existentes
+LOTE_REFERENCIAS = 500
+# Mayor monto que entra en una columna INTEGER de SQLite
+MAX_CENTAVOS = 2 ** 63 - 1
+
+
+def leer_filas(ruta):
+    """
+    Recorre el archivo fila por fila sin cargarlo completo
+
+    Las líneas JSONL se devuelven sin parsear (las convierte parsear_fila)
+    y los bytes que no son UTF-8 quedan como sustitutos: una línea corrupta se
+    rechaza como cualquier otra fila inválida en lugar de cortar la importación.
+    """
+    with open(ruta, newline='', encoding='utf-8', errors='surrogateescape') as archivo:
+        if ruta.endswith(('.jsonl', '.ndjson')):
+            for linea in archivo:
+                if linea.strip():
+                    yield linea
+        else:
+            yield from csv.DictReader(archivo)
+
+
+def _texto(valor):
+    texto = str(valor or '').strip()
+    try:
+        texto.encode('utf-8')
+    except UnicodeEncodeError:
+        raise ValueError(f"texto que no es UTF-8: {texto!r}") from None
+    return texto
+
+
+def _a_epoch(fecha):
+    if fecha in (None, ''):
+        return db.ahora()
+    if isinstance(fecha, (int, float)) or str(fecha).isdigit():
+        return int(fecha)
+    return int(datetime.fromisoformat(str(fecha)).timestamp())
+
+
+def parsear_fila(fila):
+    """
+    Validar y convertir una fila del archivo (dict de CSV o línea JSONL)
+
+    Returns:
+        tuple: (ref, user_id, descripcion, monto_centavos, fecha)
+
+    Raises:
+        ValueError: si falta un campo o tiene un formato inválido
+    """
+    try:
+        if isinstance(fila, str):
+            try:
+                fila = json.loads(fila)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"JSON inválido: {e}") from e
+        ref = _texto(fila['ref'])
+        if not ref:
+            raise ValueError("ref vacía")
+        monto = Decimal(str(fila['monto']).strip())
+        if not monto.is_finite():
+            raise ValueError(f"monto no finito: {fila['monto']!r}")
+        centavos = int((monto * 100).to_integral_value())
+        if abs(centavos) > MAX_CENTAVOS:
+            raise ValueError(f"monto fuera de rango: {fila['monto']!r}")
+        return (
+            ref,
+            int(fila['user_id']),
+            _texto(fila.get('descripcion')),
+            centavos,
+            _a_epoch(fila.get('fecha')),
+        )
+    except (KeyError, TypeError, AttributeError, InvalidOperation) as e:
+        raise ValueError(f"fila inválida: {e!r}") from e
+
+
+def _referencias_existentes(conn, refs):
+    existentes = set()
+    for i in range(0, len(refs), LOTE_REFERENCIAS):
+        lote = refs[i:i + LOTE_REFERENCIAS]
+        marcas = ",".join("?" * len(lote))
+        existentes.update(r for (r,) in conn.execute(
+            f'SELECT ref_externa FROM movimientos WHERE ref_externa IN ({marcas})', lote))
+    return existentes
+
+
+def _movimientos_archivados(conn):
+    """Total de movimientos archivados: cambia cada vez que el archivador borra de la base caliente"""
+    return conn.execute('SELECT COALESCE(SUM(movimientos), 0) FROM particiones').fetchone()[0]
+
+
+def _referencias_archivadas(conn, refs):
+    """Referencias que ya están en alguna partición del historial archivado"""
+    archivadas = set()
+    for particion in db.list_partitions(conn):
+        with db.open_partition(particion) as archivo:
+            archivadas |= _referencias_existentes(archivo, refs)
+    return archivadas
+
+
+def importar_bloque(conn, movimientos):
+    """
+    Insertar un bloque de movimientos y aplicar los saldos en una transacción
+
+    Returns:
+        tuple: (movimientos insertados, ids de los usuarios afectados)
+    """
+    # Duplicados dentro del mismo bloque: nos quedamos con el primero
+    unicos = {}
+    for mov in movimientos:
+        unicos.setdefault(mov[0], mov)
+
+    # Las particiones se leen antes de tomar el lock de escritura
+    archivados = _movimientos_archivados(conn)
+    existentes = _referencias_archivadas(conn, list(unicos))
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        existentes |= _referencias_existentes(conn, [r for r in unicos if r not in existentes])
+        if _movimientos_archivados(conn) != archivados:
+            # El archivador movió filas en el medio: pudieron salir de la base
+            # caliente después de leer las particiones (raro, se vuelve a mirar)
+            existentes |= _referencias_archivadas(conn, [r for r in unicos if r not in existentes])
+        nuevos = [mov for ref, mov in unicos.items() if ref not in existentes]
+
+        # Deltas de saldo agregados por usuario
+        deltas = {}
+        for _ref, user_id, _descripcion, monto_centavos, _fecha in nuevos:
+            deltas[user_id] = deltas.get(user_id, 0) + monto_centavos
+
+        conn.executemany(
+            'INSERT INTO movimientos (ref_externa, user_id, descripcion, monto_centavos, fecha) VALUES (?, ?, ?, ?, ?)',
+            nuevos
+        )
+        # Usuarios que existen en el core pero todavía no usaron el bot
+        fecha = db.ahora()
+        conn.executemany(
+            'INSERT OR IGNORE INTO usuarios (user_id, nombre, saldo_centavos, fecha_registro) VALUES (?, ?, 0, ?)',
+            [(user_id, "Usuario", fecha) for user_id in deltas]
+        )
+        conn.executemany(
+            'UPDATE usuarios SET saldo_centavos = saldo_centavos + ? WHERE user_id = ?',
+            [(delta, user_id) for user_id, delta in deltas.items()]
+        )
+        # El bot corre en otro proceso: su caché de usuarios se entera por la base
+        db.notify_user_changes(conn, deltas)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+    for user_id in deltas:
+        db.invalidate_user(user_id)
+    return len(nuevos), deltas.keys()
+
+
+def importar(ruta, chunk_size=CHUNK_SIZE, progreso=print):
+    """
+    Importar un archivo de movimientos completo
+
+    Returns:
+        dict: filas leídas, insertadas, duplicadas, rechazadas, usuarios y segundos
+    """
+    stats = {"leidas": 0, "insertadas": 0, "duplicadas": 0,
+             "rechazadas": 0, "usuarios": 0, "segundos": 0.0}
+    usuarios = set()
+    inicio = time.perf_counter()
+    filas = leer_filas(ruta)
+
+    with db.get_pool().connection() as conn:
+        while True:
+            bloque = list(islice(filas, chunk_size))
+            if not bloque:
+                break
+
+            movimientos = []
+            for numero, fila in enumerate(bloque, stats["leidas"] + 1):
+                try:
+                    movimientos.append(parsear_fila(fila))
+                except ValueError as e:
+                    stats["rechazadas"] += 1
+                    if stats["rechazadas"] <= 10:
+                        progreso(f"⚠️ Fila {numero} rechazada: {e}")
+
+            insertadas, afectados = importar_bloque(conn, movimientos)
+            usuarios.update(afectados)
+            stats["leidas"] += len(bloque)
+            stats["insertadas"] += insertadas
+            stats["duplicadas"] += len(movimientos) - insertadas
+
+            segundos = time.perf_counter() - inicio
+            progreso(
+                f"{stats['leidas']:,} filas leídas · {stats['insertadas']:,} nuevas · "
+                f"{stats['duplicadas']:,} duplicadas · {stats['rechazadas']:,} rechazadas · "
+                f"{stats['leidas'] / segundos:,.0f} filas/s"
+            )
+
+    stats["usuarios"] = len(usuarios)
+    stats["segundos"] = time.perf_counter() - inicio
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("archivo", help="archivo .csv o .jsonl")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="filas por transacción")
+    args = parser.parse_args()
+
+    if not db.init_db():
+        raise SystemExit(1)
+    try:
+        stats = importar(args.archivo, args.chunk_size)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error al importar movimientos: {e}")
+        raise SystemExit(1)
+    finally:
+        db.close_pool()
+
+    print(f"✅ Importación terminada en {stats['segundos']:.1f} s: "
+          f"{stats['insertadas']:,} movimientos nuevos de {stats['usuarios']:,} usuarios")
+
+
+if __name__ == "__main__":
+    main()
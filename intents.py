@@ -0,0 +1,178 @@
+import re
+from collections import namedtuple
+
+from text import strip_accents
+
+# Resultado de clasificar un mensaje
+Intencion = namedtuple("Intencion", "intent confidence entities")
+
+# Palabras clave por intención (se comparan sin tildes y por palabra completa).
+# El orden define la prioridad en caso de empate.
+DEFAULT_INTENTS = {
+    "saldo": {
+        "saldo": 2, "cuanto tengo": 2, "cuanta plata tengo": 2,
+        "cuanto dinero tengo": 2, "en mi cuenta": 1, "disponible": 1,
+        "plata disponible": 2,
+    },
+    "movimientos": {
+        "movimientos": 2, "movimiento": 2, "transacciones": 2,
+        "transaccion": 2, "gastos": 1, "gaste": 1, "ultimos": 1,
+        "recientes": 1, "historial": 2,
+    },
+    "prestamo": {
+        "prestamo": 2, "prestamos": 2, "credito": 1, "credito personal": 2,
+        "solicitar": 1, "pedir": 1, "pido": 1, "necesito dinero": 2,
+        "necesito plata": 2, "simular": 1, "simulacion": 1, "pagaria": 1,
+        "cuotas": 1,
+    },
+    "general": {
+        "tarjeta": 2, "tarjetas": 2, "tarjeta de credito": 3,
+        "tarjetas de credito": 3, "visa": 2, "mastercard": 2,
+        "plazo fijo": 2, "plazos fijos": 2, "uva": 1, "tasa": 2,
+        "cual es": 1, "conviene": 1, "requisitos": 1, "sin interes": 2,
+    },
+}
+
+_MULTIPLICADORES = {"mil": 1_000, "k": 1_000, "millon": 1_000_000,
+                    "millones": 1_000_000}
+
+# Entidades: plazo ("24 cuotas", "2 años") y monto ("100.000", "$ 50 mil")
+_PATRON_PLAZO = r"\b(?P<plazo>\d{1,3})\s*(?P<unidad>cuotas?|mes(?:es)?|a[ñn]os?)\b"
+_PATRON_MONTO = (
+    r"(?P<monto>(?:\$\s*)?\b(?:\d{1,3}(?:\.\d{3})+|\d+)(?:,\d+)?)"
+    r"(?:\s*(?P<mult>mil|k|millon(?:es)?)\b)?"
+)
+
+
+# Vocales con tilde o diéresis y signos de apertura; el resto pasa por strip_accents.
+# Encadenar replace es varias veces más rápido que str.translate con caracteres
+# no ASCII.
+_SIN_TILDES = (("á", "a"), ("é", "e"), ("í", "i"), ("ó", "o"), ("ú", "u"),
+               ("ü", "u"), ("à", "a"), ("è", "e"), ("ì", "i"), ("ò", "o"),
+               ("ù", "u"), ("¿", " "), ("¡", " "))
+_HAY_ENTIDADES = re.compile(r"[\d$]")
+_PALABRA = re.compile(r"\w+")
+
+
+def fold(texto):
+    """Minúsculas y sin tildes, con espacios simples"""
+    texto = texto.lower()
+    if not texto.isascii():
+        for con_tilde, sin_tilde in _SIN_TILDES:
+            if con_tilde in texto:
+                texto = texto.replace(con_tilde, sin_tilde)
+        if not texto.replace("ñ", "").isascii():
+            texto = strip_accents(texto)
+    return " ".join(texto.split())
+
+
+def _parse_monto(texto, mult):
+    texto = texto.replace("$", "").strip().replace(".", "").replace(",", ".")
+    monto = float(texto) * _MULTIPLICADORES.get(mult, 1)
+    return int(monto) if monto.is_integer() else monto
+
+
+class IntentClassifier:
+    """
+    Clasificador de intenciones basado en palabras clave
+
+    Las palabras clave se indexan por su primera palabra, así cada mensaje se
+    parte en palabras una sola vez y se buscan en un diccionario; los
+    patrones de monto y plazo sólo se prueban si el mensaje tiene algún
+    dígito o "$".
+
+    Sigue siendo más lento que buscar subcadenas (unas 3 a 4 veces en
+    benchmarks.intents), a cambio de palabras completas, pesos, entidades y
+    acertar las 32 consultas del corpus contra 20.
+    """
+
+    def __init__(self, intents=None, default="general"):
+        self.default = default
+        self._intents = {}
+        self._indice = None
+        self._entidades = re.compile(rf"{_PATRON_PLAZO}|{_PATRON_MONTO}")
+        for nombre, palabras in (intents or DEFAULT_INTENTS).items():
+            self.add_intent(nombre, palabras)
+
+    def add_intent(self, nombre, palabras):
+        """Registrar (o ampliar) una intención: {palabra_clave: peso}"""
+        claves = self._intents.setdefault(nombre, {})
+        for palabra, peso in palabras.items():
+            claves[fold(palabra)] = peso
+        self._indice = None
+
+    def _compilar(self):
+        self._prioridad = {nombre: -i for i, nombre in enumerate(self._intents)}
+        # Índice por primera palabra: {palabra: [(frase, intención, peso), ...]}
+        # con las frases más largas primero para que "tarjeta de credito" gane
+        # a "tarjeta".
+        indice = {}
+        vistas = set()
+        for nombre, claves in self._intents.items():
+            for palabra, peso in claves.items():
+                frase = _PALABRA.findall(palabra)
+                if frase and tuple(frase) not in vistas:
+                    vistas.add(tuple(frase))
+                    indice.setdefault(frase[0], []).append((frase, nombre, peso))
+        for frases in indice.values():
+            frases.sort(key=lambda entrada: len(entrada[0]), reverse=True)
+        self._indice = indice
+
+    def classify(self, mensaje):
+        """
+        Clasifica un mensaje en una sola pasada
+
+        Returns:
+            Intencion: intención, confianza (0 a 1) y entidades ("monto", "plazo")
+        """
+        if self._indice is None:
+            self._compilar()
+
+        texto = fold(mensaje)
+        puntajes = {}
+        indice = self._indice
+        tokens = _PALABRA.findall(texto)
+        siguiente = 0
+        for i, token in enumerate(tokens):
+            frases = indice.get(token)
+            if frases is None or i < siguiente:
+                continue
+            for frase, nombre, peso in frases:
+                fin = i + len(frase)
+                if fin == i + 1 or tokens[i:fin] == frase:
+                    puntajes[nombre] = puntajes.get(nombre, 0) + peso
+                    siguiente = fin
+                    break
+
+        entidades = {}
+        if _HAY_ENTIDADES.search(texto):
+            for m in self._entidades.finditer(texto):
+                if m.group("plazo"):
+                    plazo = int(m.group("plazo"))
+                    if m.group("unidad").startswith("a"):
+                        plazo *= 12
+                    entidades.setdefault("plazo", plazo)
+                    # Un plazo en cuotas/meses es una pista de préstamo
+                    if "prestamo" in self._intents:
+                        puntajes["prestamo"] = puntajes.get("prestamo", 0) + 1
+                else:
+                    entidades.setdefault(
+                        "monto", _parse_monto(m.group("monto"), m.group("mult")))
+
+        total = sum(puntajes.values())
+        if not total:
+            return Intencion(self.default, 0.0, entidades)
+
+        if len(puntajes) == 1:
+            intent = next(iter(puntajes))
+        else:
+            # En caso de empate gana la intención registrada primero
+            prioridad = self._prioridad
+            intent = max(puntajes,
+                         key=lambda nombre: (puntajes[nombre], prioridad[nombre]))
+        confianza = puntajes[intent] / total
+
+        # Con monto y plazo podemos simular el préstamo directamente
+        if intent == "prestamo" and "monto" in entidades and "plazo" in entidades:
+            intent = "simulacion"
+        return Intencion(intent, round(confianza, 3), entidades)
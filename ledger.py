@@ -0,0 +1,339 @@
+"""
+Checkpoints de saldo y auditoría incremental del libro mayor
+
+usuarios.saldo_centavos se mantiene con incrementos (saldo = saldo + ?) al
+guardar movimientos. Este módulo guarda cada tanto el saldo de cada usuario
+"hasta el movimiento N" (saldos_checkpoint) y compara el saldo registrado
+contra el último checkpoint más los movimientos posteriores. Cada auditoría
+sólo lee los movimientos nuevos desde la anterior, así su costo depende de
+la actividad y no del historial completo.
+
+Un checkpoint (user_id, hasta_id) vale la suma de los movimientos del
+usuario con id <= hasta_id; hasta_fecha es la fecha más nueva entre ellos.
+Los movimientos importados con fecha anterior quedan después del checkpoint
+por id, así que balance_at los filtra por fecha y el checkpoint sigue válido.
+archive.py sólo archiva movimientos ya auditados; balance_at suma también
+los de las particiones porque puede partir de un checkpoint viejo.
+
+Uso:
+    python ledger.py                              # una auditoría
+    python ledger.py --user 123                   # verificar un usuario
+    python ledger.py --user 123 --fecha 2025-05-01
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Segundos entre auditorías en segundo plano (0 las desactiva)
+LEDGER_AUDIT_INTERVAL = float(os.getenv("LEDGER_AUDIT_INTERVAL", "300"))
+# Antigüedad mínima de un checkpoint para conservarlo como historial; los más
+# nuevos se reemplazan, así queda como máximo uno por usuario por intervalo
+LEDGER_CHECKPOINT_INTERVAL = int(os.getenv("LEDGER_CHECKPOINT_INTERVAL", "86400"))
+# Diferencias que se detallan en el log por auditoría
+DIFERENCIAS_EN_LOG = 20
+# Ids por consulta IN al descartar movimientos archivados que siguen en la base caliente
+LOTE_IDS = 500
+
+CURSOR = "ultimo_movimiento_auditado"
+
+LEDGER_AUDIT_SECONDS = metrics.histogram(
+    "ledger_audit_seconds", "Duración de cada auditoría incremental del libro mayor")
+LEDGER_AUDITED = metrics.counter(
+    "ledger_movements_audited_total", "Movimientos procesados por el auditor")
+LEDGER_MISMATCHES = metrics.counter(
+    "ledger_mismatches_total", "Usuarios cuyo saldo no coincide con sus movimientos")
+
+
+def _ultimo_checkpoint(cursor, user_id):
+    cursor.execute(
+        'SELECT hasta_id, hasta_fecha, saldo_centavos, creado FROM saldos_checkpoint '
+        'WHERE user_id = ? ORDER BY hasta_id DESC LIMIT 1',
+        (user_id,)
+    )
+    return cursor.fetchone()
+
+
+def _saldo_hasta(cursor, user_id, hasta_id):
+    """Suma completa de los movimientos del usuario con id <= hasta_id"""
+    cursor.execute(
+        'SELECT COALESCE(SUM(monto_centavos), 0), COALESCE(MAX(fecha), 0) FROM movimientos '
+        'WHERE user_id = ? AND id <= ?',
+        (user_id, hasta_id)
+    )
+    return cursor.fetchone()
+
+
+def _leer_cursor(cursor):
+    cursor.execute('SELECT valor FROM auditoria WHERE clave = ?', (CURSOR,))
+    fila = cursor.fetchone()
+    return fila[0] if fila else 0
+
+
+def audit():
+    """
+    Auditar los movimientos nuevos desde la auditoría anterior
+
+    Lee en una sola transacción (una foto consistente de movimientos y
+    saldos), y después guarda los checkpoints y avanza el cursor en otra.
+
+    Returns:
+        dict: movimientos y usuarios procesados, y diferencias como lista
+            de (user_id, saldo registrado, saldo según movimientos)
+    """
+    inicio = time.perf_counter()
+    resultado = {"movimientos": 0, "usuarios": 0, "diferencias": []}
+    try:
+        with db.get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN')
+            try:
+                desde = _leer_cursor(cursor)
+                cursor.execute('SELECT COALESCE(MAX(id), 0) FROM movimientos')
+                hasta = cursor.fetchone()[0]
+                if hasta <= desde:
+                    return resultado
+                cursor.execute(
+                    'SELECT user_id, SUM(monto_centavos), MAX(fecha), COUNT(*) FROM movimientos '
+                    'WHERE id > ? AND id <= ? GROUP BY user_id',
+                    (desde, hasta)
+                )
+                deltas = cursor.fetchall()
+
+                checkpoints = []
+                for user_id, delta, max_fecha, cantidad in deltas:
+                    anterior = _ultimo_checkpoint(cursor, user_id)
+                    if anterior is None:
+                        # Sin checkpoint previo: se suma una vez lo ya auditado
+                        saldo_previo, fecha_previa = _saldo_hasta(cursor, user_id, desde)
+                    else:
+                        saldo_previo, fecha_previa = anterior[2], anterior[1]
+                    saldo = saldo_previo + delta
+                    checkpoints.append(
+                        (user_id, hasta, max(fecha_previa, max_fecha), saldo, anterior))
+                    resultado["movimientos"] += cantidad
+
+                    cursor.execute(
+                        'SELECT saldo_centavos FROM usuarios WHERE user_id = ?', (user_id,))
+                    fila = cursor.fetchone()
+                    registrado = fila[0] if fila else None
+                    if registrado != saldo:
+                        resultado["diferencias"].append((user_id, registrado, saldo))
+            finally:
+                conn.commit()
+
+            creado = db.ahora()
+            cursor.execute('BEGIN IMMEDIATE')
+            if _leer_cursor(cursor) != desde:
+                # Otro proceso auditó el mismo tramo mientras tanto
+                conn.rollback()
+                return resultado
+            for user_id, hasta_id, hasta_fecha, saldo, anterior in checkpoints:
+                if anterior is not None and creado - anterior[3] < LEDGER_CHECKPOINT_INTERVAL:
+                    cursor.execute(
+                        'DELETE FROM saldos_checkpoint WHERE user_id = ? AND hasta_id = ?',
+                        (user_id, anterior[0])
+                    )
+                cursor.execute(
+                    'INSERT INTO saldos_checkpoint (user_id, hasta_id, hasta_fecha, saldo_centavos, creado) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (user_id, hasta_id, hasta_fecha, saldo, creado)
+                )
+            cursor.execute(
+                'INSERT INTO auditoria (clave, valor) VALUES (?, ?) '
+                'ON CONFLICT (clave) DO UPDATE SET valor = excluded.valor',
+                (CURSOR, hasta)
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error("Error al auditar movimientos: %s", e)
+        return resultado
+    finally:
+        LEDGER_AUDIT_SECONDS.observe(time.perf_counter() - inicio)
+
+    resultado["usuarios"] = len(checkpoints)
+    LEDGER_AUDITED.inc(n=resultado["movimientos"])
+    diferencias = resultado["diferencias"]
+    if diferencias:
+        LEDGER_MISMATCHES.inc(n=len(diferencias))
+        logger.warning("Auditoría: %s usuarios con saldo distinto a sus movimientos", len(diferencias))
+        for user_id, registrado, calculado in diferencias[:DIFERENCIAS_EN_LOG]:
+            logger.warning("Usuario %s: saldo %s, movimientos %s (centavos)", user_id, registrado, calculado)
+    return resultado
+
+
+def balance_at(user_id, fecha):
+    """
+    Saldo del usuario en centavos al final de `fecha` (epoch)
+
+    Parte del checkpoint más nuevo cuyos movimientos son todos anteriores a
+    la fecha y suma sólo los movimientos posteriores a él, estén en la base
+    caliente o archivados. Una fila que el archivador ya copió pero todavía
+    no borró de la base caliente se cuenta una sola vez.
+    """
+    try:
+        with db.get_pool().connection() as conn:
+            cursor = conn.cursor()
+            # Una sola foto de la base caliente para la suma y para descartar duplicados
+            cursor.execute('BEGIN')
+            try:
+                cursor.execute(
+                    'SELECT hasta_id, saldo_centavos FROM saldos_checkpoint '
+                    'WHERE user_id = ? AND hasta_fecha <= ? ORDER BY hasta_id DESC LIMIT 1',
+                    (user_id, fecha)
+                )
+                hasta_id, saldo = cursor.fetchone() or (0, 0)
+                cursor.execute(
+                    'SELECT COALESCE(SUM(monto_centavos), 0) FROM movimientos '
+                    'WHERE user_id = ? AND id > ? AND fecha <= ?',
+                    (user_id, hasta_id, fecha)
+                )
+                saldo += cursor.fetchone()[0]
+
+                archivados = {}
+                for particion in db.list_partitions(conn, user_id):
+                    if particion.desde > fecha:
+                        continue
+                    with db.open_partition(particion) as archivo:
+                        archivados.update(archivo.execute(
+                            'SELECT id, monto_centavos FROM movimientos '
+                            'WHERE user_id = ? AND id > ? AND fecha <= ?',
+                            (user_id, hasta_id, fecha)
+                        ).fetchall())
+                ids = list(archivados)
+                for i in range(0, len(ids), LOTE_IDS):
+                    lote = ids[i:i + LOTE_IDS]
+                    cursor.execute(
+                        f'SELECT id FROM movimientos WHERE id IN ({",".join("?" * len(lote))})', lote)
+                    for (mov_id,) in cursor.fetchall():
+                        del archivados[mov_id]
+            finally:
+                conn.commit()
+        return saldo + sum(archivados.values())
+    except sqlite3.Error as e:
+        logger.error("Error al calcular saldo histórico: %s", e)
+        return None
+
+
+def verify_user(user_id):
+    """
+    Comparar el saldo registrado con el último checkpoint más los movimientos posteriores
+
+    Returns:
+        tuple: (saldo registrado, saldo según movimientos) en centavos, o None si hay error
+    """
+    try:
+        with db.get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN')
+            try:
+                anterior = _ultimo_checkpoint(cursor, user_id)
+                hasta_id, saldo = (anterior[0], anterior[2]) if anterior else (0, 0)
+                cursor.execute(
+                    'SELECT COALESCE(SUM(monto_centavos), 0) FROM movimientos WHERE user_id = ? AND id > ?',
+                    (user_id, hasta_id)
+                )
+                saldo += cursor.fetchone()[0]
+                cursor.execute('SELECT saldo_centavos FROM usuarios WHERE user_id = ?', (user_id,))
+                fila = cursor.fetchone()
+            finally:
+                conn.commit()
+        return (fila[0] if fila else None), saldo
+    except sqlite3.Error as e:
+        logger.error("Error al verificar saldo: %s", e)
+        return None
+
+
+class Auditor:
+    """Ejecuta audit() cada `intervalo` segundos en un hilo de fondo"""
+
+    def __init__(self, intervalo=LEDGER_AUDIT_INTERVAL):
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def start(self):
+        if self._hilo is not None or not self.intervalo:
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._loop, name="auditor", daemon=True)
+        self._hilo.start()
+
+    def _loop(self):
+        while not self._detener.wait(self.intervalo):
+            audit()
+
+    def stop(self):
+        """Detener el auditor (espera a que termine la auditoría en curso)"""
+        hilo = self._hilo
+        if hilo is not None:
+            self._detener.set()
+            hilo.join()
+            self._hilo = None
+
+
+_auditor = Auditor()
+
+
+def start_auditor():
+    """Iniciar las auditorías periódicas (no hace nada con LEDGER_AUDIT_INTERVAL=0)"""
+    _auditor.start()
+
+
+def stop_auditor():
+    _auditor.stop()
+
+
+def _a_epoch(fecha):
+    """'2025-05-01' o '2025-05-01 13:00:00' a epoch; una fecha sola abarca el día completo"""
+    if fecha.isdigit():
+        return int(fecha)
+    if len(fecha) == 10:
+        fecha += " 23:59:59"
+    return int(datetime.fromisoformat(fecha).timestamp())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--user", type=int, help="verificar sólo este usuario")
+    parser.add_argument("--fecha", help="con --user: saldo al final de esta fecha (ISO o epoch)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not db.init_db():
+        raise SystemExit(1)
+    try:
+        if args.user is not None and args.fecha:
+            saldo = balance_at(args.user, _a_epoch(args.fecha))
+            if saldo is None:
+                raise SystemExit(1)
+            print(f"Saldo de {args.user} al {args.fecha}: {saldo} centavos")
+        elif args.user is not None:
+            verificacion = verify_user(args.user)
+            if verificacion is None:
+                raise SystemExit(1)
+            registrado, calculado = verificacion
+            marca = "✅" if registrado == calculado else "✗"
+            print(f"{marca} Usuario {args.user}: saldo {registrado}, movimientos {calculado} (centavos)")
+            if registrado != calculado:
+                raise SystemExit(1)
+        else:
+            resultado = audit()
+            print(f"Auditados {resultado['movimientos']:,} movimientos de "
+                  f"{resultado['usuarios']:,} usuarios, {len(resultado['diferencias'])} diferencias")
+            if resultado["diferencias"]:
+                raise SystemExit(1)
+    finally:
+        db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Cotización de préstamos por lotes con NumPy
+
+Replica exactamente logic.calculate_loan (mismas operaciones en el mismo
+orden y mismo redondeo) sobre arrays de montos, plazos e interacciones,
+para grillas de comparación y para recotizar las simulaciones guardadas.
+"""
+import logging
+
+import numpy as np
+
+import db
+from logic import TASA_BASE, DESCUENTO_POR_INTERACCION, DESCUENTO_MAXIMO, PLAZO_MAXIMO
+
+logger = logging.getLogger(__name__)
+
+
+def _round2(valores):
+    """
+    Redondeo a 2 decimales idéntico al round() de Python
+
+    np.round multiplica por 100 antes de redondear y puede diferir de round()
+    en los valores que quedan justo en la mitad; esos casos se redondean
+    uno por uno con round().
+    """
+    valores = np.asarray(valores, dtype=np.float64)
+    planos = valores.reshape(-1)
+    redondeados = np.round(planos, 2)
+    escalados = planos * 100
+    dudosos = np.abs(escalados - np.floor(escalados) - 0.5) < 1e-6
+    if dudosos.any():
+        redondeados[dudosos] = [round(float(v), 2) for v in planos[dudosos]]
+    return redondeados.reshape(valores.shape)
+
+
+def _tasas(interacciones):
+    descuento = np.minimum(np.asarray(interacciones, dtype=np.float64)
+                           * DESCUENTO_POR_INTERACCION, DESCUENTO_MAXIMO)
+    tasa_final = TASA_BASE - descuento
+    tem = ((1 + tasa_final / 100) ** (1 / 12) - 1) * 100
+    return tasa_final, tem
+
+
+def calculate_loans(montos, plazos, interacciones=0):
+    """
+    Versión vectorizada de calculate_loan
+
+    Los argumentos se combinan con broadcasting de NumPy, por ejemplo
+    montos[:, None] y plazos[None, :] para una grilla monto x plazo.
+
+    Returns:
+        dict: mismas claves que calculate_loan, con arrays como valores
+    """
+    montos = np.asarray(montos, dtype=np.float64)
+    plazos = np.asarray(plazos)
+    tasa_final, tem = _tasas(interacciones)
+
+    tem_decimal = tem / 100
+    factor = (1 + tem_decimal) ** plazos
+    cuota = montos * (tem_decimal * factor) / (factor - 1)
+    total = cuota * plazos
+
+    forma = np.broadcast_shapes(montos.shape, plazos.shape, tasa_final.shape)
+    return {
+        "monto": np.broadcast_to(montos, forma),
+        "plazo": np.broadcast_to(plazos, forma),
+        "tasa_anual": np.broadcast_to(_round2(tasa_final), forma),
+        "tasa_mensual": np.broadcast_to(_round2(tem), forma),
+        "cuota_mensual": _round2(cuota),
+        "total": _round2(total),
+    }
+
+
+def loan_grid(montos, plazos=range(1, 61), interacciones=0):
+    """
+    Grilla de cuotas para comparar montos y plazos
+
+    Returns:
+        np.ndarray: cuota mensual con forma (len(montos), len(plazos))
+    """
+    montos = np.asarray(montos, dtype=np.float64)[:, None]
+    plazos = np.asarray(plazos)[None, :]
+    return calculate_loans(montos, plazos, interacciones)["cuota_mensual"]
+
+
+def amortization_schedule(monto, plazo, interacciones=0):
+    """
+    Cuadro de amortización (sistema francés) mes a mes
+
+    Returns:
+        np.ndarray: forma (plazo, 3) con columnas interés, capital y saldo
+                    restante al final de cada mes (sin redondear)
+
+    Raises:
+        ValueError: si el monto no es positivo o el plazo no está entre
+                    1 y PLAZO_MAXIMO meses (los mismos límites que el bot)
+    """
+    if not np.isfinite(monto) or monto <= 0:
+        raise ValueError(f"monto inválido: {monto!r}")
+    if isinstance(plazo, bool) or not isinstance(plazo, (int, np.integer)) \
+            or not 1 <= plazo <= PLAZO_MAXIMO:
+        raise ValueError(f"plazo inválido: {plazo!r}")
+
+    _tasa_final, tem = _tasas(interacciones)
+    r = float(tem) / 100
+    factor = (1 + r) ** plazo
+    cuota = monto * (r * factor) / (factor - 1)
+
+    # Saldo después de k pagos: monto*(1+r)^k - cuota*((1+r)^k - 1)/r
+    k = np.arange(plazo + 1, dtype=np.float64)
+    crecimiento = (1 + r) ** k
+    saldos = monto * crecimiento - cuota * (crecimiento - 1) / r
+    saldos[np.abs(saldos) < 1e-6] = 0.0
+
+    cuadro = np.empty((plazo, 3))
+    cuadro[:, 0] = saldos[:-1] * r          # interés
+    cuadro[:, 1] = cuota - cuadro[:, 0]     # capital
+    cuadro[:, 2] = saldos[1:]               # saldo
+    return cuadro
+
+
+def _cotizar(filas):
+    """
+    Cotizar un bloque de filas (id, monto_centavos, plazo, interacciones)
+
+    Las filas sin monto o sin plazo (NULL) se saltean con un aviso en lugar
+    de cortar todo el lote.
+    """
+    validas = [fila for fila in filas if fila[1] is not None and fila[2] is not None]
+    if len(validas) < len(filas):
+        logger.warning("Recotización: %s simulaciones sin monto o plazo salteadas",
+                       len(filas) - len(validas))
+    datos = np.array(validas, dtype=np.int64).reshape(-1, 4)
+    ids = datos[:, 0]
+    return ids, calculate_loans(datos[:, 1] / 100, datos[:, 2], datos[:, 3])
+
+
+def reprice_saved_loans(chunk_size=10000):
+    """
+    Recotizar todas las simulaciones guardadas con la política de tasas actual
+
+    Lee la tabla prestamos por bloques (keyset sobre id), después las
+    particiones archivadas de la más vieja a la más nueva, y usa las
+    interacciones actuales de cada usuario. Si archive.py corre a la vez,
+    una simulación que se archiva en el medio puede aparecer dos veces.
+
+    Yields:
+        tuple: (ids, cotizaciones) por bloque, con cotizaciones como en
+               calculate_loans
+    """
+    ultimo_id = 0
+    while True:
+        with db.get_pool().connection() as conn:
+            filas = conn.execute(
+                '''SELECT p.id, p.monto_centavos, p.plazo, COALESCE(u.interacciones, 0)
+                   FROM prestamos p LEFT JOIN usuarios u ON u.user_id = p.user_id
+                   WHERE p.id > ? ORDER BY p.id LIMIT ?''',
+                (ultimo_id, chunk_size)
+            ).fetchall()
+        if not filas:
+            break
+
+        ids, cotizaciones = _cotizar(filas)
+        if len(ids):
+            yield ids, cotizaciones
+        ultimo_id = filas[-1][0]
+
+    with db.get_pool().connection() as conn:
+        particiones = db.list_partitions(conn)
+    for particion in reversed(particiones):
+        ultimo_id = 0
+        while True:
+            with db.open_partition(particion) as archivo:
+                filas = archivo.execute(
+                    'SELECT id, user_id, monto_centavos, plazo FROM prestamos WHERE id > ? ORDER BY id LIMIT ?',
+                    (ultimo_id, chunk_size)
+                ).fetchall()
+            if not filas:
+                break
+
+            usuarios = list({user_id for _id, user_id, _monto, _plazo in filas})
+            with db.get_pool().connection() as conn:
+                interacciones = dict(conn.execute(
+                    f'SELECT user_id, interacciones FROM usuarios WHERE user_id IN ({",".join("?" * len(usuarios))})',
+                    usuarios
+                ).fetchall())
+            ids, cotizaciones = _cotizar([
+                (prestamo_id, monto, plazo, interacciones.get(user_id) or 0)
+                for prestamo_id, user_id, monto, plazo in filas
+            ])
+            if len(ids):
+                yield ids, cotizaciones
+            ultimo_id = filas[-1][0]
@@ -1,25 +1,57 @@
-def calculate_loan(monto, plazo, interacciones=0):
-    """
-    Calcula un préstamo con sus detalles
+import logging
+import os
 
-    Args:
-        monto: Monto solicitado
-        plazo: Plazo en meses
-        interacciones: Número de interacciones del usuario (para ajustar tasa)
+from money import format_pesos
 
-    Returns:
-        dict: Diccionario con detalles del préstamo
-    """
-    # Base: 55% TEA (Tasa Efectiva Anual)
-    # Ajustamos según perfil (interacciones como proxy de fidelidad)
-    tasa_base = 55.0
+logger = logging.getLogger(__name__)
+
+# Política de tasas de préstamos personales
+TASA_BASE = 55.0                  # TEA en %
+DESCUENTO_POR_INTERACCION = 0.5   # puntos de TEA por interacción
+DESCUENTO_MAXIMO = 10.0
+PLAZO_MAXIMO = 60
+
+# Si está activo, cada cálculo con la tabla se compara con la fórmula cerrada
+LOAN_TABLE_VALIDATE = os.getenv("LOAN_TABLE_VALIDATE", "0") == "1"
+
+# (descuento, plazo) -> (tasa anual, tasa mensual, numerador, denominador)
+_TABLA_TASAS = {}
 
-    # Ajuste por fidelidad (máximo 10% de descuento)
-    descuento = min(interacciones * 0.5, 10.0)
-    tasa_final = tasa_base - descuento
 
+def _tasas(descuento):
+    """TEA final y TEM (en %) para un descuento dado"""
+    tasa_final = TASA_BASE - descuento
     # Convertir TEA a TEM (Tasa Efectiva Mensual)
     tem = ((1 + tasa_final / 100) ** (1 / 12) - 1) * 100
+    return tasa_final, tem
+
+
+def build_rate_table():
+    """
+    Precalcula tasas y factores de anualidad para cada escalón de descuento
+    y cada plazo. Hay que volver a llamarla si cambia la política de tasas.
+    """
+    global _TABLA_TASAS
+    tabla = {}
+    escalones = int(DESCUENTO_MAXIMO / DESCUENTO_POR_INTERACCION)
+    for interacciones in range(escalones + 1):
+        descuento = min(interacciones * DESCUENTO_POR_INTERACCION, DESCUENTO_MAXIMO)
+        tasa_final, tem = _tasas(descuento)
+        tem_decimal = tem / 100
+        for plazo in range(1, PLAZO_MAXIMO + 1):
+            potencia = (1 + tem_decimal) ** plazo
+            tabla[(descuento, plazo)] = (
+                round(tasa_final, 2),
+                round(tem, 2),
+                tem_decimal * potencia,
+                potencia - 1
+            )
+    _TABLA_TASAS = tabla
+
+
+def _calculate_loan_closed_form(monto, plazo, descuento):
+    """Cálculo completo con la fórmula de amortización"""
+    tasa_final, tem = _tasas(descuento)
 
     # Calcular cuota mensual - Fórmula de amortización
     tem_decimal = tem / 100
@@ -39,6 +71,69 @@ def calculate_loan(monto, plazo, interacciones=0):
     }
 
 
+def calculate_loan(monto, plazo, interacciones=0):
+    """
+    Calcula un préstamo con sus detalles
+
+    Args:
+        monto: Monto solicitado
+        plazo: Plazo en meses
+        interacciones: Número de interacciones del usuario (para ajustar tasa)
+
+    Returns:
+        dict: Diccionario con detalles del préstamo
+    """
+    # Base: 55% TEA (Tasa Efectiva Anual)
+    # Ajuste por fidelidad (interacciones como proxy, máximo 10% de descuento)
+    descuento = min(interacciones * DESCUENTO_POR_INTERACCION, DESCUENTO_MAXIMO)
+
+    fila = _TABLA_TASAS.get((descuento, plazo))
+    if fila is None:
+        # Fuera de la tabla (plazo no entero o mayor al máximo, etc.)
+        return _calculate_loan_closed_form(monto, plazo, descuento)
+
+    # Mismas operaciones y en el mismo orden que la fórmula cerrada
+    tasa_anual, tasa_mensual, numerador, denominador = fila
+    cuota = monto * numerador / denominador
+    total = cuota * plazo
+
+    resultado = {
+        "monto": monto,
+        "plazo": plazo,
+        "tasa_anual": tasa_anual,
+        "tasa_mensual": tasa_mensual,
+        "cuota_mensual": round(cuota, 2),
+        "total": round(total, 2)
+    }
+
+    if LOAN_TABLE_VALIDATE:
+        esperado = _calculate_loan_closed_form(monto, plazo, descuento)
+        if resultado != esperado:
+            logger.warning("Diferencia en la tabla de tasas: %s != %s", resultado, esperado)
+            return esperado
+
+    return resultado
+
+
+def validate_rate_table(montos=(1000, 100000, 5000000)):
+    """
+    Compara la tabla con la fórmula cerrada para todos los escalones y plazos
+
+    Returns:
+        list: (monto, plazo, descuento) de cada combinación que no coincide
+    """
+    diferencias = []
+    for (descuento, plazo) in _TABLA_TASAS:
+        interacciones = descuento / DESCUENTO_POR_INTERACCION
+        for monto in montos:
+            if calculate_loan(monto, plazo, interacciones) != _calculate_loan_closed_form(monto, plazo, descuento):
+                diferencias.append((monto, plazo, descuento))
+    return diferencias
+
+
 def format_currency(amount):
     """Formatea un número como moneda (pesos argentinos)"""
-    return f"$ {amount:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+    return format_pesos(amount)
+
+
+build_rate_table()
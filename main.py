@@ -1,55 +1,105 @@
+import asyncio
+import logging
 import os
-from dotenv import load_dotenv
-from telegram import Update, ReplyKeyboardMarkup
+import re
+from telegram import (
+    Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+)
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler,
+    ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
     ContextTypes, filters, ConversationHandler
 )
 
-from db import (
-    init_db, get_user, create_user, update_interactions,
-    get_balance, get_transactions, save_loan_simulation
+import config  # carga .env antes de leer las variables
+from db import init_db
+from db_async import (
+    get_user, create_user, update_interactions,
+    get_balance, get_transactions_page, save_loan_simulation,
+    shutdown as shutdown_db
 )
 from logic import calculate_loan, format_currency
-from ai import detect_intent, get_ai_response
+from money import format_cents, format_movement
+import metrics
+from ai import (
+    classify_intent, get_ai_response, stream_ai_response, cancel_ai_response,
+    close_client, preload as preload_ai, AI_STREAMING
+)
+from scheduler import PerUserUpdateProcessor
+from persistence import SQLitePersistence
+import outbox
+import archive
+import ledger
+
+logger = logging.getLogger(__name__)
 
-# Cargar variables del entorno
-load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
-# Inicializar la base de datos
-init_db()
+# Modo de recepción de updates: "polling" o "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # URL pública, ej: https://bot.ejemplo.com/telegram
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+# Updates en espera; con la cola llena el servidor demora la respuesta y Telegram reintenta
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+# Segundos mínimos entre ediciones de una respuesta en curso de la IA
+# (Telegram limita las ediciones por chat; ~1 por segundo es seguro)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+# Importar openai en segundo plano apenas el bot está listo (0: en la primera consulta)
+AI_PRELOAD = os.getenv("AI_PRELOAD", "1") == "1"
 
 # Estados para el flujo de conversación del préstamo
 MONTO, PLAZO = range(2)
 
+# Teclado del menú principal (se arma una sola vez)
+MENU_KEYBOARD = ReplyKeyboardMarkup(
+    [['/saldo', '/movimientos'], ['/prestamo', '/ayuda']], resize_keyboard=True)
+
+# Movimientos por página en /movimientos
+MOVIMIENTOS_POR_PAGINA = 5
+
+# Duración y errores de cada handler
+HANDLER_SECONDS = metrics.histogram(
+    "bot_handler_seconds", "Duración de los handlers", ("handler",))
+HANDLER_ERRORS = metrics.counter(
+    "bot_handler_errors_total", "Excepciones en los handlers", ("handler",))
+
+# Respuestas a través de la cola de salida
+
+
+def responder(update: Update, texto, reply_markup=None):
+    """Encola una respuesta al chat del update; el handler no espera el envío"""
+    outbox.send(update.get_bot(), update.effective_chat.id, texto, reply_markup=reply_markup)
+
 # Comando /start
 
 
+@metrics.timed(HANDLER_SECONDS, errores=HANDLER_ERRORS)
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user = get_user(user_id)
+    nombre = update.effective_user.first_name
 
-    if not user:
-        nombre = update.effective_user.first_name
-        create_user(user_id, nombre)
-        await update.message.reply_text(f"👋 ¡Bienvenido {nombre}! Para comenzar, necesitas autenticarte.")
-        await update.message.reply_text("🔒 Ingresá tu PIN para acceder a tu cuenta:")
+    # create_user solo inserta si el usuario no existe
+    if await create_user(user_id, nombre):
+        responder(update, f"👋 ¡Bienvenido {nombre}! Para comenzar, necesitas autenticarte.")
+        responder(update, "🔒 Ingresá tu PIN para acceder a tu cuenta:")
         context.user_data["autenticado"] = False
+    elif context.user_data.get("autenticado"):
+        user = await get_user(user_id)
+        responder(
+            update,
+            f"👋 ¡Hola de nuevo {user.nombre if user else nombre}! ¿En qué puedo ayudarte hoy?",
+            reply_markup=MENU_KEYBOARD
+        )
     else:
-        if context.user_data.get("autenticado"):
-            keyboard = [['/saldo', '/movimientos'], ['/prestamo', '/ayuda']]
-            reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-            await update.message.reply_text(
-                f"👋 ¡Hola de nuevo {user[1]}! ¿En qué puedo ayudarte hoy?",
-                reply_markup=reply_markup
-            )
-        else:
-            await update.message.reply_text("🔒 Ingresá tu PIN para acceder a tu cuenta:")
+        responder(update, "🔒 Ingresá tu PIN para acceder a tu cuenta:")
 
 # Verificación del PIN
 
 
+@metrics.timed(HANDLER_SECONDS, errores=HANDLER_ERRORS)
 async def verificar_pin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     mensaje = update.message.text.strip()
@@ -61,14 +111,12 @@ async def verificar_pin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if mensaje == PIN_CORRECTO:
         context.user_data["autenticado"] = True
-        update_interactions(user_id)
-
-        keyboard = [['/saldo', '/movimientos'], ['/prestamo', '/ayuda']]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        await update_interactions(user_id)
 
-        await update.message.reply_text("🔓 ¡Autenticación exitosa!", reply_markup=reply_markup)
+        responder(update, "🔓 ¡Autenticación exitosa!", reply_markup=MENU_KEYBOARD)
 
-        await update.message.reply_text(
+        responder(
+            update,
             "💡 Podés usar los siguientes comandos:\n"
             "- /start - Iniciar o reiniciar el bot\n"
             "- /saldo - Consultar tu saldo actual\n"
@@ -78,7 +126,8 @@ async def verificar_pin(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "- /ayuda - Mostrar este menú y ejemplos de preguntas"
         )
 
-        await update.message.reply_text(
+        responder(
+            update,
             "🧠 También podés escribirme preguntas como:\n"
             "- ¿Cuánto tengo en mi cuenta?\n"
             "- Mostrame los últimos movimientos\n"
@@ -89,82 +138,177 @@ async def verificar_pin(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "- ¿Cuál es la tasa para préstamos personales?"
         )
     else:
-        await update.message.reply_text("❌ PIN incorrecto. Probá de nuevo.")
+        responder(update, "❌ PIN incorrecto. Probá de nuevo.")
 
 
 # Consulta de saldo
 
+@metrics.timed(HANDLER_SECONDS, errores=HANDLER_ERRORS)
 async def consultar_saldo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
     if not context.user_data.get("autenticado"):
-        await update.message.reply_text("🔒 Necesitás autenticarte primero con /start.")
+        responder(update, "🔒 Necesitás autenticarte primero con /start.")
         return
 
-    update_interactions(user_id)
-    saldo = get_balance(user_id)
-    await update.message.reply_text(f"💰 Tu saldo actual es: {saldo}")
+    await update_interactions(user_id)
+    saldo = await get_balance(user_id)
+    responder(update, f"💰 Tu saldo actual es: {format_cents(saldo)}")
 
 # Consulta de movimientos
 
 
+def formatear_movimientos(movimientos):
+    return "\n".join(format_movement(m.descripcion, m.monto_centavos) for m in movimientos)
+
+
+# callback_data del botón de movimientos: mov:<user_id>:<fecha>:<id>
+_CALLBACK_MOVIMIENTOS = re.compile(r"mov:(\d{1,18}):(\d{1,18}):(\d{1,18})")
+
+
+def teclado_movimientos(user_id, cursor):
+    """Botón para ver la página siguiente; el cursor viaja en callback_data"""
+    if cursor is None:
+        return None
+    fecha, mov_id = cursor
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("⏪ Anteriores", callback_data=f"mov:{user_id}:{fecha}:{mov_id}")
+    ]])
+
+
+def leer_cursor_movimientos(data, user_id):
+    """
+    Cursor (fecha, id) de un callback_data de teclado_movimientos
+
+    Returns:
+        tuple: el cursor, o None si el formato no es válido o el botón es de
+            otro usuario
+    """
+    coincidencia = _CALLBACK_MOVIMIENTOS.fullmatch(data or "")
+    if coincidencia is None or int(coincidencia.group(1)) != user_id:
+        return None
+    return int(coincidencia.group(2)), int(coincidencia.group(3))
+
+
+@metrics.timed(HANDLER_SECONDS, errores=HANDLER_ERRORS)
 async def consultar_movimientos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
     if not context.user_data.get("autenticado"):
-        await update.message.reply_text("🔒 Necesitás autenticarte primero con /start.")
+        responder(update, "🔒 Necesitás autenticarte primero con /start.")
         return
 
-    update_interactions(user_id)
-    movimientos = get_transactions(user_id)
+    await update_interactions(user_id)
+    movimientos, cursor = await get_transactions_page(user_id, page_size=MOVIMIENTOS_POR_PAGINA)
 
     if movimientos:
-        mensaje = "📄 Tus últimos movimientos:\n" + "\n".join(movimientos)
+        mensaje = "📄 Tus últimos movimientos:\n" + formatear_movimientos(movimientos)
     else:
         mensaje = "📭 No tenés movimientos recientes."
 
-    await update.message.reply_text(mensaje)
+    responder(update, mensaje, reply_markup=teclado_movimientos(user_id, cursor))
+
+# Página siguiente de movimientos
+
+
+@metrics.timed(HANDLER_SECONDS, errores=HANDLER_ERRORS)
+async def ver_mas_movimientos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = update.effective_user.id
+
+    cursor = leer_cursor_movimientos(query.data, user_id)
+    if cursor is None:
+        # Botón viejo, alterado o de otro usuario (por ejemplo, en un grupo)
+        await query.answer("⚠️ Este botón ya no es válido. Usá /movimientos.")
+        return
+    await query.answer()
+
+    if not context.user_data.get("autenticado"):
+        await query.edit_message_text("🔒 Necesitás autenticarte primero con /start.")
+        return
+
+    movimientos, cursor = await get_transactions_page(user_id, cursor, MOVIMIENTOS_POR_PAGINA)
+
+    if movimientos:
+        mensaje = "📄 Movimientos anteriores:\n" + formatear_movimientos(movimientos)
+    else:
+        mensaje = "📭 No hay movimientos anteriores."
+
+    await query.edit_message_text(mensaje, reply_markup=teclado_movimientos(user_id, cursor))
 
 # Iniciar simulación de préstamo
 
 
+@metrics.timed(HANDLER_SECONDS, errores=HANDLER_ERRORS)
 async def iniciar_prestamo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
     if not context.user_data.get("autenticado"):
-        await update.message.reply_text("🔒 Necesitás autenticarte primero con /start.")
+        responder(update, "🔒 Necesitás autenticarte primero con /start.")
         return
 
-    update_interactions(user_id)
-    await update.message.reply_text("💵 Ingresá el monto que necesitás (solo números):")
+    await update_interactions(user_id)
+    responder(update, "💵 Ingresá el monto que necesitás (solo números):")
     return MONTO
 
 # Procesar monto
 
 
+@metrics.timed(HANDLER_SECONDS, errores=HANDLER_ERRORS)
 async def procesar_monto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto = update.message.text.strip().replace(".", "").replace(",", "")
 
     try:
         monto = float(texto)
         if monto <= 0:
-            await update.message.reply_text("❌ El monto debe ser mayor a 0. Ingresá otro valor:")
+            responder(update, "❌ El monto debe ser mayor a 0. Ingresá otro valor:")
             return MONTO
         if monto > 5000000:
-            await update.message.reply_text("❌ El monto máximo es de $5.000.000. Ingresá un valor menor:")
+            responder(update, "❌ El monto máximo es de $5.000.000. Ingresá un valor menor:")
             return MONTO
 
         context.user_data["monto_prestamo"] = monto
-        await update.message.reply_text(f"✅ Monto: {format_currency(monto)}\n\n📆 Ahora, ingresá el plazo en meses (1-60):")
+        responder(update, f"✅ Monto: {format_currency(monto)}\n\n📆 Ahora, ingresá el plazo en meses (1-60):")
         return PLAZO
 
     except ValueError:
-        await update.message.reply_text("❌ Ingresá solo números. Por ejemplo: 100000")
+        responder(update, "❌ Ingresá solo números. Por ejemplo: 100000")
         return MONTO
 
+# Calcular, guardar y enviar una simulación de préstamo
+
+
+async def responder_simulacion(update: Update, user_id, monto, plazo):
+    user = await get_user(user_id)
+    interacciones = user.interacciones if user else 0
+
+    resultado = calculate_loan(monto, plazo, interacciones)
+
+    await save_loan_simulation(
+        user_id,
+        resultado["monto"],
+        resultado["plazo"],
+        resultado["tasa_anual"],
+        resultado["cuota_mensual"],
+        resultado["total"]
+    )
+
+    mensaje = (
+        f"📊 *Simulación de préstamo*\n\n"
+        f"💵 Monto solicitado: {format_currency(resultado['monto'])}\n"
+        f"📆 Plazo: {resultado['plazo']} meses\n"
+        f"📈 Tasa anual: {resultado['tasa_anual']}%\n"
+        f"📈 Tasa mensual: {resultado['tasa_mensual']}%\n"
+        f"💰 Cuota mensual: {format_currency(resultado['cuota_mensual'])}\n"
+        f"💰 Total a pagar: {format_currency(resultado['total'])}"
+    )
+
+    responder(update, mensaje)
+
 # Procesar plazo
 
 
+@metrics.timed(HANDLER_SECONDS, errores=HANDLER_ERRORS)
 async def procesar_plazo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     texto = update.message.text.strip()
@@ -172,51 +316,29 @@ async def procesar_plazo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         plazo = int(texto)
         if plazo <= 0 or plazo > 60:
-            await update.message.reply_text("❌ El plazo debe ser entre 1 y 60 meses. Ingresá otro valor:")
+            responder(update, "❌ El plazo debe ser entre 1 y 60 meses. Ingresá otro valor:")
             return PLAZO
 
         monto = context.user_data.get("monto_prestamo")
-        user = get_user(user_id)
-        interacciones = user[4] if user else 0
-
-        resultado = calculate_loan(monto, plazo, interacciones)
-
-        save_loan_simulation(
-            user_id,
-            resultado["monto"],
-            resultado["plazo"],
-            resultado["tasa_anual"],
-            resultado["cuota_mensual"],
-            resultado["total"]
-        )
-
-        mensaje = (
-            f"📊 *Simulación de préstamo*\n\n"
-            f"💵 Monto solicitado: {format_currency(resultado['monto'])}\n"
-            f"📆 Plazo: {resultado['plazo']} meses\n"
-            f"📈 Tasa anual: {resultado['tasa_anual']}%\n"
-            f"📈 Tasa mensual: {resultado['tasa_mensual']}%\n"
-            f"💰 Cuota mensual: {format_currency(resultado['cuota_mensual'])}\n"
-            f"💰 Total a pagar: {format_currency(resultado['total'])}"
-        )
-
-        await update.message.reply_text(mensaje)
+        await responder_simulacion(update, user_id, monto, plazo)
         return ConversationHandler.END
 
     except ValueError:
-        await update.message.reply_text("❌ Ingresá solo números. Por ejemplo: 12")
+        responder(update, "❌ Ingresá solo números. Por ejemplo: 12")
         return PLAZO
 
 # Cancelar conversación
 
 
+@metrics.timed(HANDLER_SECONDS, errores=HANDLER_ERRORS)
 async def cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("❌ Operación cancelada.")
+    responder(update, "❌ Operación cancelada.")
     return ConversationHandler.END
 
 # Comando /ayuda
 
 
+@metrics.timed(HANDLER_SECONDS, errores=HANDLER_ERRORS)
 async def ayuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
     mensaje = (
         "🏦 *Bot Bancario - Comandos disponibles*\n\n"
@@ -231,11 +353,12 @@ async def ayuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "- ¿Qué tarjetas ofrecen?\n"
         "- ¿Conviene un plazo fijo?"
     )
-    await update.message.reply_text(mensaje)
+    responder(update, mensaje)
 
 # Procesar mensajes
 
 
+@metrics.timed(HANDLER_SECONDS, errores=HANDLER_ERRORS)
 async def procesar_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     mensaje = update.message.text
@@ -243,25 +366,171 @@ async def procesar_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.user_data.get("autenticado"):
         return await verificar_pin(update, context)
 
-    update_interactions(user_id)
-    intent = await detect_intent(mensaje)
+    # Un mensaje nuevo reemplaza cualquier consulta a la IA que siga pendiente
+    cancel_ai_response(user_id)
+
+    await update_interactions(user_id)
+    resultado = await classify_intent(mensaje)
+    intent = resultado.intent
+    entidades = resultado.entities
 
     if intent == "saldo":
         return await consultar_saldo(update, context)
     elif intent == "movimientos":
         return await consultar_movimientos(update, context)
-    elif intent == "prestamo":
-        await update.message.reply_text("💵 Para simular un préstamo, vamos a necesitar algunos datos.")
+    elif (intent == "simulacion"
+          and 0 < entidades["monto"] <= 5000000
+          and 1 <= entidades["plazo"] <= 60):
+        # "¿Cuánto pagaría si pido 100.000 en 24 cuotas?" va directo al cálculo
+        return await responder_simulacion(update, user_id, entidades["monto"], entidades["plazo"])
+    elif intent in ("prestamo", "simulacion"):
+        responder(update, "💵 Para simular un préstamo, vamos a necesitar algunos datos.")
         return await iniciar_prestamo(update, context)
+    elif AI_STREAMING:
+        await responder_en_vivo(update, user_id, mensaje)
     else:
-        respuesta = await get_ai_response(mensaje)
-        await update.message.reply_text(respuesta)
+        respuesta = await get_ai_response(mensaje, user_id)
+        if respuesta is None:
+            # El usuario envió otro mensaje antes de recibir la respuesta
+            return
+        responder(update, respuesta)
 
-# Función principal
+# Respuesta de la IA mostrada a medida que se genera
 
+MENSAJE_PENSANDO = "✍️ Pensando..."
+CURSOR_ESCRITURA = " ▌"
 
-def main():
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+
+async def editar_respuesta(mensaje, texto, final=False):
+    """
+    Editar el texto de una respuesta en curso
+
+    Returns:
+        float: Segundos que Telegram pide esperar antes de la próxima edición
+    """
+    # Las ediciones no pasan por la cola de salida pero cuentan para el límite global
+    await outbox.reservar()
+    try:
+        await mensaje.edit_text(texto)
+    except RetryAfter as e:
+        if not final:
+            return e.retry_after
+        # La última edición no se puede saltear
+        await asyncio.sleep(e.retry_after)
+        await outbox.reservar()
+        await mensaje.edit_text(texto)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+    return 0
+
+
+async def responder_en_vivo(update, user_id, mensaje):
+    """
+    Envía un mensaje provisorio y lo edita con el texto de la IA a medida que
+    llega, como mucho una vez cada STREAM_EDIT_INTERVAL segundos
+    """
+    # Se espera el envío porque hace falta el mensaje para editarlo
+    enviado = await outbox.send(
+        update.get_bot(), update.effective_chat.id, MENSAJE_PENSANDO, wait=True)
+    loop = asyncio.get_running_loop()
+    texto = ""
+    proxima_edicion = 0.0
+    fragmentos = stream_ai_response(mensaje, user_id)
+    try:
+        async for fragmento in fragmentos:
+            texto += fragmento
+            if loop.time() >= proxima_edicion:
+                espera = await editar_respuesta(enviado, texto + CURSOR_ESCRITURA)
+                proxima_edicion = loop.time() + max(STREAM_EDIT_INTERVAL, espera)
+    finally:
+        await fragmentos.aclose()
+
+    if not texto:
+        # El usuario envió otro mensaje antes de recibir la respuesta
+        await outbox.reservar()
+        await enviado.delete()
+        return
+    await editar_respuesta(enviado, texto, final=True)
+
+# Un mensaje nuevo reemplaza a la respuesta de la IA que el usuario todavía espera
+
+
+def mensaje_en_cola(user_id, update):
+    if update.message and update.message.text:
+        cancel_ai_response(user_id)
+
+# Arranque explícito y readiness
+
+
+def iniciar():
+    """
+    Fase de arranque: crear la base y aplicar las migraciones pendientes
+
+    Importar este módulo no toca la base; esto tiene que correr antes de
+    inicializar la aplicación porque la persistencia lee las sesiones.
+    """
+    return init_db()
+
+
+def _informar_error_de_precarga(futuro):
+    error = None if futuro.cancelled() else futuro.exception()
+    if error is not None:
+        logger.error("Error al precargar openai: %s", error, exc_info=error)
+
+
+async def marcar_listo(app):
+    """post_init: el token ya se validó y las sesiones están cargadas"""
+    metrics.set_ready()
+    if AI_PRELOAD:
+        precarga = asyncio.get_running_loop().run_in_executor(None, preload_ai)
+        precarga.add_done_callback(_informar_error_de_precarga)
+
+# Liberar recursos al detener el bot
+
+
+async def vaciar_salida(app):
+    metrics.set_ready(False)
+    await outbox.close()
+
+
+async def cerrar_recursos(app):
+    archive.stop_archiver()
+    ledger.stop_auditor()
+    await close_client()
+    shutdown_db()
+
+# Armar la aplicación con todos los handlers
+
+
+def build_application(request=None, update_processor=None):
+    """
+    Args:
+        request: BaseRequest para hablar con la API de Telegram (los
+            benchmarks usan uno simulado)
+        update_processor: Reemplaza al PerUserUpdateProcessor por defecto
+    """
+    update_processor = update_processor or PerUserUpdateProcessor(al_encolar=mensaje_en_cola)
+    persistencia = SQLitePersistence()
+    metrics.gauge("bot_scheduler", "Estado del procesamiento de updates",
+                  lambda: {(clave,): valor for clave, valor in update_processor.stats().items()},
+                  ("stat",))
+
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .concurrent_updates(update_processor)
+        .persistence(persistencia)
+        .post_init(marcar_listo)
+        .post_stop(vaciar_salida)
+        .post_shutdown(cerrar_recursos)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    app = builder.build()
+    # La purga de sesiones vencidas también libera app.user_data
+    persistencia.set_application(app)
 
     prestamo_handler = ConversationHandler(
         entry_points=[CommandHandler("prestamo", iniciar_prestamo)],
@@ -270,19 +539,55 @@ def main():
             PLAZO: [MessageHandler(
                 filters.TEXT & ~filters.COMMAND, procesar_plazo)]
         },
-        fallbacks=[CommandHandler("cancelar", cancelar)]
+        fallbacks=[CommandHandler("cancelar", cancelar)],
+        name="prestamo",
+        persistent=True
     )
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("saldo", consultar_saldo))
     app.add_handler(CommandHandler("movimientos", consultar_movimientos))
+    app.add_handler(CallbackQueryHandler(ver_mas_movimientos, pattern=r"^mov:"))
     app.add_handler(CommandHandler("ayuda", ayuda))
     app.add_handler(prestamo_handler)
     app.add_handler(MessageHandler(
         filters.TEXT & ~filters.COMMAND, procesar_mensaje))
+    return app
+
+# Función principal
+
 
-    print("✅ Bot bancario iniciado! Presiona Ctrl+C para detener.")
-    app.run_polling()
+def main():
+    metrics.setup_logging()
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        logger.error("BOT_MODE=webhook requiere WEBHOOK_URL")
+        raise SystemExit(1)
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        # Sin secreto cualquiera que conozca la URL podría enviar updates falsos
+        logger.error("BOT_MODE=webhook requiere WEBHOOK_SECRET")
+        raise SystemExit(1)
+
+    # /ready responde 503 hasta que termine el arranque
+    metrics.start_http_server()
+    if not iniciar():
+        raise SystemExit(1)
+
+    app = build_application()
+    ledger.start_auditor()
+    archive.start_archiver()
+
+    logger.info("✅ Bot bancario iniciado! Presiona Ctrl+C para detener.")
+    if BOT_MODE == "webhook":
+        # Al detenerse se cierra el servidor HTTP y se procesan los updates ya encolados
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET
+        )
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
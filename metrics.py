@@ -0,0 +1,370 @@
+"""
+Métricas en memoria (contadores, histogramas y gauges) con endpoint HTTP
+en formato de texto de Prometheus, sonda de readiness y configuración de
+logs estructurados.
+
+Uso:
+    DURACION = metrics.histogram("bot_handler_seconds", "Duración de los handlers", ("handler",))
+
+    @metrics.timed(DURACION)
+    async def start(update, context): ...
+
+    METRICS_PORT=9100 python main.py
+    curl http://127.0.0.1:9100/metrics
+    curl http://127.0.0.1:9100/ready    # 200 cuando el bot atiende updates, 503 mientras tanto
+"""
+import asyncio
+import bisect
+import functools
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Puerto del endpoint /metrics (0 lo desactiva)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json
+
+# Límites de los buckets en segundos: de 0,5 ms a 10 s
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registro = {}
+_registro_lock = threading.Lock()
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatear_etiquetas(nombres, valores, extra=None):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+class Counter:
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *etiquetas, n=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + n
+
+    def value(self, *etiquetas):
+        return self._valores.get(etiquetas, 0)
+
+    def render(self):
+        with self._lock:
+            valores = list(self._valores.items())
+        for etiquetas, valor in valores:
+            yield f"{self.nombre}{_formatear_etiquetas(self.etiquetas, etiquetas)} {valor}"
+
+
+class Histogram:
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        # etiquetas -> [conteo por bucket (+Inf al final), suma, cantidad]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, valor, *etiquetas):
+        if not METRICS_ENABLED:
+            return
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    @contextmanager
+    def time(self, *etiquetas):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, *etiquetas)
+
+    def count(self, *etiquetas):
+        serie = self._series.get(etiquetas)
+        return serie[2] if serie else 0
+
+    def render(self):
+        with self._lock:
+            series = [(e, list(s[0]), s[1], s[2]) for e, s in self._series.items()]
+        for etiquetas, conteos, suma, cantidad in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + ("+Inf",), conteos):
+                acumulado += conteo
+                le = f'le="{limite}"'
+                yield f"{self.nombre}_bucket{_formatear_etiquetas(self.etiquetas, etiquetas, le)} {acumulado}"
+            yield f"{self.nombre}_sum{_formatear_etiquetas(self.etiquetas, etiquetas)} {suma}"
+            yield f"{self.nombre}_count{_formatear_etiquetas(self.etiquetas, etiquetas)} {cantidad}"
+
+
+class Gauge:
+    """Valor que se lee al exportar: func() devuelve un número o {etiquetas: valor}"""
+    tipo = "gauge"
+
+    def __init__(self, nombre, ayuda, func, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.func = func
+        self.etiquetas = tuple(etiquetas)
+
+    def render(self):
+        try:
+            valores = self.func()
+        except Exception as e:
+            logging.getLogger(__name__).warning("Error al leer %s: %s", self.nombre, e)
+            return
+        if not isinstance(valores, dict):
+            valores = {(): valores}
+        for etiquetas, valor in valores.items():
+            if not isinstance(etiquetas, tuple):
+                etiquetas = (etiquetas,)
+            yield f"{self.nombre}{_formatear_etiquetas(self.etiquetas, etiquetas)} {valor}"
+
+
+def _registrar(clase, nombre, *args, **kwargs):
+    with _registro_lock:
+        metrica = _registro.get(nombre)
+        if metrica is None:
+            metrica = _registro[nombre] = clase(nombre, *args, **kwargs)
+        return metrica
+
+
+def counter(nombre, ayuda, etiquetas=()):
+    return _registrar(Counter, nombre, ayuda, etiquetas)
+
+
+def histogram(nombre, ayuda, etiquetas=(), buckets=BUCKETS):
+    return _registrar(Histogram, nombre, ayuda, etiquetas, buckets)
+
+
+def gauge(nombre, ayuda, func, etiquetas=()):
+    """Registra (o reemplaza) un gauge calculado al exportar"""
+    with _registro_lock:
+        _registro[nombre] = Gauge(nombre, ayuda, func, etiquetas)
+        return _registro[nombre]
+
+
+def timed(histograma, *etiquetas, errores=None):
+    """
+    Decorador que mide la duración de una función (síncrona o asíncrona)
+
+    Args:
+        histograma: Histogram donde se registra la duración
+        etiquetas: Valores de las etiquetas; por defecto el nombre de la función
+        errores: Counter opcional que cuenta las excepciones
+    """
+    def decorador(func):
+        valores = etiquetas or (func.__name__,)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def envoltura(*args, **kwargs):
+                inicio = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    if errores is not None:
+                        errores.inc(*valores)
+                    raise
+                finally:
+                    histograma.observe(time.perf_counter() - inicio, *valores)
+        else:
+            @functools.wraps(func)
+            def envoltura(*args, **kwargs):
+                inicio = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    if errores is not None:
+                        errores.inc(*valores)
+                    raise
+                finally:
+                    histograma.observe(time.perf_counter() - inicio, *valores)
+        return envoltura
+    return decorador
+
+
+def render():
+    """Todas las métricas en formato de texto de Prometheus"""
+    with _registro_lock:
+        metricas = list(_registro.values())
+    lineas = []
+    for metrica in metricas:
+        lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+        lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+        lineas.extend(metrica.render())
+    return "\n".join(lineas) + "\n"
+
+
+# Consultas SQL por sentencia
+
+DB_QUERY_SECONDS = histogram(
+    "db_query_seconds", "Duración de execute/executemany por sentencia SQL", ("statement",))
+DB_QUERY_ERRORS = counter(
+    "db_query_errors_total", "Sentencias SQL que fallaron", ("statement",))
+
+_ESPACIOS = re.compile(r"\s+")
+_LISTA_PARAMETROS = re.compile(r"\(\?(?:\s*,\s*\?)+\)")
+
+
+@functools.lru_cache(maxsize=512)
+def _sentencia(sql):
+    """Etiqueta estable para una sentencia: sin espacios extra ni listas IN variables"""
+    sql = _ESPACIOS.sub(" ", sql).strip()
+    return _LISTA_PARAMETROS.sub("(?, ...)", sql)[:200]
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor que mide cada sentencia (el tiempo de fetch posterior no se incluye)"""
+
+    def _medir(self, metodo, sql, *args):
+        inicio = time.perf_counter()
+        try:
+            return metodo(sql, *args)
+        except sqlite3.Error:
+            DB_QUERY_ERRORS.inc(_sentencia(sql))
+            raise
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - inicio, _sentencia(sql))
+
+    def execute(self, sql, parameters=()):
+        return self._medir(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._medir(super().executemany, sql, seq_of_parameters)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Usar con sqlite3.connect(..., factory=InstrumentedConnection)"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Readiness
+
+_listo = threading.Event()
+
+
+def set_ready(listo=True):
+    """Marcar si el bot terminó de arrancar y atiende updates"""
+    if listo:
+        _listo.set()
+    else:
+        _listo.clear()
+
+
+def is_ready():
+    return _listo.is_set()
+
+
+gauge("bot_ready", "1 cuando el bot terminó de arrancar y atiende updates", lambda: int(is_ready()))
+
+
+# Endpoint HTTP
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _responder(self, status, cuerpo, tipo="text/plain; charset=utf-8"):
+        cuerpo = cuerpo.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_GET(self):
+        ruta = self.path.split("?", 1)[0]
+        if ruta == "/metrics":
+            self._responder(200, render(), "text/plain; version=0.0.4; charset=utf-8")
+        elif ruta == "/ready":
+            if is_ready():
+                self._responder(200, "ok\n")
+            else:
+                self._responder(503, "starting\n")
+        else:
+            self.send_error(404)
+
+
+def start_http_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Sirve /metrics y /ready en un hilo de fondo; devuelve el servidor o None si port es 0"""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.getLogger(__name__).info("Métricas en http://%s:%s/metrics", host, server.server_port)
+    return server
+
+
+# Logs estructurados
+
+# Atributos propios de LogRecord; el resto viene de extra={...}
+_ATRIBUTOS_RECORD = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos pasados en extra={...}"""
+
+    def format(self, record):
+        datos = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_RECORD:
+                datos[clave] = valor
+        if record.exc_info:
+            datos["exc"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+def setup_logging(nivel=LOG_LEVEL, formato=LOG_FORMAT):
+    handler = logging.StreamHandler()
+    if formato == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logging.basicConfig(level=nivel, handlers=[handler], force=True)
+    # httpx registra cada pedido en INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -0,0 +1,383 @@
+"""
+Migraciones versionadas del esquema de la base de datos
+
+La versión aplicada se guarda en PRAGMA user_version. Cada migración corre
+en su propia transacción, así una base existente (por ejemplo
+data/banco.db) se actualiza en el lugar al iniciar el bot.
+
+Uso:
+    python migrations.py            # migrar DB_PATH
+    python migrations.py --check    # migrar y verificar los planes de consulta
+"""
+import argparse
+import sqlite3
+import time
+from datetime import datetime
+
+
+def _v1_esquema_inicial(conn):
+    """Tablas originales (REAL para montos, TEXT para fechas)"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS usuarios (
+        user_id INTEGER PRIMARY KEY,
+        nombre TEXT,
+        saldo REAL,
+        fecha_registro TEXT,
+        interacciones INTEGER DEFAULT 0
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS movimientos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        descripcion TEXT,
+        monto REAL,
+        fecha TEXT,
+        FOREIGN KEY (user_id) REFERENCES usuarios(user_id)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS prestamos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        monto REAL,
+        plazo INTEGER,
+        tasa REAL,
+        cuota REAL,
+        total REAL,
+        fecha TEXT,
+        FOREIGN KEY (user_id) REFERENCES usuarios(user_id)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS respuestas_cache (
+        clave TEXT PRIMARY KEY,
+        contexto TEXT,
+        respuesta TEXT,
+        creado REAL
+    )
+    ''')
+
+
+def _a_epoch(fecha):
+    """'%Y-%m-%d %H:%M:%S' en hora local (formato original) a epoch"""
+    if fecha is None:
+        return int(time.time())
+    try:
+        return int(datetime.strptime(fecha, '%Y-%m-%d %H:%M:%S').timestamp())
+    except (TypeError, ValueError):
+        return int(time.time())
+
+
+def _v2_centavos_y_epoch(conn):
+    """Montos en centavos enteros y fechas como epoch (segundos)"""
+    conn.create_function("a_epoch", 1, _a_epoch, deterministic=True)
+
+    conn.execute('''
+    CREATE TABLE usuarios_nueva (
+        user_id INTEGER PRIMARY KEY,
+        nombre TEXT,
+        saldo_centavos INTEGER NOT NULL DEFAULT 0,
+        fecha_registro INTEGER,
+        interacciones INTEGER DEFAULT 0
+    )
+    ''')
+    conn.execute('''
+    INSERT INTO usuarios_nueva (user_id, nombre, saldo_centavos, fecha_registro, interacciones)
+    SELECT user_id, nombre, CAST(ROUND(COALESCE(saldo, 0) * 100) AS INTEGER),
+           a_epoch(fecha_registro), COALESCE(interacciones, 0)
+    FROM usuarios
+    ''')
+
+    conn.execute('''
+    CREATE TABLE movimientos_nueva (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        descripcion TEXT,
+        monto_centavos INTEGER NOT NULL,
+        fecha INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES usuarios(user_id)
+    )
+    ''')
+    conn.execute('''
+    INSERT INTO movimientos_nueva (id, user_id, descripcion, monto_centavos, fecha)
+    SELECT id, user_id, descripcion, CAST(ROUND(COALESCE(monto, 0) * 100) AS INTEGER),
+           a_epoch(fecha)
+    FROM movimientos
+    ''')
+
+    conn.execute('''
+    CREATE TABLE prestamos_nueva (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        monto_centavos INTEGER,
+        plazo INTEGER,
+        tasa REAL,
+        cuota_centavos INTEGER,
+        total_centavos INTEGER,
+        fecha INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES usuarios(user_id)
+    )
+    ''')
+    conn.execute('''
+    INSERT INTO prestamos_nueva (id, user_id, monto_centavos, plazo, tasa,
+                                 cuota_centavos, total_centavos, fecha)
+    SELECT id, user_id, CAST(ROUND(monto * 100) AS INTEGER), plazo, tasa,
+           CAST(ROUND(cuota * 100) AS INTEGER), CAST(ROUND(total * 100) AS INTEGER),
+           a_epoch(fecha)
+    FROM prestamos
+    ''')
+
+    for tabla in ("usuarios", "movimientos", "prestamos"):
+        conn.execute(f'DROP TABLE {tabla}')
+        conn.execute(f'ALTER TABLE {tabla}_nueva RENAME TO {tabla}')
+
+
+def _v3_indices(conn):
+    """Índices para las consultas por usuario ordenadas por fecha"""
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_movimientos_usuario_fecha
+    ON movimientos (user_id, fecha DESC, id DESC)
+    ''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_prestamos_usuario_fecha
+    ON prestamos (user_id, fecha DESC, id DESC)
+    ''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_respuestas_cache_contexto
+    ON respuestas_cache (contexto, creado)
+    ''')
+
+
+def _v4_referencia_externa(conn):
+    """Clave de idempotencia para movimientos importados del core bancario"""
+    conn.execute('ALTER TABLE movimientos ADD COLUMN ref_externa TEXT')
+    conn.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_movimientos_ref_externa
+    ON movimientos (ref_externa) WHERE ref_externa IS NOT NULL
+    ''')
+
+
+def _v5_sesiones(conn):
+    """Estado de sesión (user_data) y de conversaciones compartido entre procesos"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS sesiones (
+        user_id INTEGER PRIMARY KEY,
+        datos TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 1,
+        actualizado INTEGER NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS conversaciones (
+        nombre TEXT NOT NULL,
+        clave TEXT NOT NULL,
+        estado TEXT NOT NULL,
+        actualizado INTEGER NOT NULL,
+        PRIMARY KEY (nombre, clave)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_sesiones_actualizado
+    ON sesiones (actualizado)
+    ''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_conversaciones_actualizado
+    ON conversaciones (actualizado)
+    ''')
+
+
+def _v6_checkpoints_de_saldo(conn):
+    """Saldos por usuario al movimiento N y estado del auditor del libro mayor"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS saldos_checkpoint (
+        user_id INTEGER NOT NULL,
+        hasta_id INTEGER NOT NULL,
+        hasta_fecha INTEGER NOT NULL,
+        saldo_centavos INTEGER NOT NULL,
+        creado INTEGER NOT NULL,
+        PRIMARY KEY (user_id, hasta_id)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS auditoria (
+        clave TEXT PRIMARY KEY,
+        valor INTEGER NOT NULL
+    )
+    ''')
+    # Movimientos de un usuario posteriores a un id (rowid implícito en el índice)
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_movimientos_usuario
+    ON movimientos (user_id)
+    ''')
+
+
+def _v7_particiones(conn):
+    """Catálogo de particiones mensuales del historial archivado (ver archive.py)"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS particiones (
+        mes TEXT PRIMARY KEY,
+        archivo TEXT NOT NULL,
+        desde INTEGER NOT NULL,
+        hasta INTEGER NOT NULL,
+        movimientos INTEGER NOT NULL DEFAULT 0,
+        prestamos INTEGER NOT NULL DEFAULT 0,
+        actualizado INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
+    # Meses archivados con movimientos de cada usuario: /movimientos sólo abre esos
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS particiones_usuarios (
+        user_id INTEGER NOT NULL,
+        mes TEXT NOT NULL,
+        PRIMARY KEY (user_id, mes)
+    ) WITHOUT ROWID
+    ''')
+    # Filas más viejas que el horizonte, sin importar el usuario
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_movimientos_fecha
+    ON movimientos (fecha)
+    ''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_prestamos_fecha
+    ON prestamos (fecha)
+    ''')
+
+
+def _v8_invalidaciones(conn):
+    """Usuarios modificados por otros procesos (importador) para invalidar su caché"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS invalidaciones_usuarios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        creado INTEGER NOT NULL
+    )
+    ''')
+
+
+def _v9_lote_pendiente_del_archivo(conn):
+    """Rango de ids del lote que archive.py está moviendo a cada partición"""
+    for columna in ("pendiente_tabla TEXT", "pendiente_desde INTEGER", "pendiente_hasta INTEGER"):
+        conn.execute(f'ALTER TABLE particiones ADD COLUMN {columna}')
+
+
+# (versión, descripción, función). Sólo se agregan migraciones al final.
+MIGRATIONS = [
+    (1, "esquema inicial", _v1_esquema_inicial),
+    (2, "montos en centavos y fechas epoch", _v2_centavos_y_epoch),
+    (3, "índices por usuario y fecha", _v3_indices),
+    (4, "referencia externa de movimientos", _v4_referencia_externa),
+    (5, "sesiones y conversaciones", _v5_sesiones),
+    (6, "checkpoints de saldo", _v6_checkpoints_de_saldo),
+    (7, "particiones del historial archivado", _v7_particiones),
+    (8, "invalidaciones de la caché de usuarios", _v8_invalidaciones),
+    (9, "lote pendiente del archivo", _v9_lote_pendiente_del_archivo),
+]
+
+# Consultas del camino caliente: (nombre, sql, parámetros de ejemplo)
+HOT_QUERIES = [
+    ("get_user",
+     'SELECT user_id, nombre, saldo_centavos, fecha_registro, interacciones FROM usuarios WHERE user_id = ?',
+     (1,)),
+    ("get_transactions",
+     'SELECT id, descripcion, monto_centavos, fecha FROM movimientos WHERE user_id = ? ORDER BY fecha DESC, id DESC LIMIT ?',
+     (1, 5)),
+    ("get_transactions_page",
+     'SELECT id, descripcion, monto_centavos, fecha FROM movimientos WHERE user_id = ? AND (fecha, id) < (?, ?) ORDER BY fecha DESC, id DESC LIMIT ?',
+     (1, 0, 0, 6)),
+    ("update_interactions",
+     'UPDATE usuarios SET interacciones = interacciones + ? WHERE user_id = ?',
+     (1, 1)),
+    ("save_transaction_saldo",
+     'UPDATE usuarios SET saldo_centavos = saldo_centavos + ? WHERE user_id = ?',
+     (100, 1)),
+    ("load_cached_responses",
+     'SELECT clave, respuesta, creado FROM respuestas_cache WHERE contexto = ? AND creado > ?',
+     ("x", 0)),
+    ("balance_after_checkpoint",
+     'SELECT COALESCE(SUM(monto_centavos), 0) FROM movimientos WHERE user_id = ? AND id > ? AND fecha <= ?',
+     (1, 0, 0)),
+    ("latest_checkpoint",
+     'SELECT hasta_id, hasta_fecha, saldo_centavos, creado FROM saldos_checkpoint WHERE user_id = ? ORDER BY hasta_id DESC LIMIT 1',
+     (1,)),
+    ("list_partitions",
+     'SELECT p.mes, p.archivo, p.desde, p.hasta FROM particiones_usuarios pu JOIN particiones p ON p.mes = pu.mes WHERE pu.user_id = ? ORDER BY pu.mes DESC',
+     (1,)),
+    ("archive_oldest",
+     'SELECT fecha FROM movimientos WHERE fecha < ? AND id <= ? ORDER BY fecha LIMIT 1',
+     (0, 0)),
+    ("user_cache_invalidations",
+     'SELECT id, user_id FROM invalidaciones_usuarios WHERE id > ? ORDER BY id',
+     (0,)),
+    ("load_session",
+     'SELECT datos, version, actualizado FROM sesiones WHERE user_id = ?',
+     (1,)),
+]
+
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Aplicar las migraciones pendientes
+
+    Returns:
+        int: versión del esquema después de migrar
+    """
+    for version, descripcion, aplicar in MIGRATIONS:
+        if version <= get_version(conn):
+            continue
+        # BEGIN IMMEDIATE toma el lock de escritura: si otro proceso migró
+        # mientras tanto, lo vemos al volver a leer la versión
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version > get_version(conn):
+                aplicar(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return get_version(conn)
+
+
+def check_query_plans(conn):
+    """
+    Verificar que las consultas calientes usen índices
+
+    Returns:
+        list: (nombre, detalle del plan) de cada paso que recorre una tabla
+              completa o arma un índice temporal para ordenar
+    """
+    problemas = []
+    for nombre, sql, parametros in HOT_QUERIES:
+        for fila in conn.execute(f'EXPLAIN QUERY PLAN {sql}', parametros):
+            detalle = fila[-1]
+            if detalle.startswith("SCAN") or "TEMP B-TREE" in detalle:
+                problemas.append((nombre, detalle))
+    return problemas
+
+
+def main():
+    import db
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--check", action="store_true",
+                        help="verificar los planes de las consultas calientes")
+    args = parser.parse_args()
+
+    with db.get_pool().connection() as conn:
+        print(f"Esquema en versión {migrate(conn)} ({db.DB_PATH})")
+        if args.check:
+            problemas = check_query_plans(conn)
+            for nombre, detalle in problemas:
+                print(f"✗ {nombre}: {detalle}")
+            if problemas:
+                raise SystemExit(1)
+            print(f"✓ {len(HOT_QUERIES)} consultas calientes usan índices")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Formato de montos en pesos argentinos ($ 1.234.567,89)
+
+Los montos se guardan en centavos enteros; format_cents es el camino
+principal. Los resultados se memorizan porque los mismos montos (saldos
+iniciales, movimientos simulados, cuotas frecuentes) se repiten mucho.
+"""
+import math
+from functools import lru_cache
+
+FORMAT_CACHE_SIZE = 8192
+
+
+def _agrupar(entero):
+    """Entero no negativo con punto como separador de miles"""
+    if entero < 1000:
+        return str(entero)
+    return f"{entero:,}".replace(",", ".")
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def format_cents(centavos):
+    """Centavos enteros a '$ 1.234,56' (negativos como '$ -1.234,56')"""
+    signo = "-" if centavos < 0 else ""
+    entero, decimales = divmod(abs(centavos), 100)
+    return f"$ {signo}{_agrupar(entero)},{decimales:02d}"
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def format_pesos(monto):
+    """Monto en pesos (float) con el mismo redondeo que f'{monto:.2f}'"""
+    if not math.isfinite(monto):
+        return f"$ {monto}"
+    texto = f"{monto:.2f}"
+    signo = "-" if texto[0] == "-" else ""
+    entero, _, decimales = texto.lstrip("-").partition(".")
+    return f"$ {signo}{_agrupar(int(entero))},{decimales}"
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def format_movement(descripcion, monto_centavos):
+    """Línea de un movimiento: '🟢 + $ 2.500,00 - Transferencia recibida'"""
+    signo = "🟢 +" if monto_centavos > 0 else "🔴 -"
+    return f"{signo} {format_cents(abs(monto_centavos))} - {descripcion}"
+
+
+def cache_info():
+    """Aciertos de las cachés de formato"""
+    return {
+        "cents": format_cents.cache_info()._asdict(),
+        "pesos": format_pesos.cache_info()._asdict(),
+        "movements": format_movement.cache_info()._asdict(),
+    }
@@ -0,0 +1,335 @@
+"""
+Cola de salida de mensajes a Telegram con límites de envío
+
+Los handlers encolan sus respuestas con send() y siguen; unos pocos
+trabajadores las envían respetando un token bucket por chat y uno global
+(Telegram corta con 429 a partir de ~1 mensaje/s por chat y ~30/s en total).
+Los mensajes seguidos a un mismo chat se unen en uno solo cuando se puede,
+y ante un 429 el chat espera el retry_after que indica Telegram.
+
+Los mensajes de un chat salen en el orden en que se encolaron.
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import NetworkError, RetryAfter, TelegramError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Mensajes por segundo en total y por chat (0 sin límite)
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+# Mensajes que un chat puede recibir seguidos antes de aplicar OUTBOX_CHAT_RATE
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "8"))
+OUTBOX_MAX_RETRIES = 3
+OUTBOX_BACKOFF_BASE = 0.5
+
+# Largo máximo de un mensaje de Telegram y separador al unir mensajes
+LIMITE_TEXTO = 4096
+SEPARADOR = "\n\n"
+
+OUTBOX_REQUESTS = metrics.counter(
+    "outbox_requests_total", "Llamadas a sendMessage por resultado", ("result",))
+OUTBOX_MERGED = metrics.counter(
+    "outbox_merged_total", "Mensajes que viajaron unidos a otro del mismo chat")
+
+
+class TokenBucket:
+    """Fichas que se recargan a `tasa` por segundo hasta `capacidad`"""
+    __slots__ = ("tasa", "capacidad", "fichas", "ultimo", "pausa_hasta")
+
+    def __init__(self, tasa, capacidad, ahora=0.0):
+        self.tasa = tasa
+        self.capacidad = max(1, capacidad)
+        self.fichas = float(self.capacidad)
+        self.ultimo = ahora
+        self.pausa_hasta = 0.0
+
+    def espera(self, ahora):
+        """Segundos hasta que haya una ficha disponible (0 si ya hay)"""
+        pausa = max(0.0, self.pausa_hasta - ahora)
+        if not self.tasa:
+            return pausa
+        self.fichas = min(self.capacidad, self.fichas + (ahora - self.ultimo) * self.tasa)
+        self.ultimo = ahora
+        if self.fichas >= 1:
+            return pausa
+        return max(pausa, (1 - self.fichas) / self.tasa)
+
+    def tomar(self):
+        if self.tasa:
+            self.fichas -= 1
+
+    def pausar(self, segundos, ahora):
+        self.pausa_hasta = max(self.pausa_hasta, ahora + segundos)
+
+
+class _Mensaje:
+    __slots__ = ("bot", "texto", "reply_markup", "parse_mode", "futuro")
+
+    def __init__(self, bot, texto, reply_markup, parse_mode, futuro):
+        self.bot = bot
+        self.texto = texto
+        self.reply_markup = reply_markup
+        self.parse_mode = parse_mode
+        self.futuro = futuro
+
+
+class _Chat:
+    __slots__ = ("pendientes", "bucket", "activo")
+
+    def __init__(self, bucket):
+        self.pendientes = deque()
+        self.bucket = bucket
+        self.activo = False  # en la cola de listos o enviándose
+
+
+def agrupar(pendientes):
+    """
+    Saca de `pendientes` el primer mensaje y los siguientes que pueden viajar con él
+
+    Se unen mientras el texto entre en un mensaje, compartan bot y
+    parse_mode, y haya como mucho un teclado. Un teclado inline cierra el
+    grupo porque sus botones van debajo del texto al que corresponden. Un
+    mensaje con futuro (wait=True) viaja solo: quien lo espera puede editar
+    o borrar el Message y no debe tocar el texto de otros.
+
+    Returns:
+        tuple: (mensajes, texto unido, reply_markup)
+    """
+    primero = pendientes.popleft()
+    grupo = [primero]
+    texto = primero.texto
+    markup = primero.reply_markup
+    while pendientes and primero.futuro is None:
+        siguiente = pendientes[0]
+        if (siguiente.futuro is not None
+                or siguiente.bot is not primero.bot
+                or siguiente.parse_mode != primero.parse_mode
+                or isinstance(markup, InlineKeyboardMarkup)
+                or (markup is not None and siguiente.reply_markup is not None)
+                or len(texto) + len(SEPARADOR) + len(siguiente.texto) > LIMITE_TEXTO):
+            break
+        pendientes.popleft()
+        grupo.append(siguiente)
+        texto += SEPARADOR + siguiente.texto
+        markup = markup or siguiente.reply_markup
+    return grupo, texto, markup
+
+
+class Outbox:
+    def __init__(self, global_rate=OUTBOX_GLOBAL_RATE, chat_rate=OUTBOX_CHAT_RATE,
+                 chat_burst=OUTBOX_CHAT_BURST, workers=OUTBOX_WORKERS):
+        """
+        Args:
+            global_rate: Mensajes por segundo entre todos los chats (0 sin límite)
+            chat_rate: Mensajes por segundo a un mismo chat (0 sin límite)
+            chat_burst: Mensajes seguidos a un chat antes de aplicar chat_rate
+            workers: Envíos simultáneos (siempre de chats distintos)
+        """
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._listos = None
+        self._tareas = []
+        self._pendientes = 0
+        self._vacio = None
+        self.stats = {"messages": 0, "requests": 0, "merged": 0,
+                      "flood_waits": 0, "retries": 0, "errors": 0}
+
+    def _iniciar(self):
+        if self._tareas:
+            return
+        self._listos = asyncio.Queue()
+        self._vacio = asyncio.Event()
+        self._vacio.set()
+        self._tareas = [asyncio.ensure_future(self._trabajar()) for _ in range(self.workers)]
+
+    def send(self, bot, chat_id, texto, reply_markup=None, parse_mode=None, wait=False):
+        """
+        Encolar un mensaje sin esperar el envío
+
+        Args:
+            wait: Si es True devuelve un futuro que se resuelve con el
+                Message enviado (o con la excepción si no se pudo enviar)
+        """
+        self._iniciar()
+        futuro = asyncio.get_running_loop().create_future() if wait else None
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(TokenBucket(
+                self.chat_rate, self.chat_burst, asyncio.get_running_loop().time()))
+        chat.pendientes.append(_Mensaje(bot, texto, reply_markup, parse_mode, futuro))
+        self._pendientes += 1
+        self._vacio.clear()
+        self.stats["messages"] += 1
+        if not chat.activo:
+            chat.activo = True
+            self._listos.put_nowait(chat_id)
+        return futuro
+
+    async def _trabajar(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id = await self._listos.get()
+            chat = self._chats[chat_id]
+            espera = chat.bucket.espera(loop.time())
+            if espera > 0:
+                loop.call_later(espera, self._listos.put_nowait, chat_id)
+                continue
+
+            grupo = []
+            try:
+                await self.reservar()
+                chat.bucket.tomar()
+
+                grupo, texto, markup = agrupar(chat.pendientes)
+                enviado = await self._enviar(chat_id, chat, grupo, texto, markup)
+                if not enviado:
+                    # 429: el grupo vuelve al frente y el chat espera lo que pidió Telegram
+                    chat.pendientes.extendleft(reversed(grupo))
+                else:
+                    self._terminar(len(grupo))
+                grupo = []
+            except Exception as e:
+                # Un error inesperado no puede matar al trabajador ni dejar
+                # el chat marcado como activo para siempre
+                self.stats["errors"] += 1
+                OUTBOX_REQUESTS.inc("error")
+                logger.exception("Error inesperado al enviar al chat %s", chat_id)
+                self._rechazar(grupo, e)
+                self._terminar(len(grupo))
+            finally:
+                if chat.pendientes:
+                    self._listos.put_nowait(chat_id)
+                else:
+                    chat.activo = False
+                    # Se olvida el chat cuando su bucket vuelve a estar lleno
+                    loop.call_later(self._recarga(), self._olvidar, chat_id, chat)
+
+    async def reservar(self):
+        """
+        Esperar una ficha del bucket global y tomarla
+
+        Para llamadas a Telegram que no pasan por la cola, como editar un
+        mensaje ya enviado, así también respetan el límite global.
+        """
+        loop = asyncio.get_running_loop()
+        while (espera := self._global.espera(loop.time())) > 0:
+            await asyncio.sleep(espera)
+        self._global.tomar()
+
+    def _recarga(self):
+        return self.chat_burst / self.chat_rate if self.chat_rate else 0
+
+    def _olvidar(self, chat_id, chat):
+        if not chat.activo and self._chats.get(chat_id) is chat:
+            del self._chats[chat_id]
+
+    @staticmethod
+    def _rechazar(grupo, error):
+        for m in grupo:
+            if m.futuro is not None and not m.futuro.done():
+                m.futuro.set_exception(error)
+
+    def _terminar(self, cantidad):
+        self._pendientes -= cantidad
+        if self._pendientes == 0:
+            self._vacio.set()
+
+    async def _enviar(self, chat_id, chat, grupo, texto, markup):
+        """Devuelve False si Telegram pidió esperar (el grupo se reintenta después)"""
+        primero = grupo[0]
+        for intento in range(OUTBOX_MAX_RETRIES + 1):
+            try:
+                mensaje = await primero.bot.send_message(
+                    chat_id, texto, reply_markup=markup, parse_mode=primero.parse_mode)
+            except RetryAfter as e:
+                self.stats["flood_waits"] += 1
+                OUTBOX_REQUESTS.inc("retry_after")
+                logger.warning("Telegram pidió esperar %s s antes de escribir al chat %s",
+                               e.retry_after, chat_id)
+                chat.bucket.pausar(e.retry_after, asyncio.get_running_loop().time())
+                return False
+            except NetworkError as e:
+                # Incluye TimedOut; el mensaje podría haber llegado igual
+                if intento < OUTBOX_MAX_RETRIES:
+                    self.stats["retries"] += 1
+                    OUTBOX_REQUESTS.inc("network_error")
+                    await asyncio.sleep(OUTBOX_BACKOFF_BASE * 2 ** intento)
+                    continue
+                error = e
+            except TelegramError as e:
+                error = e
+            else:
+                self.stats["requests"] += 1
+                self.stats["merged"] += len(grupo) - 1
+                OUTBOX_REQUESTS.inc("ok")
+                OUTBOX_MERGED.inc(n=len(grupo) - 1)
+                for m in grupo:
+                    if m.futuro is not None and not m.futuro.done():
+                        m.futuro.set_result(mensaje)
+                return True
+            break
+
+        self.stats["errors"] += 1
+        OUTBOX_REQUESTS.inc("error")
+        logger.error("Error al enviar mensaje al chat %s: %s", chat_id, error)
+        self._rechazar(grupo, error)
+        return True
+
+    def pending(self):
+        return self._pendientes
+
+    async def flush(self):
+        """Esperar a que se envíe todo lo encolado"""
+        if self._vacio is not None:
+            await self._vacio.wait()
+
+    async def close(self, timeout=10):
+        """Enviar lo pendiente (hasta `timeout` segundos) y detener los trabajadores"""
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Se descartan %s mensajes sin enviar", self._pendientes)
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+        self._chats.clear()
+        self._pendientes = 0
+
+
+_outbox = Outbox()
+
+metrics.gauge("outbox_pending", "Mensajes encolados sin enviar", lambda: _outbox.pending())
+
+
+def send(bot, chat_id, texto, reply_markup=None, parse_mode=None, wait=False):
+    """Encolar un mensaje en la cola de salida compartida (ver Outbox.send)"""
+    return _outbox.send(bot, chat_id, texto, reply_markup, parse_mode, wait)
+
+
+async def reservar():
+    """Tomar una ficha del límite global de la cola compartida (ver Outbox.reservar)"""
+    await _outbox.reservar()
+
+
+async def flush():
+    await _outbox.flush()
+
+
+async def close(timeout=10):
+    await _outbox.close(timeout)
+
+
+def get_stats():
+    return {**_outbox.stats, "pending": _outbox.pending(), "chats": len(_outbox._chats)}
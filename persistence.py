@@ -0,0 +1,186 @@
+import asyncio
+import json
+import os
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import db
+import db_async
+
+# Sesiones sin actividad por más de SESSION_TTL segundos se descartan
+# (el usuario vuelve a ingresar el PIN)
+SESSION_TTL = int(os.getenv("SESSION_TTL", "1800"))
+# Cada cuántos segundos se escriben los cambios acumulados
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "5"))
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persistencia de user_data y de los estados de ConversationHandler en la
+    base SQLite, compartida entre procesos del bot.
+
+    - Carga perezosa: no se lee nada al iniciar; la sesión de cada usuario se
+      trae en refresh_user_data, y se vuelve a leer si otro proceso la
+      escribió (columna version).
+    - Escrituras agrupadas: la Application llama a update_* cada
+      SESSION_FLUSH_INTERVAL segundos solo para los usuarios con updates; los
+      datos sin cambios no se reescriben y el resto va en una transacción.
+    - Expiración: las sesiones inactivas por más de SESSION_TTL se vacían y
+      se purgan de la base, de los diccionarios de esta clase y, si se llamó
+      a set_application, de Application.user_data.
+
+    Los estados de conversación se cargan una sola vez al iniciar (así
+    funciona ConversationHandler) y no se vuelven a leer: entre procesos solo
+    se comparte user_data. Con varios procesos, los updates de un mismo chat
+    deben llegar siempre al mismo proceso (un único proceso en polling, o
+    ruteo fijo por chat delante del webhook); si no, un proceso no ve la
+    conversación que empezó otro.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, update_interval=SESSION_FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.ttl = ttl
+        self._versiones = {}       # user_id -> versión en memoria
+        self._persistido = {}      # user_id -> (datos JSON, momento de escritura)
+        self._ultimo_acceso = {}   # user_id -> último update procesado
+        self._aplicacion = None
+        self._sesiones_pendientes = {}
+        self._conversaciones_pendientes = {}
+        self._lock = asyncio.Lock()
+        self._ultima_purga = 0.0
+        self._stats = {"cargas": 0, "escrituras": 0, "omitidas": 0, "expiradas": 0, "purgadas": 0}
+
+    def set_application(self, application):
+        """Application cuyo user_data se purga junto con las sesiones vencidas"""
+        self._aplicacion = application
+
+    async def get_user_data(self):
+        # Carga perezosa en refresh_user_data
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        filas = await db_async.run(db.load_conversations, name, db.ahora() - self.ttl)
+        return {tuple(json.loads(clave)): json.loads(estado) for clave, estado in filas}
+
+    async def update_conversation(self, name, key, new_state):
+        estado = json.dumps(new_state) if new_state is not None else None
+        self._conversaciones_pendientes[(name, json.dumps(list(key)))] = estado
+        await self._escribir()
+
+    async def update_user_data(self, user_id, data):
+        datos = json.dumps(data, sort_keys=True)
+        anterior = self._persistido.get(user_id)
+        # Sin cambios: solo se reescribe para renovar el vencimiento
+        if anterior and anterior[0] == datos and time.time() - anterior[1] < self.ttl / 4:
+            self._stats["omitidas"] += 1
+            return
+        self._sesiones_pendientes[user_id] = datos
+        await self._escribir()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._sesiones_pendientes.pop(user_id, None)
+        self._versiones.pop(user_id, None)
+        self._persistido.pop(user_id, None)
+        await db_async.run(db.delete_session, user_id)
+
+    async def refresh_user_data(self, user_id, user_data):
+        momento = time.time()
+        ultimo = self._ultimo_acceso.get(user_id)
+        self._ultimo_acceso[user_id] = momento
+        # Sin último acceso y con datos: la entrada se purgó por inactividad
+        if (ultimo is None or momento - ultimo > self.ttl) and user_data:
+            user_data.clear()
+            self._stats["expiradas"] += 1
+
+        fila = await db_async.run(db.load_session, user_id)
+        if fila is None:
+            return
+        datos, version, actualizado = fila
+        if version == self._versiones.get(user_id) or momento - actualizado > self.ttl:
+            return
+        # Primera vez que vemos al usuario o la escribió otro proceso
+        user_data.clear()
+        user_data.update(json.loads(datos))
+        self._versiones[user_id] = version
+        self._persistido[user_id] = (datos, actualizado)
+        self._stats["cargas"] += 1
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def _escribir(self):
+        # update_persistence llama a update_* en paralelo: ceder el turno
+        # deja que todas encolen sus cambios y se escriban juntos
+        await asyncio.sleep(0)
+        async with self._lock:
+            sesiones, self._sesiones_pendientes = self._sesiones_pendientes, {}
+            conversaciones, self._conversaciones_pendientes = self._conversaciones_pendientes, {}
+            if sesiones or conversaciones:
+                versiones = await db_async.run(
+                    db.save_sessions,
+                    list(sesiones.items()),
+                    [(nombre, clave, estado) for (nombre, clave), estado in conversaciones.items()]
+                )
+                if versiones is None:
+                    # Se reintenta en la próxima pasada, sin pisar cambios más nuevos
+                    for user_id, datos in sesiones.items():
+                        self._sesiones_pendientes.setdefault(user_id, datos)
+                    for clave, estado in conversaciones.items():
+                        self._conversaciones_pendientes.setdefault(clave, estado)
+                else:
+                    momento = time.time()
+                    for user_id, datos in sesiones.items():
+                        self._persistido[user_id] = (datos, momento)
+                    self._versiones.update(versiones)
+                    self._stats["escrituras"] += len(sesiones) + len(conversaciones)
+            await self._purgar()
+
+    async def _purgar(self):
+        if time.time() - self._ultima_purga < min(self.ttl / 4, 600):
+            return
+        self._ultima_purga = time.time()
+        self._stats["purgadas"] += await db_async.run(db.purge_sessions, db.ahora() - self.ttl)
+        # Los usuarios inactivos dejan de ocupar memoria, también en
+        # Application.user_data; si vuelven, empiezan con la sesión vacía
+        limite = time.time() - self.ttl
+        for user_id in [u for u, momento in self._ultimo_acceso.items() if momento < limite]:
+            del self._ultimo_acceso[user_id]
+            self._versiones.pop(user_id, None)
+            self._persistido.pop(user_id, None)
+            if self._aplicacion is not None:
+                self._aplicacion.drop_user_data(user_id)
+
+    async def flush(self):
+        await self._escribir()
+
+    def stats(self):
+        return dict(self._stats, usuarios=len(self._ultimo_acceso))
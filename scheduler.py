@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Updates procesándose a la vez entre todos los usuarios
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "32"))
+# Updates admitidos en total (procesándose o esperando su turno)
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1000"))
+# Updates en espera por usuario; los que exceden el límite se descartan
+UPDATE_MAX_PER_USER = int(os.getenv("UPDATE_MAX_PER_USER", "10"))
+
+
+class _ColaUsuario:
+    __slots__ = ("lock", "profundidad")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # FIFO: respeta el orden de llegada
+        self.profundidad = 0
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Procesa en paralelo updates de distintos usuarios y en orden estricto
+    los de un mismo usuario (el flujo MONTO -> PLAZO del préstamo depende de eso).
+
+    El semáforo de la clase base limita los updates admitidos; cada update
+    toma primero el turno de su usuario y recién después un trabajador, así
+    un usuario con muchos mensajes en cola no ocupa trabajadores esperando.
+    """
+
+    def __init__(self, workers=UPDATE_WORKERS, max_pending=UPDATE_MAX_PENDING,
+                 max_per_user=UPDATE_MAX_PER_USER, al_encolar=None):
+        """
+        Args:
+            workers: Updates procesándose a la vez
+            max_pending: Updates admitidos en total; el resto espera
+            max_per_user: Updates en cola por usuario antes de descartar
+            al_encolar: Función (user_id, update) que se llama cuando llega un
+                update de un usuario que ya tiene otro en curso
+        """
+        super().__init__(max(max_pending, workers))
+        self.workers = workers
+        self.max_per_user = max_per_user
+        self._al_encolar = al_encolar
+        self._trabajadores = asyncio.Semaphore(workers)
+        self._colas = {}
+        self._activos = 0
+        self._procesados = 0
+        self._descartados = 0
+        self._profundidad_maxima = 0
+        self._espera_total = 0.0
+
+    @staticmethod
+    def _clave(update):
+        """Usuario al que pertenece el update (None si no tiene)"""
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def _ejecutar(self, coroutine, inicio):
+        async with self._trabajadores:
+            self._espera_total += time.perf_counter() - inicio
+            self._activos += 1
+            try:
+                await coroutine
+            finally:
+                self._activos -= 1
+                self._procesados += 1
+
+    async def do_process_update(self, update, coroutine):
+        inicio = time.perf_counter()
+        clave = self._clave(update)
+        if clave is None:
+            return await self._ejecutar(coroutine, inicio)
+
+        cola = self._colas.get(clave)
+        if cola is None:
+            cola = self._colas[clave] = _ColaUsuario()
+        if cola.profundidad >= self.max_per_user:
+            self._descartados += 1
+            coroutine.close()
+            logger.warning("Update descartado: el usuario %s tiene %s pendientes", clave, cola.profundidad)
+            return
+
+        cola.profundidad += 1
+        self._profundidad_maxima = max(self._profundidad_maxima, cola.profundidad)
+        try:
+            if cola.profundidad > 1 and self._al_encolar is not None:
+                self._al_encolar(clave, update)
+            async with cola.lock:
+                await self._ejecutar(coroutine, inicio)
+        finally:
+            cola.profundidad -= 1
+            if cola.profundidad == 0 and self._colas.get(clave) is cola:
+                del self._colas[clave]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def depths(self, top=10):
+        """Usuarios con más updates en cola: lista de (user_id, profundidad)"""
+        colas = sorted(self._colas.items(), key=lambda item: item[1].profundidad, reverse=True)
+        return [(clave, cola.profundidad) for clave, cola in colas[:top]]
+
+    def stats(self):
+        return {
+            "activos": self._activos,
+            "trabajadores": self.workers,
+            "pendientes": sum(cola.profundidad for cola in self._colas.values()),
+            "usuarios_en_cola": len(self._colas),
+            "profundidad_maxima": self._profundidad_maxima,
+            "procesados": self._procesados,
+            "descartados": self._descartados,
+            "espera_promedio": self._espera_total / self._procesados if self._procesados else 0.0
+        }
@@ -0,0 +1,33 @@
+"""
+Configuración común de las pruebas
+
+Las variables se fijan antes de importar los módulos del bot, que las leen
+al importarse. Cada prueba que usa la base recibe un archivo nuevo.
+"""
+import os
+import tempfile
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="banco-tests-"), "banco.db")
+os.environ["TELEGRAM_TOKEN"] = "1:pruebas"
+os.environ["OPENAI_API_KEY"] = "pruebas"
+os.environ["METRICS_PORT"] = "0"
+os.environ["LEDGER_AUDIT_INTERVAL"] = "0"
+os.environ["ARCHIVE_INTERVAL"] = "0"
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    """Base SQLite vacía y migrada en un directorio temporal"""
+    db.close_pool()
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "banco.db"))
+    monkeypatch.setattr(db, "_invalidaciones_vistas", None)
+    db._usuarios.clear()
+    assert db.init_db()
+    yield db
+    db.flush_interactions()
+    db.close_pool()
+    db._usuarios.clear()
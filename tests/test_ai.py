@@ -0,0 +1,177 @@
+"""Consultas idénticas simultáneas a la IA (single-flight)"""
+import asyncio
+
+import pytest
+
+import ai
+
+
+class FakeCompletions:
+    """Reemplaza las llamadas a OpenAI: cuenta llamadas y se libera a pedido"""
+
+    def __init__(self, respuesta="Respuesta de prueba", error=None):
+        self.respuesta = respuesta
+        self.error = error
+        self.llamadas = 0
+        self.liberar = None
+        self.iniciada = None
+
+    async def completar(self, user_message):
+        self.llamadas += 1
+        self.iniciada.set()
+        await self.liberar.wait()
+        if self.error is not None:
+            raise self.error
+        return self.respuesta
+
+    async def completar_en_flujo(self, user_message, entregar):
+        self.llamadas += 1
+        palabras = self.respuesta.split(" ")
+        entregar(palabras[0])
+        self.iniciada.set()
+        await self.liberar.wait()
+        for palabra in palabras[1:]:
+            entregar(" " + palabra)
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeCompletions()
+    monkeypatch.setattr(ai, "_completar", fake.completar)
+    monkeypatch.setattr(ai, "_completar_en_flujo", fake.completar_en_flujo)
+    monkeypatch.setattr(ai, "AI_CACHE_ENABLED", False)
+    yield fake
+    ai._vuelos.clear()
+    ai._en_curso.clear()
+
+
+def _correr(corrutina, fake):
+    async def principal():
+        fake.liberar = asyncio.Event()
+        fake.iniciada = asyncio.Event()
+        return await corrutina()
+    return asyncio.run(principal())
+
+
+async def _leer_flujo(mensaje, user_id=None):
+    return "".join([fragmento async for fragmento in ai.stream_ai_response(mensaje, user_id)])
+
+
+def test_consultas_identicas_comparten_una_llamada(fake):
+    async def escenario():
+        tareas = [asyncio.ensure_future(ai.get_ai_response("¿Qué tarjetas tienen?", user_id))
+                  for user_id in range(50)]
+        await fake.iniciada.wait()
+        fake.liberar.set()
+        return await asyncio.gather(*tareas)
+
+    respuestas = _correr(escenario, fake)
+    assert fake.llamadas == 1
+    assert respuestas == ["Respuesta de prueba"] * 50
+    assert not ai._vuelos
+
+
+def test_cancelar_a_uno_no_cancela_a_los_demas(fake):
+    async def escenario():
+        tareas = [asyncio.ensure_future(ai.get_ai_response("¿Qué tarjetas tienen?", user_id))
+                  for user_id in range(3)]
+        await fake.iniciada.wait()
+        ai.cancel_ai_response(0)
+        await asyncio.sleep(0)
+        fake.liberar.set()
+        return await asyncio.gather(*tareas)
+
+    respuestas = _correr(escenario, fake)
+    assert fake.llamadas == 1
+    assert respuestas == [None, "Respuesta de prueba", "Respuesta de prueba"]
+
+
+def test_cancelar_a_todos_cancela_la_consulta(fake):
+    async def escenario():
+        tareas = [asyncio.ensure_future(ai.get_ai_response("¿Qué tarjetas tienen?", user_id))
+                  for user_id in range(2)]
+        await fake.iniciada.wait()
+        vuelo = next(iter(ai._vuelos.values()))
+        ai.cancel_ai_response(0)
+        ai.cancel_ai_response(1)
+        respuestas = await asyncio.gather(*tareas)
+        await asyncio.sleep(0)
+        return respuestas, vuelo.tarea.cancelled()
+
+    respuestas, cancelada = _correr(escenario, fake)
+    assert respuestas == [None, None]
+    assert cancelada
+    assert not ai._vuelos
+
+
+def test_un_error_llega_a_todos_los_que_esperan(fake):
+    fake.error = RuntimeError("caída de la API")
+
+    async def escenario():
+        tareas = [asyncio.ensure_future(ai.get_ai_response("¿Qué tarjetas tienen?"))
+                  for _ in range(5)]
+        await fake.iniciada.wait()
+        fake.liberar.set()
+        return await asyncio.gather(*tareas)
+
+    respuestas = _correr(escenario, fake)
+    assert fake.llamadas == 1
+    assert respuestas == [ai.RESPUESTA_ERROR] * 5
+
+
+def test_quien_se_suma_tarde_al_flujo_recibe_el_texto_completo(fake):
+    fake.respuesta = "Ofrecemos Visa Classic y Mastercard"
+
+    async def escenario():
+        primero = asyncio.ensure_future(_leer_flujo("¿Qué tarjetas tienen?", 1))
+        await fake.iniciada.wait()
+        # El primer fragmento ya se entregó cuando llega el segundo usuario
+        tardio = asyncio.ensure_future(_leer_flujo("¿Qué tarjetas tienen?", 2))
+        await asyncio.sleep(0)
+        fake.liberar.set()
+        return await asyncio.gather(primero, tardio)
+
+    textos = _correr(escenario, fake)
+    assert fake.llamadas == 1
+    assert textos == ["Ofrecemos Visa Classic y Mastercard"] * 2
+
+
+def test_flujo_cancelado_con_texto_queda_marcado_como_interrumpido(fake):
+    fake.respuesta = "Ofrecemos Visa Classic y Mastercard"
+
+    async def escenario():
+        lector = asyncio.ensure_future(_leer_flujo("¿Qué tarjetas tienen?", 1))
+        await fake.iniciada.wait()
+        ai.cancel_ai_response(1)
+        fake.liberar.set()
+        return await lector
+
+    assert _correr(escenario, fake) == "Ofrecemos" + ai.RESPUESTA_INTERRUMPIDA
+
+
+def test_error_en_flujo_sin_texto_devuelve_mensaje_de_error(fake, monkeypatch):
+    async def fallar(user_message, entregar):
+        fake.llamadas += 1
+        raise RuntimeError("caída de la API")
+
+    monkeypatch.setattr(ai, "_completar_en_flujo", fallar)
+    textos = _correr(lambda: asyncio.gather(
+        _leer_flujo("¿Qué tarjetas tienen?"), _leer_flujo("¿Qué tarjetas tienen?")), fake)
+    assert fake.llamadas == 1
+    assert textos == [ai.RESPUESTA_ERROR] * 2
+
+
+def test_cache_aproximada_exige_mismos_numeros_y_negaciones(monkeypatch):
+    monkeypatch.setattr(ai, "_respuestas", ai.LRUTTLCache(100, None))
+    monkeypatch.setattr(ai, "AI_CACHE_FUZZY", 0.9)
+    for pregunta in ("plazo fijo 100000 30 dias", "prestamo 12 meses", "3 cuotas",
+                     "cuotas sin interes", "tarjetas ofrecen"):
+        ai._respuestas.set(pregunta, f"respuesta: {pregunta}")
+
+    assert ai._buscar_en_cache("plazo fijo 500000 30 dias") is None
+    assert ai._buscar_en_cache("prestamo 24 meses") is None
+    assert ai._buscar_en_cache("12 cuotas") is None
+    assert ai._buscar_en_cache("cuotas con interes") is None
+    assert ai._buscar_en_cache("tarjetas ofrece") == "respuesta: tarjetas ofrecen"
@@ -0,0 +1,115 @@
+"""Archivo del historial en particiones mensuales"""
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import archive
+import loan_batch
+import ledger
+
+DIA = 86400
+
+
+@pytest.fixture
+def historial(base):
+    """Dos usuarios con movimientos y préstamos de los últimos tres años, ya auditados"""
+    ahora = base.ahora()
+    with base.get_pool().connection() as conn:
+        conn.executemany(
+            'INSERT INTO usuarios (user_id, nombre, saldo_centavos, fecha_registro) VALUES (?, ?, 0, ?)',
+            [(1, "Ana", ahora), (2, "Beto", ahora)])
+        conn.executemany(
+            'INSERT INTO movimientos (user_id, descripcion, monto_centavos, fecha) VALUES (?, ?, ?, ?)',
+            [(1 + i % 2, f"mov {i}", 100 + i, ahora - i * 11 * DIA) for i in range(100)])
+        conn.executemany(
+            'INSERT INTO prestamos (user_id, monto_centavos, plazo, tasa, cuota_centavos, total_centavos, fecha) '
+            'VALUES (?, ?, ?, 55.0, 0, 0, ?)',
+            [(1 + i % 2, 100000 * (i + 1), 12, ahora - i * 30 * DIA) for i in range(30)])
+        conn.execute('UPDATE usuarios SET saldo_centavos = '
+                     '(SELECT SUM(monto_centavos) FROM movimientos m WHERE m.user_id = usuarios.user_id)')
+        conn.commit()
+    assert ledger.audit()["diferencias"] == []
+    return ahora
+
+
+def _foto(base, ahora):
+    historial = {u: list(base.iter_transactions(u, chunk_size=7)) for u in (1, 2)}
+    saldos = {(u, dias): ledger.balance_at(u, ahora - dias * DIA)
+              for u in (1, 2) for dias in (0, 400, 800)}
+    return historial, saldos
+
+
+def _contar(base, tabla):
+    with base.get_pool().connection() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM {tabla}').fetchone()[0]
+
+
+def test_archivar_no_cambia_lo_que_se_lee(base, historial):
+    antes = _foto(base, historial)
+    resultado = archive.archive(horizonte_dias=365, pausa=0)
+
+    assert resultado["movimientos"] > 0 and resultado["prestamos"] > 0
+    assert _contar(base, "movimientos") + resultado["movimientos"] == 100
+    assert _foto(base, historial) == antes
+    assert archive.pending(365) == {"movimientos": {}, "prestamos": {}}
+
+    cotizados = sum(len(ids) for ids, _cotizaciones in loan_batch.reprice_saved_loans(7))
+    assert cotizados == 30
+
+
+def test_sin_auditoria_no_se_archivan_movimientos(base):
+    with base.get_pool().connection() as conn:
+        conn.execute('INSERT INTO movimientos (user_id, descripcion, monto_centavos, fecha) VALUES (1, ?, 100, 0)',
+                     ("viejo",))
+        conn.commit()
+    assert archive.archive(horizonte_dias=365, pausa=0)["movimientos"] == 0
+    assert _contar(base, "movimientos") == 1
+
+
+def test_corrida_cortada_no_duplica_y_se_recupera(base, historial, monkeypatch):
+    archive.archive(horizonte_dias=365, pausa=0)
+    # Movimiento atrasado del usuario 1 en un mes ya archivado
+    fecha = historial - 700 * DIA
+    with base.get_pool().connection() as conn:
+        conn.execute('INSERT INTO movimientos (user_id, descripcion, monto_centavos, fecha) VALUES (1, ?, 5000, ?)',
+                     ("atrasado", fecha))
+        conn.execute('UPDATE usuarios SET saldo_centavos = saldo_centavos + 5000 WHERE user_id = 1')
+        conn.commit()
+    ledger.audit()
+    antes = _foto(base, historial)
+
+    # La corrida se corta después de copiar a la partición y antes de borrar
+    def cortar(_conn, _tabla, _ids):
+        raise sqlite3.OperationalError("corrida cortada")
+
+    with monkeypatch.context() as parche:
+        parche.setattr(archive, "_borrar", cortar)
+        archive.archive(horizonte_dias=365, pausa=0)
+
+    with base.get_pool().connection() as conn:
+        (particion, tabla, desde_id, hasta_id), = archive._lotes_cortados(conn)
+        archivados = conn.execute('SELECT movimientos FROM particiones WHERE mes = ?',
+                                  (particion.mes,)).fetchone()[0]
+        atrasado = conn.execute('SELECT id FROM movimientos WHERE descripcion = ?',
+                                ("atrasado",)).fetchone()[0]
+    assert (tabla, desde_id, hasta_id) == ("movimientos", atrasado, atrasado)
+    with closing(sqlite3.connect(base.partition_path(particion.archivo))) as archivo:
+        assert archivo.execute('SELECT COUNT(*) FROM movimientos WHERE id = ?', (atrasado,)).fetchone()[0] == 1
+    assert _foto(base, historial) == antes
+
+    archive.archive(horizonte_dias=365, pausa=0)
+    assert _foto(base, historial) == antes
+    with base.get_pool().connection() as conn:
+        assert archive._lotes_cortados(conn) == []
+        assert conn.execute('SELECT COUNT(*) FROM movimientos WHERE descripcion = ?', ("atrasado",)).fetchone()[0] == 0
+        assert conn.execute('SELECT movimientos FROM particiones WHERE mes = ?',
+                            (particion.mes,)).fetchone()[0] == archivados + 1
+
+
+def test_sin_lotes_cortados_no_se_relee_el_historial(base, historial, monkeypatch):
+    archive.archive(horizonte_dias=365, pausa=0)
+    recuperaciones = []
+    monkeypatch.setattr(archive, "_recuperar", lambda *args: recuperaciones.append(args) or 0)
+    archive.archive(horizonte_dias=365, pausa=0)
+    assert recuperaciones == []
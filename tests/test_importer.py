@@ -0,0 +1,67 @@
+"""Importación masiva de movimientos"""
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import importer
+
+
+@pytest.mark.parametrize("monto", ["Infinity", "-inf", "NaN", "1e400", "abc", ""])
+def test_rechaza_montos_invalidos(monto):
+    with pytest.raises(ValueError):
+        importer.parsear_fila({"ref": "r1", "user_id": "1", "monto": monto})
+
+
+def test_importar_es_idempotente_y_rechaza_filas_malas(base, tmp_path):
+    ruta = tmp_path / "movimientos.csv"
+    ruta.write_text(
+        "ref,user_id,descripcion,monto,fecha\n"
+        "a,1,Sueldo,1500.50,2025-05-01\n"
+        "b,1,Infinito,Infinity,2025-05-01\n"
+        "c,2,Compra,-200,2025-05-02\n",
+        encoding="utf-8")
+
+    stats = importer.importar(str(ruta), progreso=lambda _texto: None)
+    assert (stats["insertadas"], stats["rechazadas"]) == (2, 1)
+    assert base.get_user(1).saldo_centavos == 150050
+
+    stats = importer.importar(str(ruta), progreso=lambda _texto: None)
+    assert (stats["insertadas"], stats["duplicadas"]) == (0, 2)
+
+
+def test_cambios_de_otro_proceso_invalidan_la_cache(base, monkeypatch):
+    monkeypatch.setattr(base, "USER_CACHE_ENABLED", True)
+    monkeypatch.setattr(base, "USER_CACHE_SYNC_INTERVAL", 0)
+    assert base.create_user(1)
+    saldo = base.get_user(1).saldo_centavos
+
+    # Otro proceso (otra conexión, sin tocar la caché de este)
+    with closing(sqlite3.connect(base.DB_PATH)) as conn:
+        conn.execute('UPDATE usuarios SET saldo_centavos = saldo_centavos + 100 WHERE user_id = 1')
+        base.notify_user_changes(conn, [1])
+        conn.commit()
+
+    assert base.get_user(1).saldo_centavos == saldo + 100
+
+
+def test_lineas_corruptas_se_rechazan_sin_cortar_la_importacion(base, tmp_path):
+    jsonl = tmp_path / "movimientos.jsonl"
+    jsonl.write_bytes(
+        b'{"ref": "j1", "user_id": 1, "monto": "10"}\n'
+        b'{bad\n'
+        b'[1, 2]\n'
+        b'{"ref": "j2", "user_id": 1, "descripcion": "caf\xe9", "monto": "5"}\n'
+        b'{"ref": "j3", "user_id": 1, "monto": "2.5"}\n')
+    stats = importer.importar(str(jsonl), progreso=lambda _texto: None)
+    assert (stats["insertadas"], stats["rechazadas"]) == (2, 3)
+
+    ruta_csv = tmp_path / "movimientos.csv"
+    ruta_csv.write_bytes(
+        b"ref,user_id,descripcion,monto\n"
+        b"c1,2,Sueldo,100\n"
+        b"c2,2,Caf\xe9,-3\n"
+        b"c3,2,Compra,-7\n")
+    stats = importer.importar(str(ruta_csv), progreso=lambda _texto: None)
+    assert (stats["insertadas"], stats["rechazadas"]) == (2, 1)
+    assert base.get_user(2).saldo_centavos == 9300
@@ -0,0 +1,26 @@
+"""Clasificador de intenciones por palabras clave"""
+from benchmarks.intents import CORPUS
+from intents import IntentClassifier, fold
+
+
+def test_fold():
+    assert fold("¿Cuánto  PAGARÍA?") == "cuanto pagaria?"
+    assert fold("años") == "años"
+
+
+def test_corpus():
+    clasificador = IntentClassifier()
+    for mensaje, esperado in CORPUS:
+        assert clasificador.classify(mensaje).intent == esperado, mensaje
+
+
+def test_frase_mas_larga_gana():
+    clasificador = IntentClassifier()
+    # "tarjeta de credito" consume la palabra "credito" y no suma a prestamo
+    assert clasificador.classify("tarjeta de crédito").confidence == 1.0
+
+
+def test_entidades():
+    resultado = IntentClassifier().classify("préstamo de $ 250.000 a 2 años")
+    assert resultado.intent == "simulacion"
+    assert resultado.entities == {"monto": 250000, "plazo": 24}
@@ -0,0 +1,39 @@
+"""Buffer de escritura diferida del contador de interacciones"""
+
+
+def _interacciones(base, user_id):
+    with base.get_pool().connection() as conn:
+        return conn.execute(
+            'SELECT interacciones FROM usuarios WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+
+def test_lectura_durante_un_vaciado_no_cuenta_dos_veces(base):
+    assert base.create_user(1)
+    buffer = base.InteractionBuffer(intervalo=3600, umbral=1000)
+    buffer.add(1, 3)
+
+    vaciados = []
+
+    def leer():
+        valor = _interacciones(base, 1)
+        if not vaciados:
+            # El lote se escribe entre la lectura y la consulta de pendientes
+            vaciados.append(buffer.flush())
+        return valor
+
+    valor, pendientes = buffer.read(1, leer)
+    assert vaciados == [True]
+    assert valor + pendientes == 3
+    buffer.stop()
+
+
+def test_stop_escribe_lo_pendiente(base):
+    assert base.create_user(1)
+    buffer = base.InteractionBuffer(intervalo=3600, umbral=1000)
+    buffer.add(1)
+    buffer.add(1)
+    assert _interacciones(base, 1) == 0
+
+    buffer.stop()
+    assert buffer.pending() == 0
+    assert _interacciones(base, 1) == 2
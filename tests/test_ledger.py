@@ -0,0 +1,55 @@
+"""Auditoría incremental del libro mayor y detección de diferencias"""
+import ledger
+
+
+def test_auditoria_sin_diferencias_es_incremental(base):
+    assert base.create_user(1)
+    assert base.create_user(2)
+    assert base.save_transaction(1, "Depósito", 1500.0)
+
+    resultado = ledger.audit()
+    assert resultado["usuarios"] == 2
+    assert resultado["movimientos"] > 0
+    assert resultado["diferencias"] == []
+
+    # Sin movimientos nuevos no se vuelve a leer el historial
+    assert ledger.audit()["movimientos"] == 0
+
+    assert base.save_transaction(2, "Pago", -200.0)
+    resultado = ledger.audit()
+    assert resultado["movimientos"] == 1
+    assert resultado["usuarios"] == 1
+
+
+def test_detecta_saldo_distinto_a_los_movimientos(base):
+    assert base.create_user(1)
+    assert base.create_user(2)
+    ledger.audit()
+    registrado, calculado = ledger.verify_user(1)
+    assert registrado == calculado
+
+    with base.get_pool().connection() as conn:
+        conn.execute('UPDATE usuarios SET saldo_centavos = saldo_centavos + 999 WHERE user_id = 1')
+        conn.commit()
+    assert base.save_transaction(1, "Depósito", 10.0)
+    assert base.save_transaction(2, "Depósito", 10.0)
+
+    diferencias = ledger.audit()["diferencias"]
+    assert [(user_id, registrado - calculado) for user_id, registrado, calculado in diferencias] == [(1, 999)]
+    registrado, calculado = ledger.verify_user(1)
+    assert registrado - calculado == 999
+
+
+def test_saldo_a_una_fecha(base):
+    assert base.create_user(1)
+    ledger.audit()
+    saldo_inicial = base.get_balance(1)
+    with base.get_pool().connection() as conn:
+        # Movimiento importado con fecha anterior al checkpoint
+        conn.execute(
+            'INSERT INTO movimientos (user_id, descripcion, monto_centavos, fecha) VALUES (1, ?, ?, ?)',
+            ("Atrasado", 5000, 1000))
+        conn.commit()
+    assert ledger.balance_at(1, 999) == 0
+    assert ledger.balance_at(1, 1000) == 5000
+    assert ledger.balance_at(1, base.ahora()) == saldo_inicial + 5000
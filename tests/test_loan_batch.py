@@ -0,0 +1,39 @@
+"""Cotización de préstamos por lotes"""
+import numpy as np
+import pytest
+
+import loan_batch
+from logic import calculate_loan
+
+
+@pytest.mark.parametrize("monto, plazo", [
+    (100000, 0), (100000, -3), (100000, 61), (100000, 12.5), (100000, True),
+    (0, 12), (-500, 12), (float("nan"), 12),
+])
+def test_cuadro_de_amortizacion_rechaza_entradas_invalidas(monto, plazo):
+    with pytest.raises(ValueError):
+        loan_batch.amortization_schedule(monto, plazo)
+
+
+def test_cuadro_de_amortizacion_cancela_el_prestamo():
+    cuadro = loan_batch.amortization_schedule(100000, np.int64(12), 4)
+    assert cuadro.shape == (12, 3)
+    assert cuadro[-1, 2] == 0.0
+    assert cuadro[:, 1].sum() == pytest.approx(100000)
+    assert cuadro[0, 0] + cuadro[0, 1] == pytest.approx(calculate_loan(100000, 12, 4)["cuota_mensual"], abs=0.01)
+
+
+def test_recotizar_saltea_simulaciones_sin_monto(base):
+    with base.get_pool().connection() as conn:
+        conn.executemany(
+            'INSERT INTO prestamos (id, user_id, monto_centavos, plazo, tasa, cuota_centavos, total_centavos, fecha) '
+            'VALUES (?, 1, ?, ?, 55.0, 0, 0, 0)',
+            [(1, 1000000, 12), (2, None, 12), (3, 500000, None), (4, None, None), (5, 2000000, 24)])
+        conn.commit()
+
+    bloques = list(loan_batch.reprice_saved_loans(chunk_size=2))
+    ids = np.concatenate([ids for ids, _cotizaciones in bloques])
+    assert ids.tolist() == [1, 5]
+    cuotas = np.concatenate([cotizaciones["cuota_mensual"] for _ids, cotizaciones in bloques])
+    assert cuotas.tolist() == [calculate_loan(10000, 12)["cuota_mensual"],
+                               calculate_loan(20000, 24)["cuota_mensual"]]
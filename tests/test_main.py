@@ -0,0 +1,74 @@
+"""Handlers y arranque de main.py"""
+import asyncio
+from types import SimpleNamespace
+
+import ai
+import main
+from main import leer_cursor_movimientos, teclado_movimientos
+
+
+def test_cursor_ida_y_vuelta():
+    teclado = teclado_movimientos(42, (1700000000, 7))
+    data = teclado.inline_keyboard[0][0].callback_data
+    assert leer_cursor_movimientos(data, 42) == (1700000000, 7)
+
+
+def test_cursor_de_otro_usuario():
+    assert leer_cursor_movimientos("mov:42:1700000000:7", 43) is None
+
+
+def test_cursor_con_formato_invalido():
+    for data in ("mov:1700000000:7", "mov:42:abc:7", "mov:42:1:7:9", "mov:42:-1:7", "", None):
+        assert leer_cursor_movimientos(data, 42) is None
+
+
+def test_un_error_al_precargar_openai_queda_en_el_log(monkeypatch, caplog):
+    def fallar():
+        raise ImportError("sin openai")
+
+    async def escenario():
+        await main.marcar_listo(None)
+        # Deja terminar al executor y correr el callback
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if "precargar" in caplog.text:
+                break
+
+    monkeypatch.setattr(main, "AI_PRELOAD", True)
+    monkeypatch.setattr(main.metrics, "set_ready", lambda listo=True: None)
+    monkeypatch.setattr(main, "preload_ai", fallar)
+    asyncio.run(escenario())
+    assert "Error al precargar openai: sin openai" in caplog.text
+
+
+def test_la_respuesta_en_vivo_toma_fichas_del_limite_global(monkeypatch):
+    class Mensaje:
+        def __init__(self):
+            self.ediciones = []
+
+        async def edit_text(self, texto):
+            self.ediciones.append(texto)
+
+    enviado = Mensaje()
+    reservas = []
+
+    async def enviar(bot, chat_id, texto, wait=False):
+        return enviado
+
+    async def reservar():
+        reservas.append(len(enviado.ediciones))
+
+    async def fragmentos(mensaje, user_id):
+        for fragmento in ("Hola", " mundo", ai.RESPUESTA_INTERRUMPIDA):
+            yield fragmento
+
+    update = SimpleNamespace(get_bot=lambda: None, effective_chat=SimpleNamespace(id=1))
+    monkeypatch.setattr(main, "STREAM_EDIT_INTERVAL", 0)
+    monkeypatch.setattr(main, "stream_ai_response", fragmentos)
+    monkeypatch.setattr(main.outbox, "send", enviar)
+    monkeypatch.setattr(main.outbox, "reservar", reservar)
+    asyncio.run(main.responder_en_vivo(update, 1, "¿Qué tarjetas tienen?"))
+
+    # Cada edición espera su ficha antes de llamar a Telegram
+    assert reservas == list(range(len(enviado.ediciones)))
+    assert enviado.ediciones[-1] == "Hola mundo" + ai.RESPUESTA_INTERRUMPIDA
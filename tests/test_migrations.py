@@ -0,0 +1,53 @@
+"""Migraciones del esquema: conversión de una base v1 con montos en pesos"""
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+import migrations
+
+
+def test_migra_una_base_v1_a_centavos_y_epoch(tmp_path):
+    with closing(sqlite3.connect(tmp_path / "v1.db")) as conn:
+        migrations._v1_esquema_inicial(conn)
+        conn.execute('PRAGMA user_version = 1')
+        conn.executemany(
+            'INSERT INTO usuarios (user_id, nombre, saldo, fecha_registro, interacciones) VALUES (?, ?, ?, ?, ?)',
+            [(1, "Ana", 8500.5, "2025-05-13 13:53:42", 7),
+             (2, "Beto", None, "fecha rota", None)])
+        conn.executemany(
+            'INSERT INTO movimientos (id, user_id, descripcion, monto, fecha) VALUES (?, ?, ?, ?, ?)',
+            [(10, 1, "Sueldo", 10000.0, "2025-05-01 09:00:00"),
+             # 0.1 + 0.2 no es exacto en REAL: el redondeo tiene que dar 30
+             (11, 1, "Café", 0.1 + 0.2, "2025-05-02 10:30:00"),
+             (12, 1, "Compra", -1499.995, "2025-05-03 18:15:00")])
+        conn.execute(
+            'INSERT INTO prestamos (id, user_id, monto, plazo, tasa, cuota, total, fecha) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (5, 1, 100000.0, 12, 0.45, 10235.76, 122829.12, "2025-05-04 12:00:00"))
+        conn.commit()
+
+        assert migrations.migrate(conn) == migrations.MIGRATIONS[-1][0]
+
+        assert conn.execute(
+            'SELECT saldo_centavos, fecha_registro, interacciones FROM usuarios WHERE user_id = 1'
+        ).fetchone() == (850050, int(datetime(2025, 5, 13, 13, 53, 42).timestamp()), 7)
+        saldo, fecha, interacciones = conn.execute(
+            'SELECT saldo_centavos, fecha_registro, interacciones FROM usuarios WHERE user_id = 2'
+        ).fetchone()
+        # Sin saldo ni fecha válida: saldo 0 y la fecha de la migración
+        assert (saldo, interacciones) == (0, 0)
+        assert isinstance(fecha, int)
+
+        assert conn.execute(
+            'SELECT id, monto_centavos, fecha FROM movimientos ORDER BY id'
+        ).fetchall() == [
+            (10, 1000000, int(datetime(2025, 5, 1, 9, 0).timestamp())),
+            (11, 30, int(datetime(2025, 5, 2, 10, 30).timestamp())),
+            (12, -150000, int(datetime(2025, 5, 3, 18, 15).timestamp())),
+        ]
+        assert conn.execute(
+            'SELECT monto_centavos, plazo, cuota_centavos, total_centavos, fecha FROM prestamos WHERE id = 5'
+        ).fetchone() == (10000000, 12, 1023576, 12282912, int(datetime(2025, 5, 4, 12, 0).timestamp()))
+
+        # Migrar de nuevo no cambia nada
+        assert migrations.migrate(conn) == migrations.MIGRATIONS[-1][0]
+        assert conn.execute('SELECT SUM(monto_centavos) FROM movimientos').fetchone()[0] == 850030
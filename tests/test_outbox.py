@@ -0,0 +1,97 @@
+"""Cola de salida: unión de mensajes por chat"""
+import asyncio
+from collections import deque
+
+import outbox
+
+
+class FakeBot:
+    def __init__(self):
+        self.enviados = []
+
+    async def send_message(self, chat_id, texto, reply_markup=None, parse_mode=None):
+        self.enviados.append(texto)
+        return texto
+
+
+def _mensaje(bot, texto, futuro=None):
+    return outbox._Mensaje(bot, texto, None, None, futuro)
+
+
+def test_agrupar_une_mensajes_seguidos():
+    bot = FakeBot()
+    pendientes = deque([_mensaje(bot, "a"), _mensaje(bot, "b")])
+    grupo, texto, _markup = outbox.agrupar(pendientes)
+    assert len(grupo) == 2
+    assert texto == "a" + outbox.SEPARADOR + "b"
+
+
+def test_agrupar_no_une_mensajes_con_futuro():
+    bot = FakeBot()
+    futuro = object()
+    pendientes = deque([_mensaje(bot, "a"), _mensaje(bot, "pensando", futuro), _mensaje(bot, "c")])
+    assert outbox.agrupar(pendientes)[1] == "a"
+    assert outbox.agrupar(pendientes)[1] == "pensando"
+    assert outbox.agrupar(pendientes)[1] == "c"
+
+
+def test_el_futuro_recibe_solo_su_mensaje():
+    async def escenario():
+        bot = FakeBot()
+        cola = outbox.Outbox(global_rate=0, chat_rate=1000, chat_burst=1, workers=1)
+        cola.send(bot, 1, "respuesta /saldo")
+        cola.send(bot, 1, "respuesta /ayuda")
+        futuro = cola.send(bot, 1, "✍️ Pensando...", wait=True)
+        enviado = await futuro
+        await cola.close()
+        return bot.enviados, enviado
+
+    enviados, enviado = asyncio.run(escenario())
+    assert enviado == "✍️ Pensando..."
+    # Las respuestas anteriores se unen entre sí, pero no con el mensaje que se va a editar
+    assert enviados == ["respuesta /saldo" + outbox.SEPARADOR + "respuesta /ayuda", "✍️ Pensando..."]
+
+
+class BotQueFalla(FakeBot):
+    """Falla con una excepción ajena a Telegram en el primer envío"""
+
+    async def send_message(self, chat_id, texto, reply_markup=None, parse_mode=None):
+        if not self.enviados and texto == "roto":
+            self.enviados.append(None)
+            raise ValueError("respuesta inesperada")
+        return await super().send_message(chat_id, texto, reply_markup, parse_mode)
+
+
+def test_error_inesperado_no_traba_el_chat():
+    async def escenario():
+        bot = BotQueFalla()
+        cola = outbox.Outbox(global_rate=0, chat_rate=0, workers=1)
+        roto = cola.send(bot, 1, "roto", wait=True)
+        try:
+            await asyncio.wait_for(roto, 1)
+        except ValueError as e:
+            error = e
+        # El trabajador sigue vivo y el chat vuelve a atenderse
+        siguiente = await asyncio.wait_for(cola.send(bot, 1, "después", wait=True), 1)
+        await asyncio.wait_for(cola.flush(), 1)
+        pendientes = cola.pending()
+        await cola.close()
+        return error, siguiente, pendientes
+
+    error, siguiente, pendientes = asyncio.run(escenario())
+    assert isinstance(error, ValueError)
+    assert siguiente == "después"
+    assert pendientes == 0
+
+
+def test_reservar_espera_una_ficha_del_bucket_global():
+    async def escenario():
+        cola = outbox.Outbox(global_rate=20, workers=1)
+        loop = asyncio.get_running_loop()
+        inicio = loop.time()
+        for _ in range(22):
+            await cola.reservar()
+        return loop.time() - inicio
+
+    # 20 fichas de entrada y las otras dos a 20 por segundo
+    assert asyncio.run(escenario()) >= 0.09
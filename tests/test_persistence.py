@@ -0,0 +1,43 @@
+"""Persistencia de sesiones en SQLite"""
+import asyncio
+import time
+
+from persistence import SQLitePersistence
+
+
+class FakeApplication:
+    def __init__(self):
+        self.user_data = {}
+
+    def drop_user_data(self, user_id):
+        self.user_data.pop(user_id, None)
+
+
+def test_purga_libera_usuarios_inactivos(base):
+    async def escenario():
+        persistencia = SQLitePersistence(ttl=60, update_interval=3600)
+        aplicacion = FakeApplication()
+        persistencia.set_application(aplicacion)
+        datos = aplicacion.user_data[1] = {}
+        await persistencia.refresh_user_data(1, datos)
+        datos["autenticado"] = True
+        await persistencia.update_user_data(1, datos)
+        assert 1 in persistencia._persistido
+
+        # El usuario queda inactivo más allá del TTL
+        persistencia._ultimo_acceso[1] = time.time() - 120
+        with base.get_pool().connection() as conn:
+            conn.execute("UPDATE sesiones SET actualizado = actualizado - 120")
+            conn.commit()
+        persistencia._ultima_purga = 0
+        await persistencia._purgar()
+        assert persistencia.stats()["usuarios"] == 0
+        assert 1 not in persistencia._versiones
+        assert 1 not in persistencia._persistido
+        assert aplicacion.user_data == {}
+
+        # Al volver, la sesión en memoria se trata como vencida
+        await persistencia.refresh_user_data(1, datos)
+        return datos
+
+    assert asyncio.run(escenario()) == {}
@@ -0,0 +1,52 @@
+"""Procesamiento concurrente de updates con orden por usuario"""
+import asyncio
+
+from telegram import Update
+
+from scheduler import PerUserUpdateProcessor
+
+
+def _update(update_id, user_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Prueba"},
+            "text": str(update_id),
+        },
+    }, None)
+
+
+def test_orden_por_usuario_y_descarte_por_profundidad():
+    async def escenario():
+        procesador = PerUserUpdateProcessor(workers=4, max_pending=100, max_per_user=3)
+        orden = []
+        liberar = asyncio.Event()
+
+        async def atender(update_id, user_id):
+            if update_id == 1:
+                # El primero del usuario 1 tarda: los siguientes esperan su turno
+                await liberar.wait()
+            orden.append((user_id, update_id))
+
+        tareas = [
+            asyncio.ensure_future(
+                procesador.do_process_update(_update(i, usuario), atender(i, usuario)))
+            for i, usuario in [(1, 1), (2, 1), (3, 2), (4, 1), (5, 1), (6, 1)]
+        ]
+        while len(orden) < 1:
+            await asyncio.sleep(0)
+        # El usuario 2 no espera al usuario 1
+        assert orden == [(2, 3)]
+        liberar.set()
+        await asyncio.gather(*tareas)
+        return orden, procesador.stats()
+
+    orden, stats = asyncio.run(escenario())
+    # Los updates 5 y 6 exceden max_per_user y se descartan
+    assert [update_id for usuario, update_id in orden if usuario == 1] == [1, 2, 4]
+    assert stats["descartados"] == 2
+    assert stats["procesados"] == 4
+    assert stats["pendientes"] == 0
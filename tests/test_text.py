@@ -0,0 +1,30 @@
+"""Normalización de consultas para la caché de respuestas"""
+from text import exact_terms, normalize_question
+
+
+def test_normaliza_tildes_signos_y_palabras_vacias():
+    assert normalize_question("¿Qué tarjetas ofrecen?") == normalize_question("que tarjetas ofrecen")
+
+
+def test_conserva_negaciones():
+    assert normalize_question("cuotas sin interés") != normalize_question("cuotas con interés")
+    assert normalize_question("¿me conviene?") != normalize_question("¿no me conviene?")
+
+
+def test_terminos_exactos():
+    assert exact_terms(normalize_question("plazo fijo de 100000 a 30 días")) == ("100000", "30")
+    assert exact_terms(normalize_question("cuotas sin interés")) == ("sin",)
+
+
+def test_conserva_interrogativos():
+    pares = [
+        ("¿Cómo pido una tarjeta?", "¿Dónde pido una tarjeta?"),
+        ("¿Qué tarjeta me conviene?", "¿Cuál tarjeta me conviene?"),
+        ("¿Por qué subió la tasa?", "¿Cuándo subió la tasa?"),
+        ("¿Si pido un préstamo?", "pido un préstamo"),
+    ]
+    for una, otra in pares:
+        clave, otra_clave = normalize_question(una), normalize_question(otra)
+        assert clave != otra_clave
+        # Tampoco se confunden en la búsqueda aproximada
+        assert exact_terms(clave) != exact_terms(otra_clave)
@@ -0,0 +1,33 @@
+"""Caché de lectura de usuarios"""
+import pytest
+
+
+@pytest.fixture
+def con_cache(base, monkeypatch):
+    monkeypatch.setattr(base, "USER_CACHE_ENABLED", True)
+    return base
+
+
+def test_guarda_la_lectura_y_la_descarta_al_escribir(con_cache):
+    base = con_cache
+    assert base.create_user(1)
+    usuario = base._select_user(1)
+    assert base._usuarios.get(1) == usuario
+
+    base.invalidate_user(1)
+    assert base._usuarios.get(1) is None
+
+
+def test_no_guarda_una_lectura_que_se_cruza_con_una_escritura(con_cache, monkeypatch):
+    base = con_cache
+    assert base.create_user(1)
+    construir = base.Usuario
+
+    def usuario_leido_durante_una_escritura(*fila):
+        # Otra escritura confirma e invalida entre el SELECT y el guardado
+        base.invalidate_user(fila[0])
+        return construir(*fila)
+
+    monkeypatch.setattr(base, "Usuario", usuario_leido_durante_una_escritura)
+    assert base._select_user(1) is not None
+    assert base._usuarios.get(1) is None
@@ -0,0 +1,30 @@
+"""Alta de usuarios individual y masiva"""
+
+
+def _movimientos(base, user_id):
+    with base.get_pool().connection() as conn:
+        return conn.execute(
+            'SELECT COUNT(*) FROM movimientos WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+
+def test_create_user_no_repite_un_usuario_existente(base):
+    assert base.create_user(1, "Ana") is True
+    assert base.create_user(1, "Otro nombre") is False
+
+    usuario = base.get_user(1)
+    assert usuario.nombre == "Ana"
+    assert usuario.saldo_centavos == base.SALDO_INICIAL
+    assert _movimientos(base, 1) == len(base.MOVIMIENTOS_INICIALES)
+
+
+def test_create_users_omite_los_existentes(base):
+    assert base.create_user(1, "Ana")
+    creados = base.create_users([(1, "Ana"), (2, "Beto"), (3, "Caro")], chunk_size=2)
+    assert creados == 2
+
+    assert base.get_user(1).nombre == "Ana"
+    assert base.get_user(3).saldo_centavos == base.SALDO_INICIAL
+    for user_id in (1, 2, 3):
+        assert _movimientos(base, user_id) == len(base.MOVIMIENTOS_INICIALES)
+
+    assert base.create_users([(2, "Beto"), (3, "Caro")]) == 0
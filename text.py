@@ -0,0 +1,60 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+# Palabras vacías que no cambian el sentido de una consulta bancaria
+# ("no", "sin" y "con" sí lo cambian: "cuotas sin interés" no es "con interés";
+# tampoco son vacíos los interrogativos: "cómo pido" no es "dónde pido")
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante
+de del desde el ella ellas ellos en entre era es esa ese eso esta
+este esto estos estas favor fue ha hay la las le les lo los me mi mis muy
+nos o para pero por porfa quiero quisiera saber se
+sobre son su sus te tenes tienen ti tu tus un una uno unos unas usted
+ustedes vos y ya yo hola gracias decime dime podes puedes podrias
+""".split())
+
+# Cambia cuando normalize_question da claves distintas (invalida la caché persistida)
+NORMALIZATION_VERSION = 3
+
+# Palabras que invierten o acotan el sentido, e interrogativos; deben
+# coincidir exactamente
+TERMINOS_EXACTOS = frozenset("""
+no sin con ni nunca mas menos
+que como cual cuales donde cuando cuanto cuanta cuantos cuantas porque si
+""".split())
+
+_MARCAS = re.compile("[\u0300-\u036f]")
+_NO_ALFANUMERICO = re.compile(r"[^a-z0-9ñ\s]")
+_ESPACIOS = re.compile(r"\s+")
+
+
+def strip_accents(texto):
+    """Quita tildes y diéresis conservando la ñ"""
+    texto = texto.replace("ñ", "\0").replace("Ñ", "\1")
+    sin_tildes = _MARCAS.sub("", unicodedata.normalize("NFD", texto))
+    return sin_tildes.replace("\0", "ñ").replace("\1", "Ñ")
+
+
+def normalize_question(texto):
+    """
+    Forma normalizada de una consulta para usar como clave de caché
+
+    Pasa a minúsculas, quita tildes, signos de puntuación y palabras vacías.
+    "¿Qué tarjetas ofrecen?" y "que tarjetas ofrecen" dan el mismo resultado.
+    """
+    texto = strip_accents(texto.lower())
+    texto = _NO_ALFANUMERICO.sub(" ", texto)
+    palabras = [p for p in _ESPACIOS.split(texto) if p and p not in STOPWORDS]
+    return " ".join(palabras)
+
+
+@lru_cache(maxsize=4096)
+def exact_terms(clave):
+    """
+    Números y palabras de TERMINOS_EXACTOS de una consulta normalizada
+
+    Dos consultas parecidas sólo comparten respuesta si estos términos son
+    iguales: "plazo fijo 100000 30 dias" no es "plazo fijo 500000 30 dias".
+    """
+    return tuple(p for p in clave.split() if p in TERMINOS_EXACTOS or any(c.isdigit() for c in p))